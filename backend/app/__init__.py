@@ -56,7 +56,9 @@ def create_app():
             WhatsAppConnection, WhatsAppContact, MessageLog, ScheduledMessage,
             AutomacaoRecall, CRMStage, CRMCard, CRMHistory,
             # ✅ NOVOS MODELS DE MARKETING
-            Campaign, Lead, LeadEvent
+            Campaign, Lead, LeadEvent,
+            # ✅ Infra (filas / workers)
+            WebhookEvent, WebhookMessageId, SchedulerLease, BookingLock,
         )
 
         # Cria as tabelas se não existirem (Segurança para SQLite/Dev)
@@ -68,6 +70,13 @@ def create_app():
         except Exception as e:
             logger.warning(f"⚠️ Aviso ao verificar banco: {e}")
 
+        # ✅ Tabelas de infraestrutura (create_all acima só roda em banco vazio)
+        for model in (WebhookEvent, WebhookMessageId, SchedulerLease, BookingLock):
+            try:
+                model.__table__.create(bind=db.engine, checkfirst=True)
+            except Exception as e:
+                logger.warning(f"⚠️ Falha ao criar tabela {model.__tablename__}: {e}")
+
         # ✅ Hotfix de schema (Postgres em produção / SQLite local)
         try:
             dialect = db.engine.dialect.name
@@ -97,6 +106,7 @@ def create_app():
                     "ALTER TABLE clinics ADD COLUMN IF NOT EXISTS ai_system_prompt TEXT;",
                     "ALTER TABLE clinics ADD COLUMN IF NOT EXISTS ai_procedures JSONB;",
                     "ALTER TABLE clinics ADD COLUMN IF NOT EXISTS ai_booking_policy TEXT;",
+                    "ALTER TABLE clinics ADD COLUMN IF NOT EXISTS business_hours JSONB;",
 
                     # Chat sessions (máquina de estados)
                     """
@@ -111,6 +121,22 @@ def create_app():
                         UNIQUE(clinic_id, sender_id)
                     );
                     """,
+
+                    # Fila do webhook: ordem por conversa
+                    "ALTER TABLE webhook_events ADD COLUMN IF NOT EXISTS conversation_key VARCHAR(120);",
+                    "CREATE INDEX IF NOT EXISTS ix_webhook_events_conversation_status ON webhook_events (conversation_key, status);",
+                    "ALTER TABLE webhook_events ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP WITHOUT TIME ZONE;",
+
+                    # Fila de envio (scheduled_messages)
+                    "ALTER TABLE scheduled_messages ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;",
+                    "ALTER TABLE scheduled_messages ADD COLUMN IF NOT EXISTS locked_at TIMESTAMP WITHOUT TIME ZONE;",
+                    "ALTER TABLE scheduled_messages ADD COLUMN IF NOT EXISTS sent_at TIMESTAMP WITHOUT TIME ZONE;",
+                    "CREATE INDEX IF NOT EXISTS ix_scheduled_messages_status_run_at ON scheduled_messages (status, run_at);",
+
+                    # Recall: próximo disparo indexado
+                    "ALTER TABLE automacoes_recall ADD COLUMN IF NOT EXISTS next_run_at TIMESTAMP WITHOUT TIME ZONE;",
+                    "ALTER TABLE automacoes_recall ADD COLUMN IF NOT EXISTS last_run_at TIMESTAMP WITHOUT TIME ZONE;",
+                    "CREATE INDEX IF NOT EXISTS ix_automacoes_recall_next_run_at ON automacoes_recall (next_run_at);",
                 ]
 
                 for stmt in schema_fixes:
@@ -131,6 +157,7 @@ def create_app():
                     "ai_system_prompt": "TEXT",
                     "ai_procedures": "TEXT",
                     "ai_booking_policy": "TEXT",
+                    "business_hours": "TEXT",
                 }
 
                 for col, coldef in sqlite_columns.items():
@@ -142,6 +169,47 @@ def create_app():
                         db.session.rollback()
                         logger.warning(f"⚠️ SQLite schema fix falhou para clinics.{col}: {e}")
 
+                # Tabelas de infra: colunas adicionadas depois da criação
+                sqlite_infra_columns = {
+                    ("webhook_events", "conversation_key"): "VARCHAR(120)",
+                    ("webhook_events", "next_attempt_at"): "DATETIME",
+                    ("scheduled_messages", "attempts"): "INTEGER NOT NULL DEFAULT 0",
+                    ("scheduled_messages", "locked_at"): "DATETIME",
+                    ("scheduled_messages", "sent_at"): "DATETIME",
+                    ("automacoes_recall", "next_run_at"): "DATETIME",
+                    ("automacoes_recall", "last_run_at"): "DATETIME",
+                }
+
+                for (table, col), coldef in sqlite_infra_columns.items():
+                    try:
+                        if not _sqlite_column_exists(table, col):
+                            db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {col} {coldef};"))
+                            db.session.commit()
+                    except Exception as e:
+                        db.session.rollback()
+                        logger.warning(f"⚠️ SQLite schema fix falhou para {table}.{col}: {e}")
+
+                sqlite_infra_indexes = [
+                    "CREATE INDEX IF NOT EXISTS ix_scheduled_messages_status_run_at ON scheduled_messages (status, run_at);",
+                    "CREATE INDEX IF NOT EXISTS ix_automacoes_recall_next_run_at ON automacoes_recall (next_run_at);",
+                ]
+
+                for stmt in sqlite_infra_indexes:
+                    try:
+                        db.session.execute(text(stmt))
+                        db.session.commit()
+                    except Exception as e:
+                        db.session.rollback()
+                        logger.warning(f"⚠️ SQLite schema fix falhou: {e}")
+
+                # busca de pacientes: FTS5 trigram (única origem da DDL; a migração 0003 não mexe nisso)
+                try:
+                    from app.services.patient_search import ensure_sqlite_fts
+                    ensure_sqlite_fts()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.warning(f"⚠️ SQLite FTS de pacientes indisponível (busca cai no LIKE): {e}")
+
                 # chat_sessions: cria tabela se necessário
                 try:
                     db.session.execute(
@@ -192,6 +260,9 @@ def create_app():
     from .routes.team_routes import team_bp
     app.register_blueprint(team_bp, url_prefix="/api")
 
+    from .routes.scheduler_routes import scheduler_bp
+    app.register_blueprint(scheduler_bp, url_prefix="/api")
+
     # ✅ Evolution Functions (para o Evolution salvar o OpenAI Bot)
     # IMPORT RELATIVO CORRETO + INDENTAÇÃO CORRETA
     from .routes.evolution_routes import evolution_bp
@@ -28,6 +28,10 @@ class Clinic(db.Model):
     ai_procedures = db.Column(db.JSON, nullable=True)  # {"limpeza": {"desc": "...", "dur": 30}, ...}
     ai_booking_policy = db.Column(db.Text, nullable=True)
 
+    # Agenda: turnos por dia da semana {"seg": [["08:00", "12:00"], ["13:00", "18:00"]], ..., "dom": []}
+    # (vazio = segunda a sábado, 08:00–19:00)
+    business_hours = db.Column(db.JSON, nullable=True)
+
     plan_type = db.Column(db.String(20), default="Bronze")
     max_dentists = db.Column(db.Integer, default=1)
     is_active = db.Column(db.Boolean, default=True)
@@ -111,6 +115,19 @@ class Patient(db.Model):
     whatsapp_contacts = db.relationship("WhatsAppContact", backref="patient", lazy=True)
     crm_cards = db.relationship("CRMCard", backref="patient", lazy=True)
 
+    # ⚡ índices multi-tenant (migração 0001_hot_query_indexes)
+    __table_args__ = (
+        db.Index("ix_patients_clinic_phone", "clinic_id", "phone"),
+        # listagem paginada por (name, id) (migração 0003_patient_search)
+        db.Index("ix_patients_clinic_name", "clinic_id", "name", "id"),
+        # recall: só pacientes ativos que aceitam marketing
+        db.Index(
+            "ix_patients_clinic_recall", "clinic_id", "last_visit",
+            postgresql_where=db.text("status = 'ativo' AND receive_marketing = true"),
+            sqlite_where=db.text("status = 'ativo' AND receive_marketing = 1"),
+        ),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -163,6 +180,17 @@ class Appointment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # ⚡ índices multi-tenant (migração 0001_hot_query_indexes)
+    __table_args__ = (
+        db.Index("ix_appointments_clinic_start", "clinic_id", "start_datetime"),
+        # disponibilidade / conflito: cobre início e fim dos não cancelados
+        db.Index(
+            "ix_appointments_clinic_active_span", "clinic_id", "start_datetime", "end_datetime",
+            postgresql_where=db.text("status <> 'cancelled'"),
+            sqlite_where=db.text("status <> 'cancelled'"),
+        ),
+    )
+
     # Back-compatibility fields (optional, but keeping for safety if used elsewhere)
     @property
     def date_time(self):
@@ -204,6 +232,34 @@ class Transaction(db.Model):
 
     clinic_id = db.Column(db.Integer, db.ForeignKey("clinics.id"), nullable=False)
 
+    # ⚡ índices multi-tenant (migração 0001_hot_query_indexes)
+    __table_args__ = (
+        db.Index("ix_transactions_clinic_date", "clinic_id", "date"),
+    )
+
+
+class FinancialDailyRollup(db.Model):
+    """Soma/contagem de transações por clínica, dia (UTC), tipo e categoria.
+
+    Mantida incrementalmente em `add_transaction` (app/services/financial.py),
+    reconstruída por `backfill_financial_rollup.py` e conferida contra as
+    transações pelo scheduler. Resumo e dashboard leem daqui.
+    """
+    __tablename__ = "financial_daily_rollup"
+    id = db.Column(db.Integer, primary_key=True)
+
+    clinic_id = db.Column(db.Integer, db.ForeignKey("clinics.id"), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    type = db.Column(db.String(20), nullable=False)  # income | expense
+    category = db.Column(db.String(50), nullable=False, default="Outros")
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("clinic_id", "day", "type", "category", name="uq_financial_rollup_key"),
+    )
+
 
 # =========================================================
 # 7) WHATSAPP / MARKETING CORE
@@ -262,10 +318,16 @@ class ScheduledMessage(db.Model):
     type = db.Column(db.String(50), nullable=False)
     payload = db.Column(db.JSON, nullable=False)
     run_at = db.Column(db.DateTime, nullable=False, index=True)
-    status = db.Column(db.String(20), nullable=False, default="pending")
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending | sending | sent | failed | cancelled
     fail_reason = db.Column(db.String(255), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     contact = db.relationship("WhatsAppContact", backref=db.backref("scheduled", lazy=True))
+    __table_args__ = (
+        db.Index("ix_scheduled_messages_status_run_at", "status", "run_at"),
+    )
 
 
 # ✅ NOVA TABELA: Sessões de Chat para Máquina de Estados
@@ -299,6 +361,9 @@ class AutomacaoRecall(db.Model):
     horario_disparo = db.Column(db.String(5))
     mensagem_template = db.Column(db.Text)
     ativo = db.Column(db.Boolean, default=True)
+    # próximo disparo em UTC (calculado a partir do horário de Brasília)
+    next_run_at = db.Column(db.DateTime, nullable=True, index=True)
+    last_run_at = db.Column(db.DateTime, nullable=True)
 
 
 class CRMStage(db.Model):
@@ -332,6 +397,16 @@ class CRMCard(db.Model):
     history = db.relationship("CRMHistory", backref="card", lazy=True)
     stage = db.relationship("CRMStage", backref="cards", lazy=True)
 
+    # ⚡ índices multi-tenant (migração 0001_hot_query_indexes)
+    __table_args__ = (
+        # webhook / chatbot: card aberto do telefone
+        db.Index(
+            "ix_crm_cards_clinic_phone_open", "clinic_id", "paciente_phone",
+            postgresql_where=db.text("status = 'open'"),
+            sqlite_where=db.text("status = 'open'"),
+        ),
+    )
+
 
 class CRMHistory(db.Model):
     __tablename__ = 'crm_history'
@@ -398,6 +473,17 @@ class Lead(db.Model):
     is_deleted = db.Column(db.Boolean, default=False, nullable=False)
     deleted_at = db.Column(db.DateTime, nullable=True)
 
+    # ⚡ índices multi-tenant (migração 0001_hot_query_indexes)
+    __table_args__ = (
+        db.Index("ix_marketing_leads_clinic_phone", "clinic_id", "phone"),
+        # listagem de leads (sem os apagados), mais recentes primeiro
+        db.Index(
+            "ix_marketing_leads_clinic_created_active", "clinic_id", "created_at",
+            postgresql_where=db.text("is_deleted = false"),
+            sqlite_where=db.text("is_deleted = 0"),
+        ),
+    )
+
 
 class LeadEvent(db.Model):
     __tablename__ = 'marketing_lead_events'
@@ -409,3 +495,69 @@ class LeadEvent(db.Model):
     event_type = db.Column(db.String(50)) # 'click', 'msg_in', 'status_change'
     metadata_json = db.Column(db.JSON)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# =========================================================
+# 10) INFRA: FILA DE INGESTÃO DO WEBHOOK
+# =========================================================
+class WebhookEvent(db.Model):
+    """Evento bruto recebido no /webhook/whatsapp, drenado pelos workers em background."""
+    __tablename__ = 'webhook_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(30), nullable=False, default='whatsapp')
+    payload = db.Column(db.JSON, nullable=False)
+    # instância/dono + telefone: eventos da mesma conversa são processados em ordem
+    conversation_key = db.Column(db.String(120), nullable=True)
+
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending | processing | done | failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(255), nullable=True)
+    # retry com backoff: só volta a ser reivindicado depois disso
+    next_attempt_at = db.Column(db.DateTime, nullable=True)
+
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_webhook_events_status_received', 'status', 'received_at'),
+        db.Index('ix_webhook_events_conversation_status', 'conversation_key', 'status'),
+    )
+
+
+class WebhookMessageId(db.Model):
+    """Ids de mensagem (key.id) já aceitos no webhook: retentativas do Evolution são descartadas."""
+    __tablename__ = 'webhook_message_ids'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # instância/dono + key.id
+    dedupe_key = db.Column(db.String(200), nullable=False, unique=True)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+# =========================================================
+# 11) INFRA: LÍDER DO SCHEDULER
+# =========================================================
+class SchedulerLease(db.Model):
+    """Quem está com a liderança de um job (o lock em si é advisory lock / file lock)."""
+    __tablename__ = 'scheduler_leases'
+
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(120), nullable=False)  # host:pid
+    lock_mode = db.Column(db.String(20), nullable=False)  # pg_advisory | file
+    acquired_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    heartbeat_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+# =========================================================
+# 12) INFRA: LOCK DA AGENDA
+# =========================================================
+class BookingLock(db.Model):
+    """Uma linha por clínica: quem vai gravar agendamento atualiza a linha primeiro (lock de
+    linha no Postgres / lock de escrita no SQLite) e só então confere conflito e grava."""
+    __tablename__ = 'booking_locks'
+
+    clinic_id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -1,11 +1,26 @@
+import os
+
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime, timedelta
 
-from app.models import db, Appointment, Patient, User, Lead
+from app.models import db, Appointment, Patient, User, Lead, Clinic
+from app.services.availability import (
+    AvailabilityIndex,
+    MIN_DURATION_MINUTES,
+    business_hours_to_json,
+    parse_business_hours,
+    to_agenda_time,
+)
+from app.services.booking import SlotUnavailable, reserve_slot
+from app.services.clinic_cache import invalidate_clinic
 
 agenda_bp = Blueprint('agenda_bp', __name__)
 
+# janela máxima de GET /appointments/availability (dias)
+AVAILABILITY_MAX_DAYS = int(os.getenv("AVAILABILITY_MAX_DAYS", "93"))
+AVAILABILITY_DEFAULT_DAYS = 7
+
 # ------------------------------------------------------------------------------
 # Helpers
 # ------------------------------------------------------------------------------
@@ -111,6 +126,78 @@ def _appt_to_dict(appt: Appointment, include_relations: bool = False):
     return base
 
 
+# Listagem: colunas projetadas (sem montar objetos ORM) e relações no mesmo SELECT via LEFT JOIN
+_APPT_LIST_COLUMNS = (
+    Appointment.id,
+    Appointment.clinic_id,
+    Appointment.patient_id,
+    Appointment.lead_id,
+    Appointment.title,
+    Appointment.description,
+    Appointment.start_datetime,
+    Appointment.end_datetime,
+    Appointment.status,
+    Appointment.created_at,
+)
+_APPT_RELATION_COLUMNS = (
+    Patient.id.label("patient_ref"),
+    Patient.name.label("patient_name"),
+    Patient.phone.label("patient_phone"),
+    Lead.id.label("lead_ref"),
+    Lead.name.label("lead_name"),
+    Lead.phone.label("lead_phone"),
+    Lead.campaign_id.label("lead_campaign_id"),
+    Lead.source.label("lead_source"),
+)
+
+
+def _appointment_rows(clinic_id: int, start_dt=None, end_dt=None, include_relations: bool = False):
+    """Uma consulta só (com ou sem paciente/lead), ordenada por início."""
+    columns = _APPT_LIST_COLUMNS + (_APPT_RELATION_COLUMNS if include_relations else ())
+    query = db.session.query(*columns).filter(Appointment.clinic_id == clinic_id)
+    if include_relations:
+        query = (
+            query.outerjoin(Patient, Patient.id == Appointment.patient_id)
+            .outerjoin(Lead, Lead.id == Appointment.lead_id)
+        )
+    if start_dt:
+        query = query.filter(Appointment.start_datetime >= start_dt)
+    if end_dt:
+        query = query.filter(Appointment.start_datetime <= end_dt)
+    return query.order_by(Appointment.start_datetime.asc()).all()
+
+
+def _appt_row_to_dict(row, include_relations: bool = False):
+    """Mesmo formato de `_appt_to_dict`, a partir de uma linha de `_appointment_rows`."""
+    base = {
+        "id": row.id,
+        "clinic_id": row.clinic_id,
+        "patient_id": row.patient_id,
+        "lead_id": row.lead_id,
+        "title": row.title,
+        "description": row.description,
+        "start": row.start_datetime.isoformat(),
+        "end": row.end_datetime.isoformat(),
+        "status": row.status,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+    }
+    if include_relations:
+        base["patient"] = {
+            "id": row.patient_ref,
+            "name": row.patient_name,
+            "phone": row.patient_phone,
+        } if row.patient_ref else None
+
+        base["lead"] = {
+            "id": row.lead_ref,
+            "name": row.lead_name,
+            "phone": row.lead_phone,
+            "campaign_id": row.lead_campaign_id,
+            "source": row.lead_source,
+        } if row.lead_ref else None
+    return base
+
+
 def _get_lead_id_from_payload(data: dict):
     """
     Compatibilidade:
@@ -141,20 +228,124 @@ def get_appointments():
 
     start_str = request.args.get('from')
     end_str = request.args.get('to')
-    include = (request.args.get("include") or "").lower() in ("1", "true", "yes")
+    include = (request.args.get("include") or "").lower() in ("1", "true", "yes", "relations")
 
-    query = Appointment.query.filter_by(clinic_id=clinic_id)
+    rows = _appointment_rows(
+        clinic_id, _safe_iso_datetime(start_str), _safe_iso_datetime(end_str), include_relations=include
+    )
+    return jsonify([_appt_row_to_dict(r, include_relations=include) for r in rows]), 200
 
-    start_dt = _safe_iso_datetime(start_str)
-    end_dt = _safe_iso_datetime(end_str)
 
-    if start_dt:
-        query = query.filter(Appointment.start_datetime >= start_dt)
-    if end_dt:
-        query = query.filter(Appointment.start_datetime <= end_dt)
+@agenda_bp.route('/appointments/availability', methods=['GET'])
+@jwt_required()
+def get_availability():
+    """
+    Trechos livres da agenda em [from, to) para encaixar `duration` minutos.
+
+    Uma consulta (início/fim dos agendamentos não cancelados da janela) +
+    varredura em memória: expediente da clínica menos os trechos em que
+    todos os dentistas (max_dentists) estão ocupados.
+    Query: from, to (ISO; só a data = dia inteiro), duration (min, padrão 30).
+    """
+    clinic_id = _get_clinic_id()
+    if not clinic_id:
+        return jsonify({"error": "clinic_id inválido no token"}), 401
+
+    start_str = (request.args.get('from') or "").strip()
+    end_str = (request.args.get('to') or "").strip()
+
+    if start_str:
+        start_dt = _safe_iso_datetime(start_str)
+        if not start_dt:
+            return jsonify({"error": "from inválido (use ISO: 2026-10-17 ou 2026-10-17T08:00)"}), 400
+    else:
+        start_dt = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if end_str:
+        end_dt = _safe_iso_datetime(end_str)
+        if not end_dt:
+            return jsonify({"error": "to inválido (use ISO: 2026-10-24 ou 2026-10-24T19:00)"}), 400
+        if len(end_str) == 10:
+            # só a data: inclui o dia inteiro
+            end_dt += timedelta(days=1)
+    else:
+        end_dt = start_dt + timedelta(days=AVAILABILITY_DEFAULT_DAYS)
 
-    appointments = query.order_by(Appointment.start_datetime.asc()).all()
-    return jsonify([_appt_to_dict(a, include_relations=include) for a in appointments]), 200
+    # mesmo critério do reserve_slot: "...Z" é convertido para SP, não só perde o fuso
+    start_dt = to_agenda_time(start_dt)
+    end_dt = to_agenda_time(end_dt)
+    if end_dt <= start_dt:
+        return jsonify({"error": "to deve ser depois de from"}), 400
+    if end_dt - start_dt > timedelta(days=AVAILABILITY_MAX_DAYS):
+        return jsonify({"error": f"janela máxima de {AVAILABILITY_MAX_DAYS} dias"}), 400
+
+    try:
+        duration = int(request.args.get('duration') or 30)
+    except (TypeError, ValueError):
+        return jsonify({"error": "duration inválido (minutos)"}), 400
+    if duration < MIN_DURATION_MINUTES:
+        return jsonify({"error": f"duration mínimo de {MIN_DURATION_MINUTES} minutos"}), 400
+
+    index = AvailabilityIndex.load_for_clinic(clinic_id, start_dt, end_dt)
+    free = index.free_intervals(start_dt, end_dt, min_minutes=duration)
+
+    return jsonify({
+        "from": start_dt.isoformat(),
+        "to": end_dt.isoformat(),
+        "duration_minutes": duration,
+        "capacity": index.capacity,
+        "business_hours": business_hours_to_json(index.hours),
+        "free": [
+            {"start": s.isoformat(), "end": e.isoformat(), "minutes": int((e - s).total_seconds() // 60)}
+            for s, e in free
+        ],
+    }), 200
+
+
+@agenda_bp.route('/appointments/business-hours', methods=['GET'])
+@jwt_required()
+def get_business_hours():
+    clinic_id = _get_clinic_id()
+    if not clinic_id:
+        return jsonify({"error": "clinic_id inválido no token"}), 401
+
+    clinic = Clinic.query.get(clinic_id)
+    if not clinic:
+        return jsonify({"error": "Clínica não encontrada"}), 404
+
+    try:
+        hours = parse_business_hours(getattr(clinic, "business_hours", None))
+    except ValueError:
+        hours = parse_business_hours(None)
+    return jsonify({"business_hours": business_hours_to_json(hours), "custom": bool(clinic.business_hours)}), 200
+
+
+@agenda_bp.route('/appointments/business-hours', methods=['PUT'])
+@jwt_required()
+def update_business_hours():
+    """Body: {"business_hours": {"seg": [["08:00", "12:00"], ["13:00", "18:00"]], ..., "dom": []}} (null = padrão)."""
+    clinic_id = _get_clinic_id()
+    if not clinic_id:
+        return jsonify({"error": "clinic_id inválido no token"}), 401
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict) or "business_hours" not in data:
+        return jsonify({"error": "business_hours é obrigatório"}), 400
+
+    clinic = Clinic.query.get(clinic_id)
+    if not clinic:
+        return jsonify({"error": "Clínica não encontrada"}), 404
+
+    raw = data.get("business_hours")
+    try:
+        hours = parse_business_hours(raw)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    clinic.business_hours = business_hours_to_json(hours) if raw else None
+    db.session.commit()
+    invalidate_clinic(clinic_id)
+    return jsonify({"business_hours": business_hours_to_json(hours), "custom": bool(raw)}), 200
 
 
 @agenda_bp.route('/appointments', methods=['POST'])
@@ -197,6 +388,10 @@ def create_appointment():
 
         end_dt = start_dt + timedelta(minutes=minutes)
 
+    # grava exatamente o horário que o reserve_slot confere (naive de SP)
+    start_dt = to_agenda_time(start_dt)
+    end_dt = to_agenda_time(end_dt)
+
     # ids
     patient_id = data.get("patient_id")
     try:
@@ -221,8 +416,14 @@ def create_appointment():
     title = (data.get('title') or data.get('patient_name') or "Agendamento").strip()
     description = (data.get('description') or data.get('procedure') or "").strip()
     status = (data.get('status') or "scheduled").strip()
+    # encaixe proposital acima da capacidade (ex: urgência): {"force": true}
+    force = bool(data.get("force"))
 
     try:
+        if status != "cancelled" and not force:
+            # trava a agenda da clínica até o commit: duas reservas simultâneas não pegam o mesmo horário
+            reserve_slot(clinic_id, start_dt, end_dt)
+
         new_appt = Appointment(
             clinic_id=clinic_id,
             patient_id=patient_id,
@@ -238,6 +439,10 @@ def create_appointment():
         db.session.commit()
         return jsonify(_appt_to_dict(new_appt, include_relations=True)), 201
 
+    except SlotUnavailable as e:
+        db.session.rollback()
+        return jsonify(e.to_dict()), 409
+
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": "Falha ao criar agendamento", "details": str(e)}), 400
@@ -255,18 +460,22 @@ def update_appointment(id):
     if not isinstance(data, dict):
         return jsonify({"error": "JSON inválido"}), 400
 
+    # antes da edição: decide se a agenda precisa ser conferida de novo
+    prev_span = (appt.start_datetime, appt.end_datetime)
+    prev_status = appt.status
+
     try:
         if 'start' in data or 'start_datetime' in data:
             start_dt = _safe_iso_datetime(data.get('start') or data.get('start_datetime'))
             if not start_dt:
                 return jsonify({"error": "start inválido"}), 400
-            appt.start_datetime = start_dt
+            appt.start_datetime = to_agenda_time(start_dt)
 
         if 'end' in data or 'end_datetime' in data:
             end_dt = _safe_iso_datetime(data.get('end') or data.get('end_datetime'))
             if not end_dt:
                 return jsonify({"error": "end inválido"}), 400
-            appt.end_datetime = end_dt
+            appt.end_datetime = to_agenda_time(end_dt)
 
         if 'title' in data:
             appt.title = (data.get('title') or "").strip()
@@ -299,9 +508,20 @@ def update_appointment(id):
                     return jsonify({"error": "lead_id não encontrado para esta clínica"}), 400
             appt.lead_id = lid
 
+        # mudou horário (ou voltou de cancelado): confere a agenda com lock até o commit.
+        # Só status (concluído, faltou...) não reconfere: sobreposições antigas não travam a baixa.
+        moved = (appt.start_datetime, appt.end_datetime) != prev_span
+        reactivated = prev_status == "cancelled" and appt.status != "cancelled"
+        if (moved or reactivated) and appt.status != "cancelled" and not data.get("force"):
+            reserve_slot(clinic_id, appt.start_datetime, appt.end_datetime, exclude_appointment_id=appt.id)
+
         db.session.commit()
         return jsonify(_appt_to_dict(appt, include_relations=True)), 200
 
+    except SlotUnavailable as e:
+        db.session.rollback()
+        return jsonify(e.to_dict()), 409
+
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": "Falha ao atualizar agendamento", "details": str(e)}), 400
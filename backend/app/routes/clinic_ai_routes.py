@@ -1,5 +1,6 @@
 from flask import Blueprint, jsonify, request
 from app.models import db, User, Clinic, ClinicAISettings
+from app.services.clinic_cache import invalidate_clinic
 from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
 from datetime import datetime
 
@@ -227,4 +228,5 @@ def update_ai_settings():
         settings.business_rules_json = data["business_rules_json"]
 
     db.session.commit()
+    invalidate_clinic(clinic.id)
     return jsonify(_ai_settings_to_dict(settings)), 200
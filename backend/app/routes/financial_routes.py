@@ -1,41 +1,57 @@
 from flask import Blueprint, jsonify, request
 from app.models import db, Transaction, User
+from app.services.financial import (
+    EXPENSE, INCOME, apply_to_rollup, by_category, by_month, recent_transactions, totals_by_type,
+)
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from datetime import datetime
+from datetime import datetime, timedelta
 
 financial_bp = Blueprint('financial_bp', __name__)
 
+
+def _parse_period_bound(value, end=False):
+    """'2026-10-01' ou ISO completo. Só a data no `to` = inclui o dia inteiro."""
+    if not value:
+        return None
+    dt = datetime.fromisoformat(value.strip())
+    if end and len(value.strip()) == 10:
+        dt += timedelta(days=1)
+    return dt.replace(tzinfo=None)
+
+
 # 1. OBTER RESUMO FINANCEIRO (DASHBOARD)
+# ?from=&to= (opcionais) e ?breakdown=category,month para as quebras
 @financial_bp.route('/financial/summary', methods=['GET'])
 @jwt_required()
 def get_financial_summary():
     user = User.query.get(get_jwt_identity())
-    
-    # Filtra apenas transações da clínica do usuário logado
-    transactions = Transaction.query.filter_by(clinic_id=user.clinic_id).all()
-    
-    total_receita = sum(t.amount for t in transactions if t.type == 'income')
-    total_despesas = sum(t.amount for t in transactions if t.type == 'expense')
+
+    try:
+        start = _parse_period_bound(request.args.get('from'))
+        end = _parse_period_bound(request.args.get('to'), end=True)
+    except ValueError:
+        return jsonify({'error': 'Período inválido (use YYYY-MM-DD)'}), 400
+
+    # Somas pelo rollup diário, últimas 20 direto no banco (filtradas pela clínica do usuário logado)
+    totals = totals_by_type(user.clinic_id, start, end)
+    total_receita = totals[INCOME]['total']
+    total_despesas = totals[EXPENSE]['total']
     lucro = total_receita - total_despesas
-    
-    # Pegar as últimas 20 transações para a tabela
-    recent_transactions = []
-    for t in sorted(transactions, key=lambda x: x.date, reverse=True)[:20]:
-        recent_transactions.append({
-            'id': t.id,
-            'description': t.description,
-            'amount': t.amount,
-            'type': t.type,
-            'category': t.category,
-            'date': t.date.strftime('%Y-%m-%d')  # Formatado para string legível
-        })
 
-    return jsonify({
+    result = {
         'receita': total_receita,
         'despesas': total_despesas,
         'lucro': lucro,
-        'transactions': recent_transactions
-    }), 200
+        'transactions': recent_transactions(user.clinic_id, start, end, limit=20),
+    }
+
+    breakdown = {b.strip() for b in (request.args.get('breakdown') or '').split(',') if b.strip()}
+    if 'category' in breakdown:
+        result['por_categoria'] = by_category(user.clinic_id, start, end)
+    if 'month' in breakdown:
+        result['por_mes'] = by_month(user.clinic_id, start, end)
+
+    return jsonify(result), 200
 
 # 2. LANÇAR TRANSAÇÃO (Receita ou Despesa)
 # CORREÇÃO: A rota agora bate com o que o Frontend chama (/financial/transaction)
@@ -63,6 +79,8 @@ def add_transaction():
         )
         
         db.session.add(new_transaction)
+        # rollup diário atualizado na mesma transação (resumo e dashboard leem dele)
+        apply_to_rollup(new_transaction)
         db.session.commit()
         
         return jsonify({'message': 'Transação salva com sucesso!', 'id': new_transaction.id}), 201
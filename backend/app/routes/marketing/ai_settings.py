@@ -2,6 +2,7 @@ from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from app.models import db, Clinic
+from app.services.clinic_cache import invalidate_clinic
 
 bp = Blueprint("marketing_ai", __name__)
 
@@ -68,4 +69,5 @@ def update_ai_settings():
         clinic.ai_booking_policy = (data.get("ai_booking_policy") or "").strip() or None
 
     db.session.commit()
+    invalidate_clinic(clinic_id)
     return jsonify({"success": True}), 200
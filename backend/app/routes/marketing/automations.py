@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models import db, AutomacaoRecall, CRMStage, CRMCard, Patient, Lead, Campaign
+from app.services.crm_stages import BOARD_DEFAULT_STAGES, ensure_stages
+from app.services.recall_schedule import notify_recall_changed, refresh_next_run
 from datetime import datetime
 
 bp = Blueprint("marketing_automations", __name__)
@@ -57,7 +59,8 @@ def list_automations():
         "dias_ausente": r.dias_ausente,
         "horario": r.horario_disparo,
         "mensagem": r.mensagem_template,
-        "ativo": bool(r.ativo)
+        "ativo": bool(r.ativo),
+        "proxima_execucao": r.next_run_at.isoformat() if r.next_run_at else None
     } for r in regras]), 200
 
 
@@ -85,9 +88,11 @@ def create_automation():
         mensagem_template=mensagem,
         ativo=True
     )
+    refresh_next_run(nova_regra)
 
     db.session.add(nova_regra)
     db.session.commit()
+    notify_recall_changed()
 
     return jsonify({"message": "Regra criada com sucesso!", "id": nova_regra.id}), 201
 
@@ -125,7 +130,11 @@ def update_automation(id):
     if "ativo" in data:
         regra.ativo = bool(data.get("ativo"))
 
+    if "horario" in data or "ativo" in data:
+        refresh_next_run(regra)
+
     db.session.commit()
+    notify_recall_changed()
 
     return jsonify({
         "message": "Regra atualizada",
@@ -161,22 +170,7 @@ def get_crm_board():
     estagios = CRMStage.query.filter_by(clinic_id=clinic_id).order_by(CRMStage.ordem).all()
 
     if not estagios:
-        padroes = [
-            {"nome": "A Contactar", "cor": "yellow", "ordem": 1, "is_initial": True},
-            {"nome": "Aguardando Resposta", "cor": "blue", "ordem": 2},
-            {"nome": "Agendado", "cor": "green", "ordem": 3, "is_success": True},
-            {"nome": "Perdido", "cor": "red", "ordem": 4}
-        ]
-        for p in padroes:
-            db.session.add(CRMStage(
-                clinic_id=clinic_id,
-                nome=p["nome"],
-                cor=p["cor"],
-                ordem=p["ordem"],
-                is_initial=p.get("is_initial", False),
-                is_success=p.get("is_success", False)
-            ))
-        db.session.commit()
+        ensure_stages(clinic_id, BOARD_DEFAULT_STAGES)
         estagios = CRMStage.query.filter_by(clinic_id=clinic_id).order_by(CRMStage.ordem).all()
 
     stage_ids = [e.id for e in estagios]
@@ -1,18 +1,23 @@
 import logging
-import json
 import uuid
-import re
 import os
+import time
 from datetime import datetime, timedelta
 
 # ✅ timezone robusto (Python 3.9+)
 from zoneinfo import ZoneInfo
 
-from app.models import db, ChatSession, Appointment, Patient, Lead, Clinic, CRMCard, CRMStage
+from app.models import db, ChatSession, Appointment, Patient, Lead, CRMCard
+from .intents import INTENT_NO, INTENT_RESCHEDULE, INTENT_SCHEDULE, INTENT_YES, analyze_message
 from .webhook import _send_whatsapp_reply
 
 # ✅ Serviço central de IA (OpenAI)
-from app.services.ai_client import chat_reply
+from app.services.ai_client import AIDeadlineExceeded, chat_reply_with_deadline, record_time_to_first_message
+from app.services.ai_response_cache import get_cached_reply, is_cacheable_question, store_reply
+from app.services.booking import SlotUnavailable, reserve_slot
+from app.services.clinic_cache import get_clinic_snapshot
+from app.services.crm_stages import get_stage_registry
+from app.services.prompt_builder import build_chat_messages, compile_prompt
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +28,11 @@ TZ_SP = ZoneInfo("America/Sao_Paulo")
 # ------------------------------------------------------------------------------
 DEFAULT_OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 DEFAULT_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.4"))
+# prazo total da resposta da IA no WhatsApp (fila nos semáforos + completion)
+CHATBOT_AI_DEADLINE_SECONDS = float(os.getenv("OPENAI_CHATBOT_DEADLINE_SECONDS", "20"))
+# streaming: manda a primeira frase da IA assim que chega (o resto em mensagens seguintes)
+AI_STREAMING_ENABLED = os.getenv("AI_STREAMING_ENABLED", "1") == "1"
+AI_STREAM_SEND_DELAY_MS = int(os.getenv("AI_STREAM_SEND_DELAY_MS", "300"))
 
 DEFAULT_SYSTEM_PROMPT = os.getenv(
     "CLINIC_AI_SYSTEM_PROMPT",
@@ -67,7 +77,7 @@ DEFAULT_PROCEDURES = {
 
 def _get_clinic_ai_config(clinic_id: int):
     """Retorna configurações de IA. Se a clínica não tiver config, usa padrão."""
-    clinic = Clinic.query.get(clinic_id)
+    clinic = get_clinic_snapshot(clinic_id)
     if not clinic:
         return {
             "enabled": False,
@@ -79,17 +89,12 @@ def _get_clinic_ai_config(clinic_id: int):
             "clinic_name": "",
         }
 
-    # ⚠️ em bancos desatualizados, alguns campos podem não existir ainda.
-    enabled = bool(getattr(clinic, "ai_enabled", True))
-    model = (getattr(clinic, "ai_model", None) or DEFAULT_OPENAI_MODEL).strip()
-    temperature = float(getattr(clinic, "ai_temperature", None) or DEFAULT_TEMPERATURE)
-    system_prompt = (getattr(clinic, "ai_system_prompt", None) or DEFAULT_SYSTEM_PROMPT).strip()
-
-    # Compatibilidade: já existiram nomes diferentes.
-    procs = getattr(clinic, "ai_procedures", None)
-    if not isinstance(procs, dict) or not procs:
-        procs = getattr(clinic, "ai_procedures_json", None)
+    enabled = bool(clinic.get("ai_enabled", True))
+    model = (clinic.get("ai_model") or DEFAULT_OPENAI_MODEL).strip()
+    temperature = float(clinic.get("ai_temperature") or DEFAULT_TEMPERATURE)
+    system_prompt = (clinic.get("ai_system_prompt") or DEFAULT_SYSTEM_PROMPT).strip()
 
+    procs = clinic.get("ai_procedures")
     procedures = procs if isinstance(procs, dict) and procs else DEFAULT_PROCEDURES
 
     return {
@@ -98,8 +103,8 @@ def _get_clinic_ai_config(clinic_id: int):
         "temperature": temperature,
         "system_prompt": system_prompt,
         "procedures": procedures,
-        "booking_policy": (getattr(clinic, "ai_booking_policy", None) or "").strip(),
-        "clinic_name": (getattr(clinic, "name", None) or "").strip(),
+        "booking_policy": (clinic.get("ai_booking_policy") or "").strip(),
+        "clinic_name": clinic.get("name") or "",
     }
 
 
@@ -113,53 +118,86 @@ def _append_history(data: dict, role: str, content: str, max_items: int = 12):
     data["history"] = hist[-max_items:]
 
 
-def _ai_reply(clinic_id: int, user_text: str, data: dict, push_name: str):
+def _has_prior_turns(data: dict, user_text: str) -> bool:
+    """A sessão já tem conversa (user/assistant) antes da mensagem atual?"""
+    hist = data.get("history") if isinstance(data, dict) else None
+    turns = [h for h in (hist or []) if isinstance(h, dict) and h.get("role") in ("user", "assistant")]
+    # a mensagem atual já foi gravada no histórico antes de chamar a IA
+    if turns and turns[-1].get("role") == "user" \
+            and str(turns[-1].get("content", "")).strip().lower() == (user_text or "").strip().lower():
+        turns.pop()
+    return bool(turns)
+
+
+def _ai_reply(clinic_id: int, user_text: str, data: dict, push_name: str, send=None):
+    """Resposta da IA (ou None para cair no fallback humano).
+
+    Com `send`, usa streaming: cada frase/parágrafo completo já é enviado por
+    `send(texto)` enquanto o resto ainda está sendo gerado.
+    """
+    t_start = time.perf_counter()
     cfg = _get_clinic_ai_config(clinic_id)
     if not cfg.get("enabled"):
         return None
 
-    # contexto curto + histórico recente
-    clinic = Clinic.query.get(clinic_id)
-    clinic_name = getattr(clinic, "name", "") if clinic else ""
-    context = f"Nome da clínica: {clinic_name}. Nome do paciente: {push_name}."
-
-    # ✅ Enriquecimento do prompt com procedimentos e políticas (editáveis no painel)
-    procedures = cfg.get("procedures") or {}
-    booking_policy = cfg.get("booking_policy") or ""
-
-    system_blocks = [cfg.get("system_prompt") or DEFAULT_SYSTEM_PROMPT, context]
-    if booking_policy:
-        system_blocks.append("POLÍTICAS DE AGENDAMENTO (obrigatório seguir):\n" + str(booking_policy).strip())
-    if isinstance(procedures, dict) and procedures:
-        system_blocks.append(
-            "PROCEDIMENTOS (use para explicar de forma simples e profissional; não invente valores/garantias):\n"
-            + json.dumps(procedures, ensure_ascii=False, indent=2)
-        )
-
-    messages = [{"role": "system", "content": "\n\n".join(system_blocks)}]
-    hist = data.get("history") if isinstance(data, dict) else None
-    if isinstance(hist, list):
-        # já vem no formato role/content
-        for item in hist[-10:]:
-            if isinstance(item, dict) and item.get("role") in ("user", "assistant"):
-                messages.append({"role": item["role"], "content": str(item.get("content", ""))[:1500]})
+    # ⚡ perguntas frequentes (preço, horário, procedimentos) saem do cache — só sem contexto:
+    # com histórico, a resposta foi escrita para aquela conversa e não serve para outro paciente
+    use_cache = not _has_prior_turns(data, user_text) and is_cacheable_question(user_text)
+    if use_cache:
+        cached = get_cached_reply(clinic_id, cfg, user_text, push_name)
+        if cached:
+            logger.info(f"⚡ Resposta de IA servida do cache (clinic={clinic_id})")
+            return cached
+
+    # prompt fixo da clínica compilado uma vez por versão da config; por mensagem só nome + histórico
+    compiled = compile_prompt(clinic_id, cfg, DEFAULT_SYSTEM_PROMPT)
+    system_prompt, history = build_chat_messages(
+        compiled, push_name, data.get("history") if isinstance(data, dict) else None, user_text
+    )
+
+    streamed, first_ms = [], []
+
+    def _on_chunk(piece):
+        if not streamed:
+            first_ms.append((time.perf_counter() - t_start) * 1000)
+            record_time_to_first_message(clinic_id, first_ms[0])
+        streamed.append(piece)
+        send(piece)
 
     try:
-        out = chat_reply(
-            system_prompt="\n\n".join(system_blocks),
+        t0 = time.perf_counter()
+        out = chat_reply_with_deadline(
+            system_prompt=system_prompt,
             user_text=user_text,
             history={
-                # histórico apenas (não repete a mensagem atual)
-                "messages": messages[1:],
+                # histórico já filtrado/cortado pelo prompt_builder
+                "messages": history,
+                "prepared": True,
                 "model": cfg["model"],
                 "temperature": cfg["temperature"],
                 "max_tokens": 280,
             },
+            clinic_id=clinic_id,
+            deadline=CHATBOT_AI_DEADLINE_SECONDS,
+            on_chunk=_on_chunk if send else None,
         )
-        return (out or "").strip() or None
+        out = (out or "").strip() or None
+        if out:
+            elapsed = (time.perf_counter() - t0) * 1000
+            if use_cache:
+                store_reply(clinic_id, cfg, user_text, out, push_name, latency_ms=elapsed)
+            if streamed:
+                logger.info(
+                    f"⏱️ IA clinic={clinic_id}: 1ª mensagem em {first_ms[0]:.0f}ms, "
+                    f"resposta completa em {(time.perf_counter() - t_start) * 1000:.0f}ms ({len(streamed)} mensagens)"
+                )
+        return out
+    except AIDeadlineExceeded as e:
+        logger.warning(f"⏱️ OpenAI estourou o prazo: {e}")
     except Exception as e:
         logger.warning(f"⚠️ OpenAI falhou: {e}")
-        return None
+    # parte da resposta já foi enviada: fica como resposta (sem fallback por cima)
+    return "\n\n".join(streamed) if streamed else None
 
 # Estados da Máquina de Estados
 STATE_START = 'start'
@@ -175,6 +213,10 @@ STATE_RESCHEDULE_AWAITING_CONFIRM = 'reschedule_awaiting_confirm'
 
 
 def get_or_create_session(clinic_id, sender_id):
+    # Sem lock de linha: o fluxo faz commits no meio (MessageLog de cada parte enviada, agendamento),
+    # e um FOR UPDATE terminaria no primeiro deles. Quem serializa a conversa é a fila do webhook
+    # (WEBHOOK_ASYNC_MODE=1: um evento por conversa em processamento, entre processos); no modo
+    # síncrono duas mensagens simultâneas do mesmo remetente ainda podem se cruzar.
     session = ChatSession.query.filter_by(clinic_id=clinic_id, sender_id=sender_id).first()
     if not session:
         session = ChatSession(clinic_id=clinic_id, sender_id=sender_id, state=STATE_START, data={})
@@ -183,26 +225,12 @@ def get_or_create_session(clinic_id, sender_id):
     return session
 
 
-def _is_yes(text: str) -> bool:
-    return any(w in text for w in ['sim', 'confirmar', 'pode', 'ok', 'com certeza', 'claro', 'confirmado', 'isso', 'isso mesmo'])
-
-def _is_no(text: str) -> bool:
-    return any(w in text for w in ['não', 'nao', 'mudar', 'cancelar', 'errado', 'negativo'])
-
-def _wants_schedule(text: str) -> bool:
-    return any(w in text for w in ['agendar', 'consulta', 'marcar', 'avaliação', 'avaliacao'])
-
-def _wants_reschedule(text: str) -> bool:
-    return any(w in text for w in ['remarcar', 'reagendar', 'reagendamento', 'mudar horario', 'mudar horário', 'mudar data', 'trocar', 'alterar horario', 'alterar horário', 'alterar data'])
-
-
 def process_chatbot_message(clinic_id, sender_id, message_text, push_name):
     trace_id = str(uuid.uuid4())[:8]
     session = get_or_create_session(clinic_id, sender_id)
     state = session.state
-    data = session.data or {}
-    if not isinstance(data, dict):
-        data = {}
+    # ✅ cópia simples: commits intermediários (ex: create_real_appointment) expiram a sessão e o MutableDict dela
+    data = dict(session.data) if isinstance(session.data, dict) else {}
 
     logger.info(f"[{trace_id}] Chatbot: clinic={clinic_id} sender={sender_id} state={state} msg={message_text}")
 
@@ -211,11 +239,22 @@ def process_chatbot_message(clinic_id, sender_id, message_text, push_name):
     text = original_text.lower()
     reply = None
 
+    # intenções + data/hora numa passada só (regex compilada no import)
+    nlu = analyze_message(text)
+    intents = nlu["intents"]
+
     # ✅ salva histórico do usuário (para a IA responder com contexto)
     _append_history(data, "user", original_text)
 
+    # partes da resposta da IA já enviadas em streaming (não reenviar no final)
+    streamed_parts = []
+
+    def _send_streamed(piece):
+        streamed_parts.append(piece)
+        _send_whatsapp_reply(clinic_id, sender_id, piece, delay=AI_STREAM_SEND_DELAY_MS)
+
     # ✅ qualquer momento: se o cliente pedir remarcar, entra no fluxo de remarcação
-    if _wants_reschedule(text):
+    if INTENT_RESCHEDULE in intents:
         # tenta achar um appointment mais recente desse lead/paciente
         appt = _find_last_appointment(clinic_id, sender_id)
         if not appt:
@@ -240,7 +279,7 @@ def process_chatbot_message(clinic_id, sender_id, message_text, push_name):
     # Fluxo normal
     # --------------------
     if state == STATE_START:
-        if _wants_schedule(text):
+        if INTENT_SCHEDULE in intents:
             session.state = STATE_AWAITING_DATE
             data = {}
             reply = f"Olá {push_name}! Com certeza 😊 Para qual dia você gostaria de agendar?"
@@ -250,7 +289,10 @@ def process_chatbot_message(clinic_id, sender_id, message_text, push_name):
             # ✅ IA (ChatGPT) para atendimento humanizado quando não é agendamento/remarcação.
             # A função helper deste módulo é _ai_reply(clinic_id, user_text, data, push_name)
             # (mantemos o fallback caso a IA esteja desativada/sem chave).
-            ai = _ai_reply(clinic_id=clinic_id, user_text=text, data=data, push_name=push_name)
+            ai = _ai_reply(
+                clinic_id=clinic_id, user_text=text, data=data, push_name=push_name,
+                send=_send_streamed if AI_STREAMING_ENABLED else None,
+            )
             if ai:
                 reply = ai
             else:
@@ -261,11 +303,11 @@ def process_chatbot_message(clinic_id, sender_id, message_text, push_name):
                 )
 
     elif state == STATE_AWAITING_DATE:
-        parsed_date = parse_pt_br_date(text)
+        parsed_date = nlu["date"]
         if parsed_date:
             data['date'] = parsed_date.strftime('%Y-%m-%d')
 
-            parsed_time = parse_pt_br_time(text)
+            parsed_time = nlu["time"]
             if parsed_time:
                 data['time'] = parsed_time
                 session.state = STATE_AWAITING_CONFIRM
@@ -277,9 +319,12 @@ def process_chatbot_message(clinic_id, sender_id, message_text, push_name):
             reply = "Não consegui entender a data. Pode me dizer o dia? (Ex: amanhã, quarta, ou 04/02)"
 
     elif state == STATE_AWAITING_TIME:
-        parsed_time = parse_pt_br_time(text)
+        parsed_time = nlu["time"]
         if parsed_time:
             data['time'] = parsed_time
+            if nlu["date"]:
+                # ex.: escolheu uma sugestão de outro dia ("16/10 às 9h")
+                data['date'] = nlu["date"].strftime('%Y-%m-%d')
             session.state = STATE_AWAITING_CONFIRM
             date_obj = datetime.strptime(data['date'], '%Y-%m-%d')
             reply = f"Perfeito! Agendamento para {date_obj.strftime('%d/%m')} às {parsed_time}. Confirma?"
@@ -287,7 +332,7 @@ def process_chatbot_message(clinic_id, sender_id, message_text, push_name):
             reply = "Não entendi o horário. Pode me dizer as horas? (Ex: 15h, 15:30 ou apenas 15)"
 
     elif state == STATE_AWAITING_CONFIRM:
-        if _is_yes(text):
+        if INTENT_YES in intents:
             # ✅ proteção: evita 500 por falta de chaves no JSON
             if not data.get("date"):
                 session.state = STATE_AWAITING_DATE
@@ -308,7 +353,7 @@ def process_chatbot_message(clinic_id, sender_id, message_text, push_name):
                         reply = result.get("message")
                     else:
                         reply = result.get("message") or "Houve um erro ao salvar seu agendamento no sistema. Um atendente humano falará com você em breve."
-        elif _is_no(text):
+        elif INTENT_NO in intents:
             session.state = STATE_START
             data = {}
             reply = "Sem problemas 😊 Você quer *agendar* ou *remarcar*?"
@@ -317,7 +362,7 @@ def process_chatbot_message(clinic_id, sender_id, message_text, push_name):
 
     elif state == STATE_DONE:
         # ✅ depois de concluído, se falar agendar, recomeça
-        if _wants_schedule(text):
+        if INTENT_SCHEDULE in intents:
             session.state = STATE_AWAITING_DATE
             data = {}
             reply = "Vamos lá! Para qual dia você gostaria de agendar uma nova consulta?"
@@ -329,10 +374,10 @@ def process_chatbot_message(clinic_id, sender_id, message_text, push_name):
     # Fluxo de remarcação
     # --------------------
     elif state == STATE_RESCHEDULE_AWAITING_DATE:
-        parsed_date = parse_pt_br_date(text)
+        parsed_date = nlu["date"]
         if parsed_date:
             data['date'] = parsed_date.strftime('%Y-%m-%d')
-            parsed_time = parse_pt_br_time(text)
+            parsed_time = nlu["time"]
             if parsed_time:
                 data['time'] = parsed_time
                 session.state = STATE_RESCHEDULE_AWAITING_CONFIRM
@@ -344,9 +389,12 @@ def process_chatbot_message(clinic_id, sender_id, message_text, push_name):
             reply = "Não consegui entender a data. Pode me dizer o dia? (Ex: amanhã, quinta, ou 04/02)"
 
     elif state == STATE_RESCHEDULE_AWAITING_TIME:
-        parsed_time = parse_pt_br_time(text)
+        parsed_time = nlu["time"]
         if parsed_time:
             data['time'] = parsed_time
+            if nlu["date"]:
+                # ex.: escolheu uma sugestão de outro dia ("16/10 às 9h")
+                data['date'] = nlu["date"].strftime('%Y-%m-%d')
             session.state = STATE_RESCHEDULE_AWAITING_CONFIRM
             date_obj = datetime.strptime(data['date'], '%Y-%m-%d')
             reply = f"Perfeito! Remarcar para {date_obj.strftime('%d/%m')} às {parsed_time}. Confirma?"
@@ -354,7 +402,7 @@ def process_chatbot_message(clinic_id, sender_id, message_text, push_name):
             reply = "Não entendi o horário. Pode me dizer as horas? (Ex: 15h, 15:30)"
 
     elif state == STATE_RESCHEDULE_AWAITING_CONFIRM:
-        if _is_yes(text):
+        if INTENT_YES in intents:
             # ✅ proteção: evita 500 por falta de chaves no JSON
             if not data.get("date"):
                 session.state = STATE_RESCHEDULE_AWAITING_DATE
@@ -375,92 +423,30 @@ def process_chatbot_message(clinic_id, sender_id, message_text, push_name):
                         reply = result.get("message")
                     else:
                         reply = result.get("message") or "Não consegui remarcar agora. Um atendente humano falará com você em breve."
-        elif _is_no(text):
+        elif INTENT_NO in intents:
             session.state = STATE_START
             data = {}
             reply = "Sem problemas 😊 Você quer *agendar* ou *remarcar*?"
         else:
             reply = "Por favor, responda com *Sim* para confirmar ou *Não* para recomeçar."
 
+    # ✅ histórico da resposta entra antes do commit (senão nunca é persistido)
+    if reply:
+        _append_history(data, "assistant", reply)
+
     session.data = data
     db.session.commit()
 
-    if reply:
-        _append_history(data, "assistant", reply)
+    if reply and not streamed_parts:
         _send_whatsapp_reply(clinic_id, sender_id, reply)
 
 
 def parse_pt_br_date(text):
-    # ✅ "hoje" consistente em São Paulo
-    today = datetime.now(TZ_SP).replace(hour=0, minute=0, second=0, microsecond=0)
-
-    if 'amanhã' in text or 'amanha' in text:
-        return (today + timedelta(days=1)).replace(tzinfo=None)
-    if 'hoje' in text:
-        return today.replace(tzinfo=None)
-    if 'depois de amanhã' in text or 'depois de amanha' in text:
-        return (today + timedelta(days=2)).replace(tzinfo=None)
-
-    # DD/MM ou DD/MM/YYYY
-    match = re.search(r'(\d{1,2})[/-](\d{1,2})(?:[/-](\d{2,4}))?', text)
-    if match:
-        day = int(match.group(1))
-        month = int(match.group(2))
-        year = int(match.group(3)) if match.group(3) else today.year
-        if year < 100:
-            year += 2000
-        try:
-            return datetime(year, month, day)
-        except:
-            return None
-
-    meses = {
-        'janeiro': 1, 'fevereiro': 2, 'março': 3, 'marco': 3, 'abril': 4, 'maio': 5, 'junho': 6,
-        'julho': 7, 'agosto': 8, 'setembro': 9, 'outubro': 10, 'novembro': 11, 'dezembro': 12
-    }
-    for mes_nome, mes_num in meses.items():
-        if mes_nome in text:
-            match = re.search(rf'(\d{{1,2}})\s+(?:de\s+)?{mes_nome}', text)
-            if match:
-                day = int(match.group(1))
-                return datetime(today.year, mes_num, day)
-
-    dias_semana = {
-        'segunda': 0, 'terça': 1, 'terca': 1, 'quarta': 2, 'quinta': 3, 'sexta': 4,
-        'sábado': 5, 'sabado': 5, 'domingo': 6, 'seg': 0, 'ter': 1, 'qua': 2, 'qui': 3, 'sex': 4
-    }
-    for dia_nome, dia_num in dias_semana.items():
-        if re.search(rf'\b{dia_nome}\b', text):
-            days_ahead = dia_num - today.weekday()
-            if days_ahead <= 0:
-                days_ahead += 7
-            return (today + timedelta(days=days_ahead)).replace(tzinfo=None)
-
-    return None
+    return analyze_message(text)["date"]
 
 
 def parse_pt_br_time(text):
-    match = re.search(r'(\d{1,2})[:h](\d{2})\b', text)
-    if match:
-        hours = int(match.group(1))
-        minutes = int(match.group(2))
-        if 0 <= hours <= 23 and 0 <= minutes <= 59:
-            return f"{str(hours).zfill(2)}:{str(minutes).zfill(2)}"
-
-    match = re.search(r'(\d{1,2})\s*h\b', text)
-    if match:
-        hours = int(match.group(1))
-        if 0 <= hours <= 23:
-            return f"{str(hours).zfill(2)}:00"
-
-    if not re.search(r'\d{1,2}[/-]\d{1,2}', text):
-        match = re.search(r'\b(\d{1,2})\b', text)
-        if match:
-            h = int(match.group(1))
-            if 7 <= h <= 20:
-                return f"{str(h).zfill(2)}:00"
-
-    return None
+    return analyze_message(text)["time"]
 
 
 def _find_last_appointment(clinic_id, sender_id):
@@ -491,48 +477,30 @@ def _make_local_naive_start_end(date_str: str, time_str: str, duration_min: int
     return start_dt, end_dt
 
 
-def _overlaps(a_start: datetime, a_end: datetime, b_start: datetime, b_end: datetime) -> bool:
-    return a_start < b_end and b_start < a_end
+def _conflict_response(clinic_id: int, start_dt: datetime, end_dt: datetime,
+                       exclude_appointment_id: int | None = None):
+    """Reserva o horário (lock da agenda da clínica até o commit) ou devolve a resposta de conflito.
 
-
-def _find_conflict(clinic_id: int, start_dt: datetime, end_dt: datetime, exclude_appointment_id: int | None = None):
-    q = Appointment.query.filter_by(clinic_id=clinic_id)
-    # evita considerar cancelados
-    if hasattr(Appointment, "status"):
-        q = q.filter(Appointment.status != 'cancelled')
-    if exclude_appointment_id:
-        q = q.filter(Appointment.id != exclude_appointment_id)
-
-    # janela de busca: somente eventos que podem cruzar
-    q = q.filter(Appointment.start_datetime < end_dt).filter(Appointment.end_datetime > start_dt)
-    return q.first()
-
-
-def _suggest_next_slots(clinic_id: int, day: datetime, duration_min: int = 30, limit: int = 3):
-    """Sugere próximos horários disponíveis no mesmo dia (08:00–19:00)."""
-    duration_min = max(int(duration_min or 30), 15)
-    start_day = day.replace(hour=8, minute=0, second=0, microsecond=0)
-    end_day = day.replace(hour=19, minute=0, second=0, microsecond=0)
-
-    # começa pelo próximo slot de 30 min
-    cursor = day.replace(second=0, microsecond=0)
-    # arredonda para próximo 30
-    m = cursor.minute
-    if m % 30 != 0:
-        cursor = cursor + timedelta(minutes=(30 - (m % 30)))
-
-    slots = []
-    while cursor < end_day and len(slots) < limit:
-        slot_end = cursor + timedelta(minutes=duration_min)
-        if slot_end > end_day:
-            break
-        conflict = _find_conflict(clinic_id, cursor, slot_end)
-        if not conflict:
-            slots.append((cursor, slot_end))
-        cursor = cursor + timedelta(minutes=30)
-        if cursor < start_day:
-            cursor = start_day
-    return slots
+    None = horário garantido: o chamador grava o agendamento e faz commit na sequência.
+    """
+    try:
+        reserve_slot(clinic_id, start_dt, end_dt, exclude_appointment_id=exclude_appointment_id)
+        return None
+    except SlotUnavailable as e:
+        # sem rollback: a transação também segura o lock da sessão do chat; o commit do fluxo solta os dois
+        alt_list = [
+            {
+                "start": s.strftime('%Y-%m-%d %H:%M'),
+                "label": s.strftime('%H:%M') if s.date() == start_dt.date() else s.strftime('%d/%m %H:%M'),
+            }
+            for s, _ in e.alternatives
+        ]
+        return {
+            "ok": False,
+            "reason": "conflict",
+            "message": "Esse horário já está ocupado." + _format_alternatives(alt_list) + " Qual horário você prefere?",
+            "alternatives": alt_list,
+        }
 
 
 def _format_alternatives(alts: list) -> str:
@@ -563,19 +531,9 @@ def create_real_appointment(clinic_id, sender_id, data, push_name):
         duration_min = int(data.get('duration_min') or 30)
         start_dt, end_dt = _make_local_naive_start_end(data['date'], data['time'], duration_min)
 
-        conflict = _find_conflict(clinic_id, start_dt, end_dt)
+        conflict = _conflict_response(clinic_id, start_dt, end_dt)
         if conflict:
-            alternatives = _suggest_next_slots(clinic_id, start_dt, duration_min, limit=3)
-            alt_list = [
-                {"start": s.strftime('%Y-%m-%d %H:%M'), "label": s.strftime('%H:%M')}
-                for s, _ in alternatives
-            ]
-            return {
-                "ok": False,
-                "reason": "conflict",
-                "message": "Esse horário já está ocupado." + _format_alternatives(alt_list) + " Qual horário você prefere?",
-                "alternatives": alt_list,
-            }
+            return conflict
 
         new_app = Appointment(
             clinic_id=clinic_id,
@@ -594,10 +552,10 @@ def create_real_appointment(clinic_id, sender_id, data, push_name):
         if lead:
             lead.status = 'agendado'
 
-        card = CRMCard.query.filter_by(clinic_id=clinic_id, paciente_phone=sender_id, status='open').first()
-        stage_agendado = CRMStage.query.filter_by(clinic_id=clinic_id, nome='Agendado').first()
-        if stage_agendado and card:
-            card.stage_id = stage_agendado.id
+        stage_agendado_id = get_stage_registry(clinic_id)["agendado_id"]
+        card = CRMCard.query.filter_by(clinic_id=clinic_id, paciente_phone=sender_id, status='open').first() if stage_agendado_id else None
+        if card:
+            card.stage_id = stage_agendado_id
 
         db.session.commit()
 
@@ -633,19 +591,9 @@ def reschedule_real_appointment(clinic_id, sender_id, appointment_id, data, push
         duration_min = int(data.get('duration_min') or 30)
         start_dt, end_dt = _make_local_naive_start_end(data['date'], data['time'], duration_min)
 
-        conflict = _find_conflict(clinic_id, start_dt, end_dt, exclude_appointment_id=appt.id)
+        conflict = _conflict_response(clinic_id, start_dt, end_dt, exclude_appointment_id=appt.id)
         if conflict:
-            alternatives = _suggest_next_slots(clinic_id, start_dt, duration_min, limit=3)
-            alt_list = [
-                {"start": s.strftime('%Y-%m-%d %H:%M'), "label": s.strftime('%H:%M')}
-                for s, _ in alternatives
-            ]
-            return {
-                "ok": False,
-                "reason": "conflict",
-                "message": "Esse horário já está ocupado." + _format_alternatives(alt_list) + " Qual horário você prefere?",
-                "alternatives": alt_list,
-            }
+            return conflict
 
         appt.start_datetime = start_dt
         appt.end_datetime = end_dt
@@ -0,0 +1,182 @@
+"""Intenções e entidades (data/hora) das mensagens do chatbot, numa passada só.
+
+Todas as palavras-chave e padrões de data/hora estão numa única regex com
+grupos nomeados, compilada no import e com limites de palavra (\\b): "pode"
+não casa dentro de "podemos", "sim" não casa dentro de "assim", "marcar" não
+casa dentro de "remarcar". O texto é normalizado (minúsculas, sem acento) e
+percorrido uma vez com `finditer`; cada match vira intenção ou entidade.
+
+Negação: "não" até duas palavras antes (sem vírgula/ponto no meio) de uma
+palavra de confirmação / agendamento anula aquela palavra ("não pode",
+"não quero agendar").
+
+Benchmark + corpus rotulado: `backend/bench_intents.py`.
+"""
+import re
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+TZ_SP = ZoneInfo("America/Sao_Paulo")
+
+INTENT_YES = "yes"
+INTENT_NO = "no"
+INTENT_SCHEDULE = "schedule"
+INTENT_RESCHEDULE = "reschedule"
+
+_MESES = {
+    "janeiro": 1, "fevereiro": 2, "marco": 3, "abril": 4, "maio": 5, "junho": 6,
+    "julho": 7, "agosto": 8, "setembro": 9, "outubro": 10, "novembro": 11, "dezembro": 12,
+}
+_DIAS_SEMANA = {
+    "segunda": 0, "terca": 1, "quarta": 2, "quinta": 3, "sexta": 4, "sabado": 5, "domingo": 6,
+    # sem "ter": é o verbo na maioria das mensagens ("vou ter que remarcar")
+    "seg": 0, "qua": 2, "qui": 3, "sex": 4, "sab": 5, "dom": 6,
+}
+
+_YES_WORDS = [
+    "isso mesmo", "com certeza", "pode ser", "sim", "confirmar", "confirmo", "confirma", "confirmado",
+    "pode", "ok", "okay", "claro", "isso", "beleza", "blz", "fechado", "combinado", "perfeito",
+]
+_NO_WORDS = ["nao", "mudar", "cancelar", "cancela", "errado", "negativo"]
+_NEG_WORDS = ["nao", "nunca", "nem"]
+_SCHEDULE_WORDS = [
+    "agendar", "agendamento", "agenda", "consulta", "consultas", "marcar", "marcacao", "avaliacao",
+]
+_RESCHEDULE_WORDS = [
+    r"remarc\w*", r"reagend\w*", r"(?:mudar|alterar|trocar)\s+(?:o\s+|a\s+|de\s+)?(?:horario|data|dia)", "trocar",
+]
+
+
+def _words(words):
+    # mais longas primeiro: "isso mesmo" antes de "isso"
+    return "|".join(sorted(words, key=len, reverse=True))
+
+
+# A ordem das alternativas importa: no mesmo ponto do texto vence a primeira
+# (data antes de número solto, remarcar antes de "mudar" = não, etc.).
+_PATTERN = re.compile(
+    r"(?P<rel>\bdepois\s+de\s+amanha\b|\bamanha\b|\bhoje\b)"
+    r"|(?P<dnum>\b(?P<dn_d>\d{1,2})[/-](?P<dn_m>\d{1,2})(?:[/-](?P<dn_y>\d{4}|\d{2}))?\b)"
+    r"|(?P<dmonth>\b(?:dia\s+)?(?P<dm_d>\d{1,2})\s+(?:de\s+)?(?P<dm_m>" + _words(_MESES) + r")\b)"
+    r"|(?P<weekday>\b(?P<wd>" + _words(_DIAS_SEMANA) + r")\b)"
+    r"|(?P<thm>\b(?P<thm_h>\d{1,2})[:h](?P<thm_m>\d{2})\b)"
+    r"|(?P<th>\b(?P<th_h>\d{1,2})\s*(?:horas|hora|hrs|hr|hs|h)\b)"
+    r"|(?P<tas>\bas\s+(?P<tas_h>\d{1,2})\b(?![:h]?\d))"
+    r"|(?P<dayref>\bdia\s+\d{1,2}\b)"
+    r"|(?P<num>\b\d{1,2}\b)"
+    r"|(?P<resched>\b(?:" + _words(_RESCHEDULE_WORDS) + r")\b)"
+    r"|(?P<sched>\b(?:" + _words(_SCHEDULE_WORDS) + r")\b)"
+    r"|(?P<yes>\b(?:" + _words(_YES_WORDS) + r")\b)"
+    r"|(?P<neg_no>\b(?:" + _words(_NO_WORDS + _NEG_WORDS) + r")\b)"
+)
+
+_NEGATABLE = {"yes", "sched", "resched"}
+_RE_CLAUSE_BREAK = re.compile(r"[,.;!?]")
+_NEG_SET = set(_NEG_WORDS)
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _today_sp() -> datetime:
+    return datetime.now(TZ_SP).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+def _safe_date(year: int, month: int, day: int) -> Optional[datetime]:
+    try:
+        return datetime(year, month, day)
+    except ValueError:
+        return None
+
+
+def analyze_message(text: str, today: Optional[datetime] = None) -> dict:
+    """{"intents": set, "date": datetime|None, "time": "HH:MM"|None} numa passada pelo texto.
+
+    Precedência das datas igual à do parser antigo: relativa (hoje/amanhã/
+    depois de amanhã) > DD/MM > "12 de março" > dia da semana.
+    Horário: HH:MM / HHhMM > "15h" / "15 horas" > "às 15" > número solto entre 7 e 20
+    (só se não houver data numérica, e nunca o número de "dia 12" / "12 de maio").
+    """
+    norm = normalize_text(text)
+    today = today or _today_sp()
+
+    intents = set()
+    rel = dnum = dmonth = weekday = None
+    t_hm = t_h = t_as = t_num = None
+    has_numeric_date = False
+    last_neg_end = None
+
+    for m in _PATTERN.finditer(norm):
+        kind = m.lastgroup
+        if kind in _NEGATABLE and last_neg_end is not None:
+            gap = norm[last_neg_end:m.start()]
+            if len(gap.split()) <= 2 and not _RE_CLAUSE_BREAK.search(gap):
+                continue
+
+        if kind == "rel":
+            word = m.group(kind)
+            offset = 2 if word.startswith("depois") else 1 if word == "amanha" else 0
+            if rel is None or offset > rel:
+                rel = offset
+        elif kind == "dnum":
+            has_numeric_date = True
+            if dnum is None:
+                year = int(m.group("dn_y")) if m.group("dn_y") else today.year
+                if year < 100:
+                    year += 2000
+                dnum = _safe_date(year, int(m.group("dn_m")), int(m.group("dn_d")))
+        elif kind == "dmonth":
+            if dmonth is None:
+                dmonth = _safe_date(today.year, _MESES[m.group("dm_m")], int(m.group("dm_d")))
+        elif kind == "weekday":
+            if weekday is None:
+                weekday = _DIAS_SEMANA[m.group("wd")]
+        elif kind == "thm":
+            if t_hm is None:
+                h, mi = int(m.group("thm_h")), int(m.group("thm_m"))
+                if 0 <= h <= 23 and 0 <= mi <= 59:
+                    t_hm = f"{h:02d}:{mi:02d}"
+        elif kind == "th":
+            if t_h is None and 0 <= int(m.group("th_h")) <= 23:
+                t_h = f"{int(m.group('th_h')):02d}:00"
+        elif kind == "tas":
+            if t_as is None and 0 <= int(m.group("tas_h")) <= 23:
+                t_as = f"{int(m.group('tas_h')):02d}:00"
+        elif kind == "num":
+            if t_num is None:
+                t_num = int(m.group(kind))
+        elif kind == "resched":
+            intents.add(INTENT_RESCHEDULE)
+        elif kind == "sched":
+            intents.add(INTENT_SCHEDULE)
+        elif kind == "yes":
+            intents.add(INTENT_YES)
+        elif kind == "neg_no":
+            word = m.group(kind)
+            if word in _NEG_SET:
+                last_neg_end = m.end()
+            if word not in ("nunca", "nem"):
+                intents.add(INTENT_NO)
+
+    date = None
+    if rel is not None:
+        date = today + timedelta(days=rel)
+    elif dnum is not None:
+        date = dnum
+    elif dmonth is not None:
+        date = dmonth
+    elif weekday is not None:
+        days_ahead = weekday - today.weekday()
+        if days_ahead <= 0:
+            days_ahead += 7
+        date = today + timedelta(days=days_ahead)
+
+    time_str = t_hm or t_h or t_as
+    if time_str is None and t_num is not None and not has_numeric_date and 7 <= t_num <= 20:
+        time_str = f"{t_num:02d}:00"
+
+    return {"intents": intents, "date": date, "time": time_str}
@@ -1,19 +1,24 @@
-from flask import Blueprint, request, jsonify
-from app.models import db, Clinic, CRMStage, CRMCard, Lead, Campaign, LeadEvent, MessageLog
+from flask import Blueprint, request, jsonify, current_app
+from app.models import db, CRMCard, Lead, Campaign, LeadEvent, MessageLog
 import logging
 import json
 import re
-import os
-import requests
 from datetime import datetime
 
+from app.services.clinic_cache import resolve_clinic
+from app.services.conversation_pool import conversation_key
+from app.services.evolution_client import get_evolution_client
+from app.services.outbound_dispatcher import WHATSAPP_OUTBOUND_QUEUE, enqueue_message
+from app.services.crm_stages import WEBHOOK_DEFAULT_STAGES, ensure_stages
+from app.services.ai_client import ai_stats
+from app.services.ai_response_cache import ai_cache_stats
+from app.services.ops_auth import ops_required
+from app.services.webhook_dedupe import claim_message, dedupe_stats, release_message
+from app.services.webhook_queue import WEBHOOK_ASYNC_MODE, enqueue_event, ensure_workers, queue_stats
+
 logger = logging.getLogger(__name__)
 bp = Blueprint('marketing_webhook', __name__)
 
-# --- CONFIGURAÇÕES ---
-EVOLUTION_API_URL = os.getenv("WHATSAPP_QR_SERVICE_URL", "http://localhost:8080").rstrip("/")
-EVOLUTION_API_KEY = os.getenv("EVOLUTION_API_KEY", "")
-
 # -------------------------
 # Helpers
 # -------------------------
@@ -113,25 +118,22 @@ def _is_group_message(payload: dict, key: dict, remote_jid: str) -> bool:
     return False
 
 def garantir_etapas_crm(clinic_id):
-    exists = CRMStage.query.filter_by(clinic_id=clinic_id).first()
-    if exists: return
-    etapas = [
-        {"nome": "Novo Lead", "cor": "yellow", "is_initial": True},
-        {"nome": "Contactado", "cor": "blue", "is_initial": False},
-        {"nome": "Agendado", "cor": "green", "is_initial": False, "is_success": True},
-        {"nome": "Perdido", "cor": "red", "is_initial": False}
-    ]
-    for i, etapa in enumerate(etapas):
-        db.session.add(CRMStage(clinic_id=clinic_id, nome=etapa["nome"], cor=etapa["cor"], ordem=i, is_initial=etapa["is_initial"], is_success=etapa.get("is_success", False)))
-    db.session.commit()
-
-def _send_whatsapp_reply(clinic_id, to_phone, text):
+    # ✅ registro em memória: só vai ao banco na primeira mensagem da clínica (ou após invalidação)
+    return ensure_stages(clinic_id, WEBHOOK_DEFAULT_STAGES)
+
+def _send_whatsapp_reply(clinic_id, to_phone, text, delay=1200):
+    if WHATSAPP_OUTBOUND_QUEUE:
+        try:
+            enqueue_message(clinic_id, to_phone, text, source="chatbot", delay=delay)
+            return True
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro ao enfileirar resposta automática: {e}")
+            return False
+
     instance_name = f"clinica_v3_{clinic_id}"
-    url = f"{EVOLUTION_API_URL}/message/sendText/{instance_name}"
-    headers = {"apikey": EVOLUTION_API_KEY, "Content-Type": "application/json"}
-    payload = {"number": to_phone, "text": text, "delay": 1200}
     try:
-        r = requests.post(url, json=payload, headers=headers, timeout=15)
+        r = get_evolution_client().send_text(instance_name, to_phone, text, delay=delay)
         log = MessageLog(clinic_id=clinic_id, direction="out", body=text, status="sent" if r.status_code in (200, 201) else "failed")
         db.session.add(log)
         db.session.commit()
@@ -140,48 +142,55 @@ def _send_whatsapp_reply(clinic_id, to_phone, text):
         logger.error(f"Erro ao enviar resposta automática: {e}")
         return False
 
-# -------------------------
-# Routes
-# -------------------------
-
-@bp.route('/webhook/whatsapp', methods=['POST'])
-@bp.route('/webhook/whatsapp/messages-upsert', methods=['POST'])
-def whatsapp_webhook():
-    data = _get_json_body()
-    if not data or not isinstance(data, dict): return jsonify({"status": "ignored"}), 200
+def _parse_inbound(data):
+    """Valida o evento do Evolution. Retorna None se deve ser ignorado."""
+    if not data or not isinstance(data, dict): return None
     payload = data.get("data") if isinstance(data.get("data"), dict) else data
     key = payload.get('key') or {}
-    if key.get('fromMe') is True: return jsonify({"status": "ignored"}), 200
+    if key.get('fromMe') is True: return None
     remote_jid = key.get('remoteJid') or ""
-    if _is_group_message(payload, key, remote_jid): return jsonify({"status": "ignored"}), 200
+    if _is_group_message(payload, key, remote_jid): return None
     phone = _normalize_phone_from_jid(remote_jid)
-    if not phone: return jsonify({"status": "ignored"}), 200
-
-    push_name = (payload.get('pushName') or 'Paciente').strip()
+    if not phone: return None
 
     # --- ALTERADO: usa texto RAW para extrair tracking e texto limpo para o bot ---
     message_text_raw = _extract_message_text(payload)
-    if not message_text_raw: return jsonify({"status": "ignored"}), 200
+    if not message_text_raw: return None
 
-    code = _extract_tracking_code(message_text_raw)  # tracking deve vir do RAW
     message_text = _normalize_message_for_bot(message_text_raw)  # bot recebe texto limpo
-    if not message_text: return jsonify({"status": "ignored"}), 200
+    if not message_text: return None
 
-    # Identificação da Clínica
     owner_raw = _extract_instance_owner(data) or _extract_instance_owner(payload)
-    owner_phone = _normalize_phone_from_jid(owner_raw)
-    instance_name = _extract_instance_name(data) or _extract_instance_name(payload)
+    return {
+        "phone": phone,
+        "push_name": (payload.get('pushName') or 'Paciente').strip(),
+        "code": _extract_tracking_code(message_text_raw),  # tracking deve vir do RAW
+        "message_text": message_text,
+        "owner_phone": _normalize_phone_from_jid(owner_raw),
+        "instance_name": _extract_instance_name(data) or _extract_instance_name(payload),
+        "message_id": key.get('id'),
+    }
+
+def process_inbound_event(data):
+    """Processa um evento já validado (lead/card/chatbot). Retorna (body, http_status)."""
+    parsed = _parse_inbound(data)
+    if not parsed: return {"status": "ignored"}, 200
+
+    phone = parsed["phone"]
+    push_name = parsed["push_name"]
+    code = parsed["code"]
+    message_text = parsed["message_text"]
 
-    clinic = None
-    if owner_phone: clinic = Clinic.query.filter_by(whatsapp_number=owner_phone).first()
-    if not clinic and instance_name and instance_name.startswith("clinica_v3_"):
-        try: clinic = Clinic.query.get(int(instance_name.replace("clinica_v3_", "")))
-        except: pass
-    if not clinic: clinic = Clinic.query.filter(Clinic.id == 1).first()
-    if not clinic: return jsonify({"status": "ignored"}), 200
+    # Identificação da Clínica
+    owner_phone = parsed["owner_phone"]
+    instance_name = parsed["instance_name"]
+
+    # ✅ cache com TTL (dono -> instância clinica_v3_<id> -> clínica 1)
+    clinic = resolve_clinic(owner_phone, instance_name)
+    if not clinic: return {"status": "ignored"}, 200
 
-    clinic_id = clinic.id
-    garantir_etapas_crm(clinic_id)
+    clinic_id = clinic["id"]
+    stages = garantir_etapas_crm(clinic_id)
 
     # Tracking de Campanha
     campaign = Campaign.query.filter(Campaign.tracking_code.ilike(code)).first() if code else None
@@ -232,12 +241,12 @@ def whatsapp_webhook():
             db.session.add(lead)
 
         if not existing_card:
-            stage = CRMStage.query.filter_by(clinic_id=clinic_id, is_initial=True).first()
-            if stage:
+            stage_id = stages["initial_id"]
+            if stage_id:
                 logger.info(f"[{trace_id}] Criando novo card no CRM.")
                 novo_card = CRMCard(
                     clinic_id=clinic_id,
-                    stage_id=stage.id,
+                    stage_id=stage_id,
                     paciente_nome=push_name,
                     paciente_phone=phone,
                     historico_conversas=f"{source_text}: {message_text}",
@@ -256,9 +265,67 @@ def whatsapp_webhook():
         from .chatbot_logic import process_chatbot_message
         process_chatbot_message(clinic_id, phone, message_text, push_name)
 
-        return jsonify({"status": "processed", "clinic_id": clinic_id, "trace_id": trace_id}), 200
+        return {"status": "processed", "clinic_id": clinic_id, "trace_id": trace_id}, 200
 
     except Exception as e:
         logger.exception(f"Erro no webhook: {e}")
         db.session.rollback()
+        return {"status": "error"}, 500
+
+# -------------------------
+# Routes
+# -------------------------
+
+@bp.route('/webhook/whatsapp', methods=['POST'])
+@bp.route('/webhook/whatsapp/messages-upsert', methods=['POST'])
+def whatsapp_webhook():
+    data = _get_json_body()
+
+    parsed = _parse_inbound(data)
+    if not parsed: return jsonify({"status": "ignored"}), 200
+
+    # ✅ Retentativa do Evolution (mesmo key.id): responde sem tocar em lead/card/chatbot
+    source_ref = parsed["instance_name"] or parsed["owner_phone"]
+    message_id = parsed["message_id"]
+    try:
+        if not claim_message(source_ref, message_id):
+            return jsonify({"status": "duplicate"}), 200
+    except Exception as e:
+        # dedupe indisponível não pode derrubar o atendimento
+        db.session.rollback()
+        logger.warning(f"⚠️ Dedupe do webhook falhou, seguindo sem: {e}")
+
+    if not WEBHOOK_ASYNC_MODE:
+        try:
+            body, code = process_inbound_event(data)
+        except Exception:
+            release_message(source_ref, message_id)
+            raise
+        if code >= 500:
+            release_message(source_ref, message_id)
+        return jsonify(body), code
+
+    # ✅ Modo fila: persiste o evento bruto e responde na hora
+    try:
+        # chave da conversa: eventos do mesmo remetente na mesma instância são processados em ordem
+        key = conversation_key(source_ref, parsed["phone"])
+        ev = enqueue_event(data, key)
+        ensure_workers(current_app._get_current_object(), process_inbound_event)
+        # sem COUNT(*) da fila aqui: o ack tem que sair em milissegundos (profundidade no GET .../queue)
+        return jsonify({"status": "queued", "event_id": ev.id}), 200
+    except Exception as e:
+        logger.exception(f"Erro ao enfileirar webhook: {e}")
+        db.session.rollback()
+        release_message(source_ref, message_id)
         return jsonify({"status": "error"}), 500
+
+@bp.route('/webhook/whatsapp/queue', methods=['GET'])
+@ops_required
+def whatsapp_webhook_queue_stats():
+    """Fila, dedupe e IA de todas as clínicas: só para a operação (header X-Ops-Token)."""
+    stats = queue_stats()
+    stats["async_mode"] = WEBHOOK_ASYNC_MODE
+    stats["dedupe"] = dedupe_stats()
+    stats["ai"] = ai_stats()
+    stats["ai_cache"] = ai_cache_stats()
+    return jsonify(stats), 200
@@ -1,6 +1,5 @@
 import os
 import json
-import requests
 import logging
 from datetime import datetime
 
@@ -8,24 +7,14 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from app.models import db, WhatsAppContact, MessageLog, Clinic, WhatsAppConnection
+from app.services.clinic_cache import invalidate_clinic
+from app.services.evolution_client import get_evolution_client
+from app.services.ops_auth import ops_required
+from app.services.outbound_dispatcher import WHATSAPP_OUTBOUND_QUEUE, enqueue_message, outbound_stats
 
 bp = Blueprint("marketing_whatsapp", __name__)
 logger = logging.getLogger(__name__)
 
-# --- CONFIGURAÇÕES ---
-EVOLUTION_API_URL = os.getenv("WHATSAPP_QR_SERVICE_URL", "http://localhost:8080").rstrip("/")
-EVOLUTION_API_KEY = os.getenv("EVOLUTION_API_KEY", "")
-
-TIMEOUT_SHORT = 10
-TIMEOUT_MED = 20
-TIMEOUT_LONG = 30
-
-def get_headers():
-    return {
-        "apikey": EVOLUTION_API_KEY,
-        "Content-Type": "application/json"
-    }
-
 def _get_clinic_id_from_jwt() -> int:
     identity = get_jwt_identity()
     # Se a identidade for um dicionário (claims adicionais)
@@ -69,9 +58,8 @@ def _safe_json(resp):
         return None
 
 def _fetch_instances():
-    url = f"{EVOLUTION_API_URL}/instance/fetchInstances"
     try:
-        r = requests.get(url, headers=get_headers(), timeout=TIMEOUT_SHORT)
+        r = get_evolution_client().fetch_instances()
         data = _safe_json(r)
         if r.status_code != 200 or data is None:
             return []
@@ -114,18 +102,7 @@ def ensure_instance(instance_name: str) -> bool:
         if inst:
             return True
 
-        payload = {
-            "instanceName": instance_name,
-            "qrcode": True,
-            "integration": "WHATSAPP-BAILEYS"
-        }
-
-        r = requests.post(
-            f"{EVOLUTION_API_URL}/instance/create",
-            json=payload,
-            headers=get_headers(),
-            timeout=TIMEOUT_MED
-        )
+        r = get_evolution_client().create_instance(instance_name)
 
         if r.status_code in (200, 201):
             return True
@@ -156,6 +133,7 @@ def _sync_clinic_phone_from_instance(clinic_id: int, instance_name: str) -> dict
 
         clinic.whatsapp_number = owner_phone
         db.session.commit()
+        invalidate_clinic(clinic_id)
         return {"ok": True, "owner_phone": owner_phone}
     except Exception as e:
         db.session.rollback()
@@ -172,11 +150,7 @@ def get_qr():
 
     try:
         state = "close"
-        r_state = requests.get(
-            f"{EVOLUTION_API_URL}/instance/connectionState/{instance_name}",
-            headers=get_headers(),
-            timeout=TIMEOUT_SHORT
-        )
+        r_state = get_evolution_client().connection_state(instance_name)
 
         if r_state.status_code == 200:
             js = _safe_json(r_state) or {}
@@ -187,11 +161,7 @@ def get_qr():
             sync = _sync_clinic_phone_from_instance(clinic_id, instance_name)
             return jsonify({"status": "connected", "synced_phone": sync.get("owner_phone")}), 200
 
-        r_connect = requests.get(
-            f"{EVOLUTION_API_URL}/instance/connect/{instance_name}",
-            headers=get_headers(),
-            timeout=TIMEOUT_MED
-        )
+        r_connect = get_evolution_client().connect(instance_name)
 
         if r_connect.status_code == 200:
             js = _safe_json(r_connect) or {}
@@ -215,10 +185,16 @@ def send_message():
     if not to or not message:
         return jsonify({"ok": False, "message": "Dados incompletos"}), 400
 
+    if WHATSAPP_OUTBOUND_QUEUE:
+        try:
+            msg = enqueue_message(clinic_id, to, message, source="manual", delay=1000)
+            return jsonify({"ok": True, "queued": True, "id": msg.id}), 202
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({"ok": False, "message": str(e)}), 500
+
     try:
-        send_url = f"{EVOLUTION_API_URL}/message/sendText/{instance_name}"
-        payload = {"number": to, "text": message, "delay": 1000}
-        r = requests.post(send_url, json=payload, headers=get_headers(), timeout=TIMEOUT_LONG)
+        r = get_evolution_client().send_text(instance_name, to, message, delay=1000)
         
         log = MessageLog(
             clinic_id=clinic_id,
@@ -234,3 +210,15 @@ def send_message():
         return jsonify({"ok": False, "error": r.text}), 400
     except Exception as e:
         return jsonify({"ok": False, "message": str(e)}), 500
+
+@bp.route('/whatsapp/client-metrics', methods=['GET'])
+@ops_required
+def client_metrics():
+    """Latência / erros por instância do cliente da Evolution (processo atual, todas as clínicas: só operação)."""
+    return jsonify(get_evolution_client().metrics()), 200
+
+@bp.route('/whatsapp/outbound/stats', methods=['GET'])
+@ops_required
+def outbound_queue_stats():
+    """Fila de envio de todas as clínicas (por status, atraso da mais antiga, tokens por instância): só operação."""
+    return jsonify(outbound_stats()), 200
@@ -1,11 +1,15 @@
 from flask import Blueprint, jsonify, request
 from app.models import db, Patient, User, Appointment
+from app.services.patient_search import PATIENT_PAGE_MAX, PATIENT_PAGE_SIZE, list_patients, parse_fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
 
 patient_bp = Blueprint('patient', __name__)
 
 # --- LISTAR PACIENTES (GET) ---
+# ?q= busca por nome/telefone/CPF, ?fields=id,name,phone projeta as colunas.
+# Com ?limit= (ou ?cursor=) responde {items, next_cursor} paginado por (name, id);
+# sem eles devolve a lista inteira, como antes.
 @patient_bp.route('/patients', methods=['GET'])
 @jwt_required()
 def get_patients():
@@ -16,23 +20,31 @@ def get_patients():
         if not user:
             return jsonify({'error': 'Usuário não encontrado'}), 404
 
-        # Filtra apenas pacientes da clínica do usuário
-        patients = Patient.query.filter_by(clinic_id=user.clinic_id).order_by(Patient.name).all()
-        
-        # Garante que to_dict() existe no model, senão cria manual
-        result = []
-        for p in patients:
-            p_dict = p.to_dict() if hasattr(p, 'to_dict') else {
-                'id': p.id,
-                'name': p.name,
-                'phone': p.phone,
-                'cpf': p.cpf,
-                'email': p.email,
-                'address': p.address
-            }
-            result.append(p_dict)
-
-        return jsonify(result), 200
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({'error': f'fields inválido: {e}'}), 400
+
+        cursor = request.args.get('cursor') or None
+        limit = None
+        if request.args.get('limit') or cursor:
+            try:
+                limit = int(request.args.get('limit') or PATIENT_PAGE_SIZE)
+            except ValueError:
+                return jsonify({'error': 'limit inválido'}), 400
+            limit = max(1, min(limit, PATIENT_PAGE_MAX))
+
+        # Filtra apenas pacientes da clínica do usuário (só as colunas pedidas, direto do banco)
+        try:
+            items, next_cursor = list_patients(
+                user.clinic_id, q=request.args.get('q'), fields=fields, limit=limit, cursor=cursor
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if limit is None:
+            return jsonify(items), 200
+        return jsonify({'items': items, 'next_cursor': next_cursor}), 200
     except Exception as e:
         print(f"Erro ao listar pacientes: {e}") # Log no terminal
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,22 @@
+from flask import Blueprint, jsonify
+from app.models import db, AutomacaoRecall
+from app.services.ops_auth import ops_required
+from app.task.leader import lease_status, local_elector
+
+scheduler_bp = Blueprint('scheduler', __name__)
+
+@scheduler_bp.route('/scheduler/status', methods=['GET'])
+@ops_required
+def scheduler_status():
+    """Quem é o líder do scheduler (lease no banco) e o estado deste processo (visão global: só operação)."""
+    proximo = (
+        db.session.query(db.func.min(AutomacaoRecall.next_run_at))
+        .filter(AutomacaoRecall.ativo == True)
+        .scalar()
+    )
+    elector = local_elector()
+    return jsonify({
+        'lease': lease_status(),
+        'this_process': elector.status() if elector else None,
+        'next_recall_run_at': proximo.isoformat() if proximo else None,
+    }), 200
@@ -1,24 +1,56 @@
+import asyncio
 import base64
+import logging
 import os
-from typing import Any, Dict, List, Optional, Union
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional, Union
 
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+    import httpx
 except Exception:  # pragma: no cover
     OpenAI = None
+    AsyncOpenAI = None
 
+logger = logging.getLogger(__name__)
 
 _DEFAULT_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 _DEFAULT_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.4"))
 
+# Pool HTTP / limites
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "50"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+OPENAI_MAX_CONCURRENCY_PER_CLINIC = int(os.getenv("OPENAI_MAX_CONCURRENCY_PER_CLINIC", "4"))
+OPENAI_DEFAULT_DEADLINE_SECONDS = float(os.getenv("OPENAI_DEADLINE_SECONDS", "25"))
+
+# Streaming: primeira mensagem na primeira frase completa; as seguintes agrupam frases até ~N caracteres
+AI_STREAM_FIRST_MIN_CHARS = int(os.getenv("AI_STREAM_FIRST_MIN_CHARS", "20"))
+AI_STREAM_MIN_CHARS = int(os.getenv("AI_STREAM_MIN_CHARS", "160"))
+
+
+class AIDeadlineExceeded(TimeoutError):
+    """A completion não terminou dentro do prazo (inclui a espera pelos semáforos)."""
+
+
+_client = None
+_client_lock = threading.Lock()
+
 
 def get_openai_client() -> "OpenAI":
-    """Retorna o client OpenAI (lazy).
+    """Retorna o client OpenAI (lazy, compartilhado pelo processo: pool de conexões + keep-alive).
 
     Requisitos:
       - OPENAI_API_KEY no ambiente
       - pacote openai instalado
     """
+    global _client
     if OpenAI is None:
         raise RuntimeError("Dependência 'openai' não encontrada. Garanta 'openai' no requirements.")
 
@@ -26,7 +58,21 @@ def get_openai_client() -> "OpenAI":
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY não está configurada no ambiente.")
 
-    return OpenAI(api_key=api_key)
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=api_key,
+                    timeout=OPENAI_TIMEOUT_SECONDS,
+                    max_retries=OPENAI_MAX_RETRIES,
+                    http_client=DefaultHttpxClient(
+                        limits=httpx.Limits(
+                            max_connections=OPENAI_MAX_CONNECTIONS,
+                            max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                        )
+                    ),
+                )
+    return _client
 
 
 def _extract_overrides(history: Optional[Union[List[Dict[str, Any]], Dict[str, Any]]]):
@@ -35,6 +81,7 @@ def _extract_overrides(history: Optional[Union[List[Dict[str, Any]], Dict[str, A
     Aceita:
       - history: list[{'role','content'}]
       - history: {'messages': [...], 'model': '...', 'temperature': 0.4, 'max_tokens': 300}
+        ('prepared': True pula a validação/corte do histórico)
     """
     if isinstance(history, dict):
         msgs = history.get("messages")
@@ -53,15 +100,19 @@ def _extract_overrides(history: Optional[Union[List[Dict[str, Any]], Dict[str, A
     return [], _DEFAULT_MODEL, _DEFAULT_TEMPERATURE, 350
 
 
-def chat_reply(system_prompt: str, user_text: str, history: Optional[Union[List[Dict[str, Any]], Dict[str, Any]]] = None) -> str:
-    """Resposta de chat (texto) via OpenAI."""
-    client = get_openai_client()
+def _build_chat_request(system_prompt: str, user_text: str, history) -> Dict[str, Any]:
     hist, model, temperature, max_tokens = _extract_overrides(history)
 
     messages: List[Dict[str, Any]] = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
 
+    if isinstance(history, dict) and history.get("prepared"):
+        # histórico já validado e cortado pelo chamador (prompt_builder)
+        messages.extend(hist)
+        messages.append({"role": "user", "content": (user_text or "").strip()[:8000]})
+        return {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+
     for item in hist:
         if not isinstance(item, dict):
             continue
@@ -71,14 +122,92 @@ def chat_reply(system_prompt: str, user_text: str, history: Optional[Union[List[
             messages.append({"role": role, "content": content[:6000]})
 
     messages.append({"role": "user", "content": (user_text or "").strip()[:8000]})
+    return {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
 
-    resp = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=max_tokens,
-    )
-    return (resp.choices[0].message.content or "").strip()
+
+# fim de frase: pontuação + (aspas/parênteses/emoji) + espaço. "R$ 1.500" não corta.
+_RE_SENTENCE_END = re.compile(r"[.!?…]+(?:[\"')\]]|\s*[\u2600-\u27BF\U0001F300-\U0001FAFF]\ufe0f?)*\s+")
+
+
+class SentenceChunker:
+    """Quebra o texto que chega em streaming em mensagens de WhatsApp.
+
+    A primeira sai na primeira frase completa (>= AI_STREAM_FIRST_MIN_CHARS);
+    as demais em fim de parágrafo ou na primeira frase completa depois de
+    AI_STREAM_MIN_CHARS, para não virar uma rajada de balões.
+    """
+
+    def __init__(self, first_min_chars: int = AI_STREAM_FIRST_MIN_CHARS, min_chars: int = AI_STREAM_MIN_CHARS):
+        self.first_min_chars = first_min_chars
+        self.min_chars = min_chars
+        self.buf = ""
+        self.emitted = 0
+
+    def _cut_point(self) -> Optional[int]:
+        idx = self.buf.find("\n\n")
+        if idx >= self.first_min_chars:
+            return idx + 2
+        min_len = self.first_min_chars if self.emitted == 0 else self.min_chars
+        if len(self.buf) < min_len:
+            return None
+        for m in _RE_SENTENCE_END.finditer(self.buf):
+            if m.end() >= min_len:
+                return m.end()
+        return None
+
+    def feed(self, delta: str) -> List[str]:
+        self.buf += delta or ""
+        out = []
+        while True:
+            cut = self._cut_point()
+            if cut is None:
+                break
+            piece, self.buf = self.buf[:cut].strip(), self.buf[cut:].lstrip()
+            if piece:
+                out.append(piece)
+                self.emitted += 1
+        return out
+
+    def flush(self) -> List[str]:
+        piece, self.buf = self.buf.strip(), ""
+        if piece:
+            self.emitted += 1
+            return [piece]
+        return []
+
+
+def chat_reply(
+    system_prompt: str,
+    user_text: str,
+    history: Optional[Union[List[Dict[str, Any]], Dict[str, Any]]] = None,
+    on_chunk: Optional[Callable[[str], Any]] = None,
+) -> str:
+    """Resposta de chat (texto) via OpenAI.
+
+    Com `on_chunk`, usa streaming: cada frase/parágrafo completo é entregue
+    ao callback assim que chega (ver `SentenceChunker`). Retorna o texto todo.
+    """
+    client = get_openai_client()
+    request = _build_chat_request(system_prompt, user_text, history)
+    if on_chunk is None:
+        resp = client.chat.completions.create(**request)
+        return (resp.choices[0].message.content or "").strip()
+
+    chunker = SentenceChunker()
+    parts: List[str] = []
+    stream = client.chat.completions.create(stream=True, **request)
+    try:
+        for event in stream:
+            delta = event.choices[0].delta.content if event.choices else None
+            if delta:
+                parts.append(delta)
+                for piece in chunker.feed(delta):
+                    on_chunk(piece)
+    finally:
+        stream.close()
+    for piece in chunker.flush():
+        on_chunk(piece)
+    return "".join(parts).strip()
 
 
 def vision_reply(system_prompt: str, user_text: str, image_bytes: bytes, image_mime: str) -> str:
@@ -116,3 +245,244 @@ def vision_reply(system_prompt: str, user_text: str, image_bytes: bytes, image_m
         max_tokens=max_tokens,
     )
     return (resp.choices[0].message.content or "").strip()
+
+
+# =========================================================
+# Caminho assíncrono
+# =========================================================
+# Um único event loop em background (thread "openai-loop") com um AsyncOpenAI
+# compartilhado: dezenas de completions em andamento multiplexadas num só
+# thread, limitadas por um semáforo global e um por clínica. Threads síncronas
+# (workers do webhook, rotas Flask) usam `submit_chat_reply` / `chat_reply_with_deadline`.
+
+class _AsyncAI:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.client = None
+        self.global_sem = None
+        self.clinic_sems: Dict[Any, asyncio.Semaphore] = {}
+        self.stats = {"started": 0, "completed": 0, "failed": 0, "timeouts": 0, "cancelled": 0,
+                      "in_flight": 0, "waiting": 0, "latency_ms_last": 0.0, "latency_ms_avg": 0.0}
+        self.thread = threading.Thread(target=self._run, name="openai-loop", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.global_sem = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+        self.loop.run_forever()
+
+    def get_client(self) -> "AsyncOpenAI":
+        if self.client is None:
+            api_key = os.getenv("OPENAI_API_KEY")
+            if AsyncOpenAI is None:
+                raise RuntimeError("Dependência 'openai' não encontrada. Garanta 'openai' no requirements.")
+            if not api_key:
+                raise RuntimeError("OPENAI_API_KEY não está configurada no ambiente.")
+            self.client = AsyncOpenAI(
+                api_key=api_key,
+                timeout=OPENAI_TIMEOUT_SECONDS,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                    )
+                ),
+            )
+        return self.client
+
+    def clinic_sem(self, clinic_id) -> asyncio.Semaphore:
+        sem = self.clinic_sems.get(clinic_id)
+        if sem is None:
+            sem = self.clinic_sems[clinic_id] = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY_PER_CLINIC)
+        return sem
+
+
+_async_ai: Optional[_AsyncAI] = None
+_async_lock = threading.Lock()
+
+
+def _get_async_ai() -> _AsyncAI:
+    global _async_ai
+    if _async_ai is None:
+        with _async_lock:
+            if _async_ai is None:
+                _async_ai = _AsyncAI()
+    return _async_ai
+
+
+async def _limited_completion(ai: _AsyncAI, clinic_id, request: Dict[str, Any], on_delta=None) -> str:
+    ai.stats["waiting"] += 1
+    try:
+        await ai.global_sem.acquire()
+    finally:
+        ai.stats["waiting"] -= 1
+    try:
+        async with ai.clinic_sem(clinic_id):
+            ai.stats["in_flight"] += 1
+            try:
+                if on_delta is None:
+                    resp = await ai.get_client().chat.completions.create(**request)
+                    return (resp.choices[0].message.content or "").strip()
+
+                parts: List[str] = []
+                stream = await ai.get_client().chat.completions.create(stream=True, **request)
+                try:
+                    async for event in stream:
+                        delta = event.choices[0].delta.content if event.choices else None
+                        if delta:
+                            parts.append(delta)
+                            on_delta(delta)
+                finally:
+                    await stream.close()
+                return "".join(parts).strip()
+            finally:
+                ai.stats["in_flight"] -= 1
+    finally:
+        ai.global_sem.release()
+
+
+async def achat_reply(
+    system_prompt: str,
+    user_text: str,
+    history: Optional[Union[List[Dict[str, Any]], Dict[str, Any]]] = None,
+    clinic_id=None,
+    deadline: Optional[float] = None,
+    on_delta: Optional[Callable[[str], Any]] = None,
+) -> str:
+    """Versão assíncrona de `chat_reply` (executa no loop do módulo, pode ser aguardada de qualquer loop).
+
+    `deadline` (segundos) vale para tudo: espera nos semáforos + completion.
+    Estourou o prazo: a requisição HTTP é cancelada e levanta `AIDeadlineExceeded`.
+    Cancelar a task (ou o Future de `submit_chat_reply`) também aborta a requisição.
+    `on_delta` liga o streaming e recebe cada pedaço de texto no thread do loop
+    (deve ser barato: ex. `queue.put_nowait`).
+    """
+    ai = _get_async_ai()
+    if asyncio.get_running_loop() is not ai.loop:
+        # semáforos pertencem ao loop do módulo: delega e aguarda daqui
+        fut = submit_chat_reply(system_prompt, user_text, history, clinic_id=clinic_id, deadline=deadline, on_delta=on_delta)
+        return await asyncio.wrap_future(fut)
+
+    request = _build_chat_request(system_prompt, user_text, history)
+    timeout = OPENAI_DEFAULT_DEADLINE_SECONDS if deadline is None else deadline
+
+    ai.stats["started"] += 1
+    t0 = time.perf_counter()
+    try:
+        out = await asyncio.wait_for(_limited_completion(ai, clinic_id, request, on_delta), timeout=timeout)
+    except asyncio.TimeoutError:
+        ai.stats["timeouts"] += 1
+        raise AIDeadlineExceeded(f"OpenAI não respondeu em {timeout:.1f}s (clínica {clinic_id})")
+    except asyncio.CancelledError:
+        ai.stats["cancelled"] += 1
+        raise
+    except Exception:
+        ai.stats["failed"] += 1
+        raise
+
+    elapsed = (time.perf_counter() - t0) * 1000
+    ai.stats["completed"] += 1
+    ai.stats["latency_ms_last"] = round(elapsed, 1)
+    n = ai.stats["completed"]
+    ai.stats["latency_ms_avg"] = round(elapsed if n == 1 else ai.stats["latency_ms_avg"] * 0.9 + elapsed * 0.1, 1)
+    return out
+
+
+def submit_chat_reply(
+    system_prompt: str,
+    user_text: str,
+    history=None,
+    clinic_id=None,
+    deadline: Optional[float] = None,
+    on_delta: Optional[Callable[[str], Any]] = None,
+) -> Future:
+    """Agenda `achat_reply` no loop do módulo a partir de uma thread comum. `future.cancel()` aborta a chamada."""
+    ai = _get_async_ai()
+    return asyncio.run_coroutine_threadsafe(
+        achat_reply(system_prompt, user_text, history, clinic_id=clinic_id, deadline=deadline, on_delta=on_delta),
+        ai.loop,
+    )
+
+
+_STREAM_DONE = object()
+
+
+def chat_reply_with_deadline(
+    system_prompt: str,
+    user_text: str,
+    history=None,
+    clinic_id=None,
+    deadline: Optional[float] = None,
+    on_chunk: Optional[Callable[[str], Any]] = None,
+) -> str:
+    """Como `chat_reply`, mas passando pelos limites de concorrência e com prazo máximo.
+
+    Com `on_chunk`, usa streaming e chama o callback no thread de quem chamou
+    (pode fazer I/O e usar o app context) a cada frase/parágrafo completo.
+    """
+    timeout = OPENAI_DEFAULT_DEADLINE_SECONDS if deadline is None else deadline
+    if on_chunk is None:
+        fut = submit_chat_reply(system_prompt, user_text, history, clinic_id=clinic_id, deadline=timeout)
+        try:
+            # margem pequena: o próprio loop levanta AIDeadlineExceeded no prazo
+            return fut.result(timeout=timeout + 1)
+        except FutureTimeout:
+            fut.cancel()
+            raise AIDeadlineExceeded(f"OpenAI não respondeu em {timeout:.1f}s (clínica {clinic_id})")
+
+    deltas: "queue.Queue" = queue.Queue()
+    fut = submit_chat_reply(
+        system_prompt, user_text, history, clinic_id=clinic_id, deadline=timeout, on_delta=deltas.put_nowait
+    )
+    fut.add_done_callback(lambda _f: deltas.put_nowait(_STREAM_DONE))
+
+    chunker = SentenceChunker()
+    limit = time.monotonic() + timeout + 1
+    while True:
+        try:
+            delta = deltas.get(timeout=max(limit - time.monotonic(), 0.01))
+        except queue.Empty:
+            fut.cancel()
+            raise AIDeadlineExceeded(f"OpenAI não respondeu em {timeout:.1f}s (clínica {clinic_id})")
+        if delta is _STREAM_DONE:
+            break
+        for piece in chunker.feed(delta):
+            on_chunk(piece)
+
+    out = fut.result()  # propaga AIDeadlineExceeded / erro da API
+    for piece in chunker.flush():
+        on_chunk(piece)
+    return out
+
+
+_ttfm: Dict[Any, Dict[str, float]] = {}
+_ttfm_lock = threading.Lock()
+
+
+def record_time_to_first_message(clinic_id, ms: float):
+    """Tempo até a primeira mensagem enviada (streaming), por clínica."""
+    with _ttfm_lock:
+        item = _ttfm.get(clinic_id)
+        if item is None:
+            if len(_ttfm) >= 1000:
+                _ttfm.pop(next(iter(_ttfm)))
+            item = _ttfm[clinic_id] = {"count": 0, "avg_ms": 0.0, "last_ms": 0.0}
+        item["count"] += 1
+        item["last_ms"] = round(ms, 1)
+        item["avg_ms"] = round(ms if item["count"] == 1 else item["avg_ms"] * 0.9 + ms * 0.1, 1)
+
+
+def ai_stats() -> dict:
+    with _ttfm_lock:
+        ttfm = {str(k): dict(v) for k, v in _ttfm.items()}
+    if _async_ai is None:
+        return {"async_loop": False, "time_to_first_message": ttfm}
+    data = dict(_async_ai.stats)
+    data["time_to_first_message"] = ttfm
+    data.update({
+        "async_loop": _async_ai.thread.is_alive(),
+        "max_concurrency": OPENAI_MAX_CONCURRENCY,
+        "max_concurrency_per_clinic": OPENAI_MAX_CONCURRENCY_PER_CLINIC,
+    })
+    return data
@@ -0,0 +1,228 @@
+"""Cache de respostas da IA para perguntas frequentes (por clínica, por processo).
+
+Chave: pergunta normalizada + hash da config de IA da clínica (prompt,
+procedimentos, política de agendamento, modelo). Mudou a config, muda o
+hash e as respostas antigas deixam de casar; `invalidate_ai_responses` é
+chamado junto com `invalidate_clinic` para liberar a memória na hora.
+
+Busca em duas etapas, sem serviço externo:
+  1. exata (pergunta normalizada igual);
+  2. similaridade de tokens (Jaccard sem stopwords) >= AI_CACHE_SIMILARITY.
+
+O nome do paciente é trocado por um marcador ao gravar e reposto na leitura.
+Perguntas com números (datas, horários, telefone, CPF) ou longas demais não
+são cacheadas: costumam ser pessoais. Perguntas com menos de
+AI_CACHE_MIN_CONTENT_TOKENS palavras de conteúdo ("sim", "e quanto custa?")
+também não: a resposta depende da conversa. Quem chama (`_ai_reply`) só
+usa o cache na primeira mensagem da sessão, sem histórico antes.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+from app.services.prompt_builder import settings_hash
+
+logger = logging.getLogger(__name__)
+
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "1") == "1"
+AI_CACHE_TTL_SECONDS = float(os.getenv("AI_CACHE_TTL_SECONDS", str(6 * 3600)))
+AI_CACHE_MAX_PER_CLINIC = int(os.getenv("AI_CACHE_MAX_PER_CLINIC", "200"))
+AI_CACHE_MAX_CLINICS = int(os.getenv("AI_CACHE_MAX_CLINICS", "500"))
+AI_CACHE_SIMILARITY = float(os.getenv("AI_CACHE_SIMILARITY", "0.8"))
+AI_CACHE_MAX_QUESTION_CHARS = int(os.getenv("AI_CACHE_MAX_QUESTION_CHARS", "160"))
+AI_CACHE_MIN_CONTENT_TOKENS = int(os.getenv("AI_CACHE_MIN_CONTENT_TOKENS", "3"))
+
+NAME_PLACEHOLDER = "{{nome}}"
+
+_STOPWORDS = {
+    "a", "o", "as", "os", "um", "uma", "uns", "umas", "de", "do", "da", "dos", "das", "e", "ou",
+    "em", "no", "na", "nos", "nas", "por", "pra", "para", "pro", "com", "que", "se", "me", "te",
+    "eu", "voce", "voces", "vc", "vcs", "ai", "la", "ja", "ne", "tb", "tbm", "tambem", "so",
+    "oi", "ola", "bom", "boa", "dia", "tarde", "noite", "tudo", "bem", "obrigado", "obrigada",
+    "favor", "gostaria", "queria", "quero", "saber", "sobre", "qual", "quais",
+    "ao", "aos", "isso", "esse", "essa", "meu", "minha", "seu", "sua", "ser", "sao", "esta",
+}
+
+_RE_NON_WORD = re.compile(r"[^a-z0-9\s]")
+_RE_SPACES = re.compile(r"\s+")
+_RE_DIGIT = re.compile(r"\d")
+
+
+def normalize_question(text: str) -> str:
+    """minúsculas, sem acento, sem pontuação, espaços colapsados."""
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = _RE_NON_WORD.sub(" ", text)
+    return _RE_SPACES.sub(" ", text).strip()
+
+
+def _tokens(normalized: str) -> frozenset:
+    out = set()
+    for tok in normalized.split():
+        if tok in _STOPWORDS or len(tok) < 2:
+            continue
+        # plural simples: "implantes" ~ "implante"
+        if len(tok) > 4 and tok.endswith("s"):
+            tok = tok[:-1]
+        out.add(tok)
+    return frozenset(out)
+
+
+def _cacheable(question: str, normalized: str) -> bool:
+    return (
+        bool(normalized)
+        and len(question or "") <= AI_CACHE_MAX_QUESTION_CHARS
+        and not _RE_DIGIT.search(normalized)
+        and len(_tokens(normalized)) >= AI_CACHE_MIN_CONTENT_TOKENS
+    )
+
+
+def is_cacheable_question(question: str) -> bool:
+    """A pergunta se sustenta sozinha (tamanho, sem números, palavras de conteúdo suficientes)?"""
+    return _cacheable(question, normalize_question(question))
+
+
+class AIResponseCache:
+    def __init__(self):
+        # (clinic_id, settings_hash) -> OrderedDict[normalized -> entry]
+        self._buckets: "OrderedDict[tuple, OrderedDict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_data = {
+            "hits_exact": 0, "hits_similar": 0, "misses": 0, "stores": 0,
+            "skipped": 0, "evictions": 0, "saved_ms": 0.0,
+        }
+
+    def _bucket(self, key, create: bool = False) -> Optional[OrderedDict]:
+        bucket = self._buckets.get(key)
+        if bucket is None and create:
+            bucket = self._buckets[key] = OrderedDict()
+            while len(self._buckets) > AI_CACHE_MAX_CLINICS:
+                _, dropped = self._buckets.popitem(last=False)
+                self.stats_data["evictions"] += len(dropped)
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def lookup(self, clinic_id, cfg: dict, question: str, push_name: str = "") -> Optional[str]:
+        normalized = normalize_question(question)
+        if not _cacheable(question, normalized):
+            with self._lock:
+                self.stats_data["skipped"] += 1
+            return None
+
+        key = (clinic_id, settings_hash(cfg))
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(key)
+            entry, kind = None, None
+            if bucket:
+                entry = bucket.get(normalized)
+                if entry is not None:
+                    kind = "hits_exact"
+                else:
+                    toks = _tokens(normalized)
+                    best = 0.0
+                    if toks:
+                        for cand in bucket.values():
+                            if cand["expires"] < now or not cand["tokens"]:
+                                continue
+                            inter = len(toks & cand["tokens"])
+                            if not inter:
+                                continue
+                            score = inter / len(toks | cand["tokens"])
+                            if score > best:
+                                best, entry = score, cand
+                    if best >= AI_CACHE_SIMILARITY:
+                        kind = "hits_similar"
+                    else:
+                        entry = None
+
+                if entry is not None and entry["expires"] < now:
+                    bucket.pop(entry["normalized"], None)
+                    entry = None
+
+            if entry is None:
+                self.stats_data["misses"] += 1
+                return None
+
+            bucket.move_to_end(entry["normalized"])
+            entry["hits"] += 1
+            self.stats_data[kind] += 1
+            self.stats_data["saved_ms"] += entry["latency_ms"]
+            reply = entry["reply"]
+
+        return reply.replace(NAME_PLACEHOLDER, push_name or "")
+
+    def store(self, clinic_id, cfg: dict, question: str, reply: str, push_name: str = "", latency_ms: float = 0.0):
+        normalized = normalize_question(question)
+        if not reply or not _cacheable(question, normalized):
+            return
+
+        template = reply.replace(push_name, NAME_PLACEHOLDER) if push_name and len(push_name) >= 2 else reply
+        key = (clinic_id, settings_hash(cfg))
+        with self._lock:
+            bucket = self._bucket(key, create=True)
+            bucket[normalized] = {
+                "normalized": normalized,
+                "tokens": _tokens(normalized),
+                "reply": template,
+                "latency_ms": float(latency_ms or 0.0),
+                "expires": time.monotonic() + AI_CACHE_TTL_SECONDS,
+                "hits": 0,
+            }
+            bucket.move_to_end(normalized)
+            while len(bucket) > AI_CACHE_MAX_PER_CLINIC:
+                bucket.popitem(last=False)
+                self.stats_data["evictions"] += 1
+            self.stats_data["stores"] += 1
+
+    def invalidate(self, clinic_id=None) -> int:
+        with self._lock:
+            if clinic_id is None:
+                n = sum(len(b) for b in self._buckets.values())
+                self._buckets.clear()
+                return n
+            keys = [k for k in self._buckets if str(k[0]) == str(clinic_id)]
+            n = 0
+            for k in keys:
+                n += len(self._buckets.pop(k))
+            return n
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self.stats_data)
+            data["entries"] = sum(len(b) for b in self._buckets.values())
+            data["clinics"] = len({k[0] for k in self._buckets})
+        hits = data["hits_exact"] + data["hits_similar"]
+        total = hits + data["misses"]
+        data["hit_rate"] = round(hits / total, 3) if total else 0.0
+        data["saved_ms"] = round(data["saved_ms"], 1)
+        data["enabled"] = AI_CACHE_ENABLED
+        return data
+
+
+_cache = AIResponseCache()
+
+
+def get_cached_reply(clinic_id, cfg: dict, question: str, push_name: str = "") -> Optional[str]:
+    if not AI_CACHE_ENABLED:
+        return None
+    return _cache.lookup(clinic_id, cfg, question, push_name)
+
+
+def store_reply(clinic_id, cfg: dict, question: str, reply: str, push_name: str = "", latency_ms: float = 0.0):
+    if AI_CACHE_ENABLED:
+        _cache.store(clinic_id, cfg, question, reply, push_name, latency_ms)
+
+
+def invalidate_ai_responses(clinic_id=None) -> int:
+    return _cache.invalidate(clinic_id)
+
+
+def ai_cache_stats() -> dict:
+    return _cache.stats()
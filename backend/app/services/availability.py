@@ -0,0 +1,266 @@
+"""Disponibilidade da agenda em memória (uma consulta por busca).
+
+`AvailabilityIndex.load` traz de uma vez só os agendamentos (início/fim)
+da clínica que cruzam a janela pedida e monta a lista ordenada de
+intervalos *bloqueados* (onde a ocupação simultânea chega à capacidade).
+A partir dela:
+  - `is_free(start, end)`: busca binária, O(log n);
+  - `next_free_slots(after, duration_min, limit, days)`: percorre a grade de
+    horários pulando direto para o fim de cada bloqueio, inclusive nos dias
+    seguintes;
+  - `free_intervals(start, end, min_minutes)`: trechos livres (expediente
+    menos bloqueios), para o endpoint de disponibilidade.
+
+Expediente vem de `clinics.business_hours` (por dia da semana, vários
+turnos por dia) e a capacidade de `clinics.max_dentists`: um horário só fica
+bloqueado quando todos os dentistas estão ocupados.
+
+Horários são naive no fuso de São Paulo, igual ao resto da agenda; entrada
+com fuso passa por `to_agenda_time` antes de consultar ou gravar.
+"""
+from bisect import bisect_right
+from datetime import datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from app.models import Appointment
+from app.services.clinic_cache import get_clinic_snapshot
+
+TZ_SP = ZoneInfo("America/Sao_Paulo")
+
+DEFAULT_OPEN = time(8, 0)
+DEFAULT_CLOSE = time(19, 0)
+SLOT_STEP_MINUTES = 30
+MIN_DURATION_MINUTES = 15
+
+Interval = Tuple[datetime, datetime]
+Hours = Dict[int, List[Tuple[time, time]]]
+
+WEEKDAY_KEYS = ["seg", "ter", "qua", "qui", "sex", "sab", "dom"]
+
+# sem expediente cadastrado: segunda a sábado, 08:00–19:00
+DEFAULT_BUSINESS_HOURS: Hours = {wd: [(DEFAULT_OPEN, DEFAULT_CLOSE)] for wd in range(6)}
+DEFAULT_BUSINESS_HOURS[6] = []
+
+
+def to_agenda_time(dt: datetime) -> datetime:
+    """Converte data com fuso (ex: "...Z" vindo do painel) para o naive de SP da agenda; naive passa direto."""
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(TZ_SP).replace(tzinfo=None)
+
+
+def _parse_hhmm(value) -> time:
+    hh, mm = str(value).strip().split(":")[:2]
+    return time(int(hh), int(mm))
+
+
+def parse_business_hours(raw) -> Hours:
+    """{"seg": [["08:00", "12:00"], ["13:00", "18:00"]], ..., "dom": []} -> {0: [(time, time), ...], ...}
+
+    Dia ausente = fechado. Levanta ValueError se o formato for inválido.
+    Vazio/None = DEFAULT_BUSINESS_HOURS.
+    """
+    if not raw:
+        return DEFAULT_BUSINESS_HOURS
+    if not isinstance(raw, dict):
+        raise ValueError("business_hours deve ser um objeto {dia: [[inicio, fim], ...]}")
+
+    unknown = set(raw) - set(WEEKDAY_KEYS)
+    if unknown:
+        raise ValueError(f"dias inválidos em business_hours: {sorted(unknown)} (use {WEEKDAY_KEYS})")
+
+    hours: Hours = {}
+    for wd, key in enumerate(WEEKDAY_KEYS):
+        shifts = []
+        for shift in raw.get(key) or []:
+            try:
+                start, end = _parse_hhmm(shift[0]), _parse_hhmm(shift[1])
+            except (TypeError, ValueError, IndexError):
+                raise ValueError(f"turno inválido em business_hours.{key}: {shift!r} (use ['08:00', '12:00'])")
+            if start >= end:
+                raise ValueError(f"turno inválido em business_hours.{key}: início deve ser antes do fim")
+            shifts.append((start, end))
+        shifts.sort()
+        for (_, prev_end), (nxt_start, _) in zip(shifts, shifts[1:]):
+            if nxt_start < prev_end:
+                raise ValueError(f"turnos sobrepostos em business_hours.{key}")
+        hours[wd] = shifts
+    return hours
+
+
+def business_hours_to_json(hours: Hours) -> dict:
+    return {
+        key: [[s.strftime("%H:%M"), e.strftime("%H:%M")] for s, e in hours.get(wd, [])]
+        for wd, key in enumerate(WEEKDAY_KEYS)
+    }
+
+
+def _ceil_to_step(dt: datetime, step_min: int) -> datetime:
+    dt = dt.replace(second=0, microsecond=0)
+    rest = (dt.hour * 60 + dt.minute) % step_min
+    return dt + timedelta(minutes=step_min - rest) if rest else dt
+
+
+def blocked_intervals(intervals: Iterable[Interval], capacity: int = 1) -> List[Interval]:
+    """Trechos [início, fim) em que há `capacity` ou mais agendamentos ao mesmo tempo.
+
+    Varredura por eventos (+1 no início, -1 no fim; fim antes de início no
+    mesmo instante, porque os intervalos são semiabertos). Trechos
+    encostados saem unidos.
+    """
+    capacity = max(int(capacity or 1), 1)
+    events = []
+    for start, end in intervals:
+        if start < end:
+            events.append((start, 1))
+            events.append((end, -1))
+    events.sort(key=lambda e: (e[0], e[1]))
+
+    blocked: List[Interval] = []
+    level = 0
+    opened: Optional[datetime] = None
+    for at, delta in events:
+        level += delta
+        if opened is None and level >= capacity:
+            opened = at
+        elif opened is not None and level < capacity:
+            if opened < at:
+                if blocked and blocked[-1][1] >= opened:
+                    blocked[-1] = (blocked[-1][0], at)
+                else:
+                    blocked.append((opened, at))
+            opened = None
+    return blocked
+
+
+class AvailabilityIndex:
+    def __init__(self, intervals: Iterable[Interval], capacity: int = 1, hours: Optional[Hours] = None):
+        self.capacity = max(int(capacity or 1), 1)
+        self.hours = hours if hours is not None else DEFAULT_BUSINESS_HOURS
+        self.blocked = blocked_intervals(intervals, self.capacity)
+        self._starts = [b[0] for b in self.blocked]
+
+    @classmethod
+    def load(
+        cls,
+        clinic_id: int,
+        window_start: datetime,
+        window_end: datetime,
+        exclude_appointment_id: Optional[int] = None,
+        capacity: int = 1,
+        **kwargs,
+    ) -> "AvailabilityIndex":
+        """Uma consulta: só início/fim dos agendamentos não cancelados que cruzam a janela."""
+        q = Appointment.query.with_entities(Appointment.start_datetime, Appointment.end_datetime).filter(
+            Appointment.clinic_id == clinic_id,
+            Appointment.start_datetime < window_end,
+            Appointment.end_datetime > window_start,
+            Appointment.status != "cancelled",
+        )
+        if exclude_appointment_id:
+            q = q.filter(Appointment.id != exclude_appointment_id)
+        return cls(((s, e) for s, e in q.all()), capacity=capacity, **kwargs)
+
+    @classmethod
+    def load_for_clinic(
+        cls,
+        clinic_id: int,
+        window_start: datetime,
+        window_end: datetime,
+        exclude_appointment_id: Optional[int] = None,
+    ) -> "AvailabilityIndex":
+        """Como `load`, com capacidade (max_dentists) e expediente da clínica (snapshot em cache)."""
+        snap = get_clinic_snapshot(clinic_id) or {}
+        try:
+            hours = parse_business_hours(snap.get("business_hours"))
+        except ValueError:
+            hours = DEFAULT_BUSINESS_HOURS
+        return cls.load(
+            clinic_id, window_start, window_end,
+            exclude_appointment_id=exclude_appointment_id,
+            capacity=snap.get("max_dentists") or 1,
+            hours=hours,
+        )
+
+    def open_windows(self, start: datetime, end: datetime) -> List[Interval]:
+        """Turnos de expediente recortados para [start, end)."""
+        out: List[Interval] = []
+        day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day < end:
+            for open_t, close_t in self.hours.get(day.weekday(), []):
+                w_start = max(datetime.combine(day.date(), open_t), start)
+                w_end = min(datetime.combine(day.date(), close_t), end)
+                if w_start < w_end:
+                    out.append((w_start, w_end))
+            day += timedelta(days=1)
+        return out
+
+    def free_intervals(self, start: datetime, end: datetime, min_minutes: int = 0) -> List[Interval]:
+        """Trechos livres (expediente menos bloqueios) em [start, end) com pelo menos `min_minutes`.
+
+        Varre turnos e bloqueios juntos (ambos ordenados): O(turnos + bloqueios).
+        """
+        min_len = timedelta(minutes=max(int(min_minutes or 0), 0))
+        out: List[Interval] = []
+        i = max(bisect_right(self._starts, start) - 1, 0)
+        for w_start, w_end in self.open_windows(start, end):
+            cursor = w_start
+            while i < len(self.blocked) and self.blocked[i][1] <= cursor:
+                i += 1
+            j = i
+            while j < len(self.blocked) and self.blocked[j][0] < w_end:
+                b_start, b_end = self.blocked[j]
+                if b_start > cursor and b_start - cursor >= min_len:
+                    out.append((cursor, b_start))
+                cursor = max(cursor, b_end)
+                if cursor >= w_end:
+                    break
+                j += 1
+            if cursor < w_end and w_end - cursor >= min_len:
+                out.append((cursor, w_end))
+        return [iv for iv in out if iv[1] - iv[0] > timedelta(0)]
+
+    def _blocking(self, start: datetime, end: datetime) -> Optional[Interval]:
+        """Primeiro bloqueio que cruza [start, end), ou None."""
+        i = bisect_right(self._starts, start) - 1
+        if i >= 0 and self.blocked[i][1] > start:
+            return self.blocked[i]
+        if i + 1 < len(self.blocked) and self._starts[i + 1] < end:
+            return self.blocked[i + 1]
+        return None
+
+    def is_free(self, start: datetime, end: datetime) -> bool:
+        return self._blocking(start, end) is None
+
+    def next_free_slots(
+        self,
+        after: datetime,
+        duration_min: int = 30,
+        limit: int = 3,
+        days: int = 1,
+        step_min: int = SLOT_STEP_MINUTES,
+    ) -> List[Interval]:
+        """Próximos `limit` horários livres (na grade de `step_min`) a partir de `after`,
+        dentro dos turnos de expediente, olhando até `days` dias (o de `after` incluído)."""
+        duration = timedelta(minutes=max(int(duration_min or 30), MIN_DURATION_MINUTES))
+        slots: List[Interval] = []
+        first_day = after.replace(hour=0, minute=0, second=0, microsecond=0)
+        last_day = first_day + timedelta(days=max(int(days), 1))
+
+        for w_start, w_end in self.open_windows(first_day, last_day):
+            if w_end <= after:
+                continue
+            cursor = _ceil_to_step(max(after, w_start), step_min)
+            while len(slots) < limit and cursor + duration <= w_end:
+                slot_end = cursor + duration
+                block = self._blocking(cursor, slot_end)
+                if block is None:
+                    slots.append((cursor, slot_end))
+                    cursor += timedelta(minutes=step_min)
+                else:
+                    # pula o bloqueio inteiro de uma vez
+                    cursor = _ceil_to_step(max(block[1], cursor + timedelta(minutes=1)), step_min)
+            if len(slots) >= limit:
+                break
+        return slots
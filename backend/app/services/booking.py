@@ -0,0 +1,118 @@
+"""Reserva de horário atômica (checagem de conflito + gravação na mesma transação).
+
+Antes, o chatbot fazia SELECT de conflito e depois INSERT: duas mensagens
+(ou o painel e o WhatsApp) ao mesmo tempo passavam as duas pela checagem e
+gravavam o mesmo horário. Agora quem vai gravar chama `reserve_slot` dentro
+da transação do agendamento:
+
+  1. atualiza a linha da clínica em `booking_locks` — no Postgres é um lock
+     de linha, no SQLite pega o lock de escrita do banco. Quem chegar depois
+     espera o commit/rollback de quem está reservando;
+  2. confere o horário no `AvailabilityIndex` (capacidade = max_dentists,
+     expediente da clínica) já com o lock na mão;
+  3. o chamador grava e faz commit, o que solta o lock.
+
+Conflito vira `SlotUnavailable`, com as próximas alternativas livres.
+
+Por que não uma exclusion constraint (`EXCLUDE USING gist (clinic_id WITH =,
+tsrange(start, end) WITH &&)`): a clínica atende `max_dentists` pacientes ao
+mesmo tempo e o agendamento não tem dentista/cadeira, então sobreposição é
+legítima até a capacidade — a constraint só sabe dizer "nenhuma". O lock por
+clínica só serializa quem grava agendamento daquela clínica; leituras e as
+outras clínicas não esperam.
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from app.models import db
+from app.services.availability import TZ_SP, AvailabilityIndex, Interval, to_agenda_time
+
+logger = logging.getLogger(__name__)
+
+# conflito de horário: sugestões no mesmo dia e, se faltar, nos próximos N dias
+AGENDA_SUGGEST_DAYS = int(os.getenv("AGENDA_SUGGEST_DAYS", "7"))
+BOOKING_ALTERNATIVES = 3
+
+
+class SlotUnavailable(Exception):
+    """Horário pedido já está lotado (todos os dentistas ocupados)."""
+
+    def __init__(self, start_dt: datetime, end_dt: datetime, alternatives: List[Interval]):
+        super().__init__(f"horário indisponível: {start_dt.isoformat()} - {end_dt.isoformat()}")
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.alternatives = alternatives
+
+    def to_dict(self) -> dict:
+        return {
+            "error": "conflict",
+            "message": "Horário indisponível.",
+            "start": self.start_dt.isoformat(),
+            "end": self.end_dt.isoformat(),
+            "alternatives": [{"start": s.isoformat(), "end": e.isoformat()} for s, e in self.alternatives],
+        }
+
+
+def lock_clinic_agenda(clinic_id: int) -> None:
+    """Lock exclusivo da agenda da clínica até o fim da transação atual."""
+    params = {"cid": int(clinic_id), "now": datetime.utcnow()}
+    res = db.session.execute(
+        text("UPDATE booking_locks SET version = version + 1, updated_at = :now WHERE clinic_id = :cid"),
+        params,
+    )
+    if res.rowcount:
+        return
+    # primeira reserva da clínica: cria a linha (corrida entre dois "primeiros" resolvida pelo PK)
+    db.session.execute(
+        text(
+            "INSERT INTO booking_locks (clinic_id, version, updated_at) VALUES (:cid, 0, :now) "
+            "ON CONFLICT (clinic_id) DO NOTHING"
+        ),
+        params,
+    )
+    db.session.execute(
+        text("UPDATE booking_locks SET version = version + 1, updated_at = :now WHERE clinic_id = :cid"),
+        params,
+    )
+
+
+def reserve_slot(
+    clinic_id: int,
+    start_dt: datetime,
+    end_dt: datetime,
+    exclude_appointment_id: Optional[int] = None,
+) -> None:
+    """Trava a agenda da clínica e garante que [start_dt, end_dt) cabe nela.
+
+    Deve ser chamada na mesma transação que grava o agendamento (o commit
+    do chamador solta o lock). Levanta SlotUnavailable em caso de conflito.
+    """
+    # a agenda é naive no fuso de SP (o chamador grava já convertido, com o mesmo helper)
+    start_dt, end_dt = to_agenda_time(start_dt), to_agenda_time(end_dt)
+
+    lock_clinic_agenda(clinic_id)
+
+    day = start_dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    index = AvailabilityIndex.load_for_clinic(
+        clinic_id,
+        day,
+        max(day + timedelta(days=AGENDA_SUGGEST_DAYS), end_dt),
+        exclude_appointment_id=exclude_appointment_id,
+    )
+    if index.is_free(start_dt, end_dt):
+        return
+
+    duration_min = int((end_dt - start_dt).total_seconds() // 60)
+    now_sp = datetime.now(TZ_SP).replace(tzinfo=None)
+    alternatives = index.next_free_slots(
+        max(start_dt, now_sp), duration_min, limit=BOOKING_ALTERNATIVES, days=AGENDA_SUGGEST_DAYS
+    )
+    logger.info(
+        f"⛔ Conflito de agenda clinic_id={clinic_id} start={start_dt.isoformat()} "
+        f"(capacidade {index.capacity}, {len(alternatives)} alternativas)"
+    )
+    raise SlotUnavailable(start_dt, end_dt, alternatives)
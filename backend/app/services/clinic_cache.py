@@ -0,0 +1,110 @@
+"""Resolução de clínica no caminho quente do webhook (cache com TTL).
+
+Mapeia número do dono / nome da instância -> clínica, e guarda um snapshot
+da clínica (incluindo a config de IA) para o chatbot não voltar ao banco a
+cada mensagem. Escritas nas configurações da clínica chamam
+`invalidate_clinic`; o TTL limita a defasagem entre processos.
+"""
+import logging
+import os
+from typing import Optional
+
+from app.models import Clinic
+from app.services.ai_response_cache import invalidate_ai_responses
+from app.services.prompt_builder import invalidate_prompt
+from app.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CLINIC_CACHE_TTL = float(os.getenv("CLINIC_CACHE_TTL_SECONDS", "60"))
+INSTANCE_PREFIX = "clinica_v3_"
+FALLBACK_CLINIC_ID = 1
+
+_NOT_FOUND = "__not_found__"
+
+# ("id", clinic_id) -> snapshot | _NOT_FOUND
+# ("owner", phone) -> clinic_id | _NOT_FOUND
+_cache = TTLCache(ttl_seconds=CLINIC_CACHE_TTL, max_size=4096)
+
+
+def _snapshot(clinic: Clinic) -> dict:
+    return {
+        "id": clinic.id,
+        "name": (getattr(clinic, "name", None) or "").strip(),
+        "whatsapp_number": getattr(clinic, "whatsapp_number", None),
+        "max_dentists": getattr(clinic, "max_dentists", None) or 1,
+        # ⚠️ em bancos desatualizados, alguns campos podem não existir ainda.
+        "ai_enabled": getattr(clinic, "ai_enabled", True),
+        "ai_model": getattr(clinic, "ai_model", None),
+        "ai_temperature": getattr(clinic, "ai_temperature", None),
+        "ai_system_prompt": getattr(clinic, "ai_system_prompt", None),
+        "ai_procedures": getattr(clinic, "ai_procedures", None) or getattr(clinic, "ai_procedures_json", None),
+        "ai_booking_policy": getattr(clinic, "ai_booking_policy", None),
+        "business_hours": getattr(clinic, "business_hours", None),
+    }
+
+
+def get_clinic_snapshot(clinic_id) -> Optional[dict]:
+    try:
+        clinic_id = int(clinic_id)
+    except (TypeError, ValueError):
+        return None
+
+    key = ("id", clinic_id)
+    snap = _cache.get(key)
+    if snap is None:
+        clinic = Clinic.query.get(clinic_id)
+        snap = _snapshot(clinic) if clinic else _NOT_FOUND
+        _cache.set(key, snap)
+    return None if snap == _NOT_FOUND else snap
+
+
+def _clinic_id_by_owner(owner_phone: str) -> Optional[int]:
+    key = ("owner", owner_phone)
+    cid = _cache.get(key)
+    if cid is None:
+        clinic = Clinic.query.filter_by(whatsapp_number=owner_phone).first()
+        cid = clinic.id if clinic else _NOT_FOUND
+        _cache.set(key, cid)
+        if clinic:
+            _cache.set(("id", clinic.id), _snapshot(clinic))
+    return None if cid == _NOT_FOUND else cid
+
+
+def resolve_clinic(owner_phone: str = "", instance_name: str = "") -> Optional[dict]:
+    """Mesma ordem do webhook: número do dono -> instância clinica_v3_<id> -> clínica 1."""
+    if owner_phone:
+        cid = _clinic_id_by_owner(owner_phone)
+        if cid:
+            snap = get_clinic_snapshot(cid)
+            if snap:
+                return snap
+
+    if instance_name and instance_name.startswith(INSTANCE_PREFIX):
+        snap = get_clinic_snapshot(instance_name.replace(INSTANCE_PREFIX, ""))
+        if snap:
+            return snap
+
+    return get_clinic_snapshot(FALLBACK_CLINIC_ID)
+
+
+def invalidate_clinic(clinic_id=None):
+    """Remove o snapshot da clínica, os mapeamentos de número que apontam para ela (ou para nada)
+    e o prompt compilado / respostas de IA cacheadas dela."""
+    if clinic_id is None:
+        _cache.clear()
+        invalidate_ai_responses()
+        invalidate_prompt()
+        return
+    try:
+        clinic_id = int(clinic_id)
+    except (TypeError, ValueError):
+        return
+    _cache.delete(("id", clinic_id))
+    invalidate_ai_responses(clinic_id)
+    invalidate_prompt(clinic_id)
+    _cache.delete_where(lambda k, v: k[0] == "owner" and v in (clinic_id, _NOT_FOUND))
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
@@ -0,0 +1,104 @@
+"""Executor particionado por conversa.
+
+Cada chave (ex: `clinica:telefone`) cai sempre no mesmo shard, e cada shard
+é uma única thread com fila FIFO: mensagens da mesma conversa rodam em ordem
+estrita, conversas diferentes rodam em paralelo nos outros shards.
+O hash é estável (crc32), então a distribuição é a mesma em todos os processos.
+"""
+import logging
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+def conversation_key(clinic_ref: Any, sender_id: Any) -> str:
+    return f"{clinic_ref or ''}:{sender_id or ''}"
+
+
+class _Shard:
+    def __init__(self, idx: int, name: str):
+        self.idx = idx
+        self.queue: "queue.Queue" = queue.Queue()
+        self.lock = threading.Lock()
+        self.busy = False
+        self.processed = 0
+        self.failed = 0
+        self.max_backlog = 0
+        self.wait_ms_last = 0.0
+        self.run_ms_last = 0.0
+        self.thread = threading.Thread(target=self._run, name=f"{name}-shard-{idx}", daemon=True)
+
+    def _run(self):
+        while True:
+            fut, fn, args, kwargs, enqueued_at = self.queue.get()
+            started = time.monotonic()
+            with self.lock:
+                self.busy = True
+                self.wait_ms_last = (started - enqueued_at) * 1000
+            try:
+                if fut.set_running_or_notify_cancel():
+                    fut.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                logger.exception(f"Shard {self.idx}: tarefa falhou: {e}")
+                with self.lock:
+                    self.failed += 1
+                fut.set_exception(e)
+            finally:
+                with self.lock:
+                    self.busy = False
+                    self.processed += 1
+                    self.run_ms_last = (time.monotonic() - started) * 1000
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "shard": self.idx,
+                "backlog": self.queue.qsize(),
+                "busy": self.busy,
+                "processed": self.processed,
+                "failed": self.failed,
+                "max_backlog": self.max_backlog,
+                "wait_ms_last": round(self.wait_ms_last, 1),
+                "run_ms_last": round(self.run_ms_last, 1),
+            }
+
+
+class ShardedExecutor:
+    def __init__(self, shards: int, name: str = "conversation"):
+        self.name = name
+        self._shards: List[_Shard] = [_Shard(i, name) for i in range(max(int(shards or 1), 1))]
+        for shard in self._shards:
+            shard.thread.start()
+
+    @property
+    def size(self) -> int:
+        return len(self._shards)
+
+    def shard_for(self, key: str) -> int:
+        return zlib.crc32(str(key).encode("utf-8")) % len(self._shards)
+
+    def submit(self, key: str, fn: Callable, *args, **kwargs) -> Future:
+        shard = self._shards[self.shard_for(key)]
+        fut: Future = Future()
+        shard.queue.put((fut, fn, args, kwargs, time.monotonic()))
+        with shard.lock:
+            shard.max_backlog = max(shard.max_backlog, shard.queue.qsize())
+        return fut
+
+    def backlog(self) -> int:
+        return sum(s.queue.qsize() for s in self._shards)
+
+    def stats(self) -> dict:
+        shards = [s.stats() for s in self._shards]
+        return {
+            "name": self.name,
+            "shards": shards,
+            "total_backlog": sum(s["backlog"] for s in shards),
+            "busy_shards": sum(1 for s in shards if s["busy"]),
+        }
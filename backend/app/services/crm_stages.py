@@ -0,0 +1,102 @@
+"""Registro (em memória, por clínica) das etapas do CRM.
+
+Carrega as etapas uma vez e guarda os ids usados no caminho quente:
+etapa inicial, etapa de sucesso e a etapa 'Agendado'. Quem cria/altera
+etapas chama `invalidate_stages`; o TTL cobre alterações feitas em outro processo.
+"""
+import logging
+import os
+import threading
+
+from app.models import db, CRMStage
+from app.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CRM_STAGE_CACHE_TTL = float(os.getenv("CRM_STAGE_CACHE_TTL_SECONDS", "300"))
+STAGE_AGENDADO = "Agendado"
+
+# Etapas criadas quando o primeiro lead chega pelo WhatsApp
+WEBHOOK_DEFAULT_STAGES = [
+    {"nome": "Novo Lead", "cor": "yellow", "ordem": 0, "is_initial": True},
+    {"nome": "Contactado", "cor": "blue", "ordem": 1},
+    {"nome": "Agendado", "cor": "green", "ordem": 2, "is_success": True},
+    {"nome": "Perdido", "cor": "red", "ordem": 3},
+]
+
+# Etapas criadas quando o Kanban é aberto pela primeira vez
+BOARD_DEFAULT_STAGES = [
+    {"nome": "A Contactar", "cor": "yellow", "ordem": 1, "is_initial": True},
+    {"nome": "Aguardando Resposta", "cor": "blue", "ordem": 2},
+    {"nome": "Agendado", "cor": "green", "ordem": 3, "is_success": True},
+    {"nome": "Perdido", "cor": "red", "ordem": 4},
+]
+
+_cache = TTLCache(ttl_seconds=CRM_STAGE_CACHE_TTL, max_size=4096)
+_create_lock = threading.Lock()
+
+
+def _load(clinic_id: int) -> dict:
+    rows = (
+        db.session.query(CRMStage.id, CRMStage.nome, CRMStage.is_initial, CRMStage.is_success)
+        .filter(CRMStage.clinic_id == clinic_id)
+        .order_by(CRMStage.ordem, CRMStage.id)
+        .all()
+    )
+    registry = {
+        "ids": [r.id for r in rows],
+        "first_id": rows[0].id if rows else None,
+        "initial_id": None,
+        "success_id": None,
+        "agendado_id": None,
+    }
+    for r in rows:
+        if r.is_initial and registry["initial_id"] is None:
+            registry["initial_id"] = r.id
+        if r.is_success and registry["success_id"] is None:
+            registry["success_id"] = r.id
+        if r.nome == STAGE_AGENDADO and registry["agendado_id"] is None:
+            registry["agendado_id"] = r.id
+    return registry
+
+
+def get_stage_registry(clinic_id: int) -> dict:
+    return _cache.get_or_load(int(clinic_id), lambda: _load(int(clinic_id)))
+
+
+def entry_stage_id(clinic_id: int):
+    """Etapa onde entram cards novos: a marcada como inicial, senão a primeira da ordem."""
+    registry = get_stage_registry(clinic_id)
+    return registry["initial_id"] or registry["first_id"]
+
+
+def ensure_stages(clinic_id: int, defaults=None) -> dict:
+    """Garante que a clínica tem etapas (cria o conjunto padrão se não tiver) e devolve o registro."""
+    registry = get_stage_registry(clinic_id)
+    if registry["ids"]:
+        return registry
+
+    # registro vazio pode estar defasado (outro processo/thread criou as etapas): confirma no banco
+    with _create_lock:
+        invalidate_stages(clinic_id)
+        registry = get_stage_registry(clinic_id)
+        if registry["ids"]:
+            return registry
+
+        for etapa in (defaults or WEBHOOK_DEFAULT_STAGES):
+            db.session.add(CRMStage(
+                clinic_id=clinic_id,
+                nome=etapa["nome"],
+                cor=etapa["cor"],
+                ordem=etapa["ordem"],
+                is_initial=etapa.get("is_initial", False),
+                is_success=etapa.get("is_success", False),
+            ))
+        db.session.commit()
+        invalidate_stages(clinic_id)
+        logger.info(f"✅ Etapas padrão do CRM criadas para clínica {clinic_id}")
+        return get_stage_registry(clinic_id)
+
+
+def invalidate_stages(clinic_id: int):
+    _cache.delete(int(clinic_id))
@@ -0,0 +1,122 @@
+"""Indicadores do dashboard: um SELECT só, com cache curto por clínica.
+
+O front chama `/dashboard/stats` a cada navegação. As cinco métricas saem
+de subselects escalares num único statement (um round-trip), e o
+resultado fica DASHBOARD_CACHE_TTL_SECONDS em memória por clínica.
+
+Invalidação: um listener de sessão anota a clínica de todo paciente,
+item de estoque, transação ou agendamento gravado (no flush) e derruba o
+cache dela depois do commit — rollback descarta a anotação. Escritas que
+não passam pelo ORM (bulk/UPDATE direto) e outros processos dependem do
+TTL, por isso ele é de poucos segundos.
+"""
+import logging
+import os
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from app.models import db, Appointment, FinancialDailyRollup, InventoryItem, Patient, Transaction
+from app.services.cache import TTLCache
+from app.services.financial import EXPENSE, FINANCIAL_ROLLUP_READS, INCOME
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL_SECONDS", "5"))
+
+_cache = TTLCache(ttl_seconds=DASHBOARD_CACHE_TTL, max_size=4096)
+
+_WATCHED_MODELS = (Patient, InventoryItem, Transaction, Appointment)
+_DIRTY_KEY = "dashboard_dirty_clinics"
+
+
+def _day_total(clinic_id: int, ttype: str, day_start: datetime, day_end: datetime):
+    if FINANCIAL_ROLLUP_READS:
+        R = FinancialDailyRollup
+        q = select(func.coalesce(func.sum(R.total), 0.0)).where(
+            R.clinic_id == clinic_id, R.day == day_start.date(), R.type == ttype,
+        )
+    else:
+        q = select(func.coalesce(func.sum(Transaction.amount), 0.0)).where(
+            Transaction.clinic_id == clinic_id, Transaction.type == ttype,
+            Transaction.date >= day_start, Transaction.date < day_end,
+        )
+    return q.scalar_subquery()
+
+
+def _stats_statement(clinic_id: int, day_start: datetime):
+    day_end = day_start + timedelta(days=1)
+    return select(
+        select(func.count(Patient.id)).where(Patient.clinic_id == clinic_id)
+        .scalar_subquery().label("patients"),
+        select(func.count(InventoryItem.id)).where(
+            InventoryItem.clinic_id == clinic_id,
+            InventoryItem.quantity <= func.coalesce(InventoryItem.min_quantity, 0),
+        ).scalar_subquery().label("low_stock"),
+        _day_total(clinic_id, INCOME, day_start, day_end).label("income"),
+        _day_total(clinic_id, EXPENSE, day_start, day_end).label("expense"),
+        select(func.count(Appointment.id)).where(
+            Appointment.clinic_id == clinic_id,
+            Appointment.start_datetime >= day_start,
+            Appointment.start_datetime < day_end,
+        ).scalar_subquery().label("appointments"),
+    )
+
+
+def load_stats(clinic_id: int) -> dict:
+    """Métricas do dia (UTC) da clínica, direto do banco."""
+    day_start = datetime.combine(datetime.utcnow().date(), time.min)
+    row = db.session.execute(_stats_statement(clinic_id, day_start)).one()
+    revenue = float(row.income or 0.0)
+    return {
+        "patients": int(row.patients or 0),
+        "low_stock": int(row.low_stock or 0),
+        "revenue": revenue,
+        "net_profit": revenue - float(row.expense or 0.0),
+        "appointments": int(row.appointments or 0),
+    }
+
+
+def get_stats(clinic_id: int) -> dict:
+    return _cache.get_or_load(int(clinic_id), lambda: load_stats(clinic_id))
+
+
+def invalidate_dashboard(clinic_id=None):
+    if clinic_id is None:
+        _cache.clear()
+        return
+    try:
+        _cache.delete(int(clinic_id))
+    except (TypeError, ValueError):
+        pass
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
+
+
+# ---------------------------------------------------------------------------
+# Invalidação pelas escritas do ORM
+# ---------------------------------------------------------------------------
+@event.listens_for(Session, "after_flush")
+def _collect_dirty_clinics(session, flush_context):
+    dirty = None
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, _WATCHED_MODELS):
+            clinic_id = getattr(obj, "clinic_id", None)
+            if clinic_id is not None:
+                if dirty is None:
+                    dirty = session.info.setdefault(_DIRTY_KEY, set())
+                dirty.add(clinic_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    for clinic_id in session.info.pop(_DIRTY_KEY, ()):
+        invalidate_dashboard(clinic_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_dirty_clinics(session):
+    session.info.pop(_DIRTY_KEY, None)
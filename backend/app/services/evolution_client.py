@@ -0,0 +1,230 @@
+"""Cliente HTTP único para a Evolution API.
+
+Todos os envios (webhook, scheduler, rotas do WhatsApp) passam por aqui:
+- uma `requests.Session` compartilhada com pool de conexões e keep-alive;
+- concorrência limitada por instância (semáforo), para uma instância lenta
+  não ocupar o pool inteiro;
+- retry com backoff exponencial + jitter em 5xx / timeouts / erro de conexão;
+- contadores de latência e erro por instância (`metrics()`).
+
+POST de envio de mensagem só é repetido quando é seguro (erro de conexão,
+502/503/504/429): timeout de leitura num POST pode significar mensagem já
+entregue, e repetir duplicaria a mensagem para o paciente.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+EVOLUTION_API_URL = os.getenv("WHATSAPP_QR_SERVICE_URL", "http://localhost:8080").rstrip("/")
+EVOLUTION_API_KEY = os.getenv("EVOLUTION_API_KEY", "")
+
+EVOLUTION_POOL_SIZE = int(os.getenv("EVOLUTION_POOL_SIZE", "20"))
+EVOLUTION_INSTANCE_CONCURRENCY = int(os.getenv("EVOLUTION_INSTANCE_CONCURRENCY", "4"))
+EVOLUTION_MAX_RETRIES = int(os.getenv("EVOLUTION_MAX_RETRIES", "2"))
+EVOLUTION_BACKOFF_BASE = float(os.getenv("EVOLUTION_BACKOFF_BASE_SECONDS", "0.5"))
+EVOLUTION_BACKOFF_MAX = float(os.getenv("EVOLUTION_BACKOFF_MAX_SECONDS", "5"))
+EVOLUTION_CONNECT_TIMEOUT = float(os.getenv("EVOLUTION_CONNECT_TIMEOUT_SECONDS", "5"))
+
+# timeouts de leitura por tipo de chamada (antes: 10/15/20/30 espalhados pelo código)
+TIMEOUT_SHORT = float(os.getenv("EVOLUTION_TIMEOUT_SHORT_SECONDS", "10"))
+TIMEOUT_MED = float(os.getenv("EVOLUTION_TIMEOUT_MED_SECONDS", "20"))
+TIMEOUT_SEND = float(os.getenv("EVOLUTION_TIMEOUT_SEND_SECONDS", "20"))
+
+RETRY_STATUS_ANY = {500, 502, 503, 504, 429}
+RETRY_STATUS_UNSAFE = {502, 503, 504, 429}
+
+_LATENCY_WINDOW = 200
+
+
+class EvolutionBusy(requests.RequestException):
+    """A instância já está com o máximo de requisições em andamento."""
+
+
+class _InstanceStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.last_error = None
+        self.last_status = None
+        self.latencies_ms = deque(maxlen=_LATENCY_WINDOW)
+
+    def snapshot(self) -> dict:
+        lat = sorted(self.latencies_ms)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "error_rate": round(self.errors / self.requests, 3) if self.requests else 0.0,
+            "last_status": self.last_status,
+            "last_error": self.last_error,
+            "latency_ms_avg": round(sum(lat) / len(lat), 1) if lat else 0.0,
+            "latency_ms_p95": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 1) if lat else 0.0,
+            "latency_ms_max": round(lat[-1], 1) if lat else 0.0,
+        }
+
+
+class EvolutionClient:
+    def __init__(
+        self,
+        base_url: str = EVOLUTION_API_URL,
+        api_key: str = EVOLUTION_API_KEY,
+        pool_size: int = EVOLUTION_POOL_SIZE,
+        per_instance: int = EVOLUTION_INSTANCE_CONCURRENCY,
+        max_retries: int = EVOLUTION_MAX_RETRIES,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.per_instance = max(int(per_instance), 1)
+        self.max_retries = max(int(max_retries), 0)
+
+        self.session = requests.Session()
+        # retries são feitos aqui (com jitter e métricas), não pelo urllib3
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(int(pool_size), 1), max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"apikey": self.api_key, "Content-Type": "application/json"})
+
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._stats = {}
+
+    # -------------------------
+    # Infra
+    # -------------------------
+
+    def _semaphore(self, instance: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            sem = self._semaphores.get(instance)
+            if sem is None:
+                sem = self._semaphores[instance] = threading.BoundedSemaphore(self.per_instance)
+            return sem
+
+    def _record(self, instance: str, elapsed_ms: float, status=None, error=None, retried=False):
+        with self._lock:
+            st = self._stats.get(instance)
+            if st is None:
+                st = self._stats[instance] = _InstanceStats()
+            if retried:
+                st.retries += 1
+                return
+            st.requests += 1
+            st.latencies_ms.append(elapsed_ms)
+            st.last_status = status
+            if error is not None or (status is not None and status >= 400):
+                st.errors += 1
+                st.last_error = str(error) if error is not None else f"HTTP {status}"
+
+    def _backoff(self, attempt: int) -> float:
+        # "full jitter": espalha as tentativas de vários workers no tempo
+        return random.uniform(0, min(EVOLUTION_BACKOFF_MAX, EVOLUTION_BACKOFF_BASE * (2 ** attempt)))
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        instance: str = "_global",
+        timeout: float = TIMEOUT_MED,
+        idempotent: Optional[bool] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """Faz a chamada com pool, limite por instância e retry. Levanta `requests.RequestException`."""
+        if idempotent is None:
+            idempotent = method.upper() == "GET"
+        retry_status = RETRY_STATUS_ANY if idempotent else RETRY_STATUS_UNSAFE
+        url = f"{self.base_url}/{path.lstrip('/')}"
+
+        sem = self._semaphore(instance)
+        if not sem.acquire(timeout=timeout):
+            self._record(instance, 0.0, error="busy")
+            raise EvolutionBusy(f"Instância {instance} ocupada ({self.per_instance} requisições em andamento)")
+
+        try:
+            attempt = 0
+            while True:
+                started = time.monotonic()
+                try:
+                    resp = self.session.request(
+                        method, url, timeout=(EVOLUTION_CONNECT_TIMEOUT, timeout), **kwargs
+                    )
+                except requests.RequestException as e:
+                    elapsed = (time.monotonic() - started) * 1000
+                    safe = isinstance(e, (requests.ConnectionError, requests.ConnectTimeout))
+                    retryable = safe or (idempotent and isinstance(e, requests.Timeout))
+                    if retryable and attempt < self.max_retries:
+                        self._record(instance, elapsed, retried=True)
+                        time.sleep(self._backoff(attempt))
+                        attempt += 1
+                        continue
+                    self._record(instance, elapsed, error=e)
+                    raise
+
+                elapsed = (time.monotonic() - started) * 1000
+                if resp.status_code in retry_status and attempt < self.max_retries:
+                    self._record(instance, elapsed, retried=True)
+                    resp.close()
+                    time.sleep(self._backoff(attempt))
+                    attempt += 1
+                    continue
+
+                self._record(instance, elapsed, status=resp.status_code)
+                return resp
+        finally:
+            sem.release()
+
+    # -------------------------
+    # Endpoints usados pelo sistema
+    # -------------------------
+
+    def send_text(self, instance: str, number: str, text: str, delay: int = 1200, link_preview: Optional[bool] = None):
+        payload = {"number": number, "text": text, "delay": delay}
+        if link_preview is not None:
+            payload["linkPreview"] = link_preview
+        return self.request("POST", f"message/sendText/{instance}", instance=instance, timeout=TIMEOUT_SEND, json=payload)
+
+    def fetch_instances(self):
+        return self.request("GET", "instance/fetchInstances", timeout=TIMEOUT_SHORT)
+
+    def create_instance(self, instance: str):
+        payload = {"instanceName": instance, "qrcode": True, "integration": "WHATSAPP-BAILEYS"}
+        # criação é segura de repetir: a Evolution responde 403 "already exists"
+        return self.request("POST", "instance/create", instance=instance, timeout=TIMEOUT_MED, idempotent=True, json=payload)
+
+    def connection_state(self, instance: str):
+        return self.request("GET", f"instance/connectionState/{instance}", instance=instance, timeout=TIMEOUT_SHORT)
+
+    def connect(self, instance: str):
+        return self.request("GET", f"instance/connect/{instance}", instance=instance, timeout=TIMEOUT_MED)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            instances = {name: st.snapshot() for name, st in self._stats.items()}
+        return {
+            "base_url": self.base_url,
+            "pool_size": EVOLUTION_POOL_SIZE,
+            "per_instance_concurrency": self.per_instance,
+            "max_retries": self.max_retries,
+            "instances": instances,
+        }
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_evolution_client() -> EvolutionClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = EvolutionClient()
+    return _client
@@ -0,0 +1,279 @@
+"""Agregações financeiras feitas no banco (nada de carregar todas as transações).
+
+Totais, quebra por categoria e por mês saem de `financial_daily_rollup`
+(soma por clínica, dia, tipo e categoria): a leitura custa O(dias do
+período), não O(transações). A tabela é mantida assim:
+  - `apply_to_rollup`: upsert incremental na mesma transação do INSERT da
+    transação (`add_transaction`);
+  - carga inicial na revisão 0002_financial_daily_rollup (a dona da
+    tabela), com o mesmo INSERT ... SELECT de `rebuild_rollup`;
+  - `rebuild_rollup`: recalcula a partir das transações (reparo:
+    `python backfill_financial_rollup.py`);
+  - `reconcile_rollup`: confere os últimos dias contra as transações e
+    corrige divergências (scheduler).
+
+Períodos são [start, end) em UTC naive, igual a `Transaction.date`. Limites
+fora da meia-noite (ou FINANCIAL_ROLLUP_READS=0) caem nas transações
+brutas, com o mesmo SUM ... GROUP BY. A lista de recentes sempre sai de
+`ORDER BY date DESC LIMIT n`, servida pelo índice (clinic_id, date).
+"""
+import logging
+import os
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, insert, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.models import db, FinancialDailyRollup, Transaction
+
+logger = logging.getLogger(__name__)
+
+INCOME = "income"
+EXPENSE = "expense"
+DEFAULT_CATEGORY = "Outros"
+
+FINANCIAL_ROLLUP_READS = os.getenv("FINANCIAL_ROLLUP_READS", "1") == "1"
+# diferença aceitável entre rollup e transações (somas em float)
+ROLLUP_TOLERANCE = 0.005
+
+
+def _is_postgres() -> bool:
+    return db.engine.dialect.name == "postgresql"
+
+
+def _period_filters(clinic_id: int, start: Optional[datetime], end: Optional[datetime]) -> list:
+    filters = [Transaction.clinic_id == clinic_id]
+    if start:
+        filters.append(Transaction.date >= start)
+    if end:
+        filters.append(Transaction.date < end)
+    return filters
+
+
+def _rollup_filters(clinic_id: int, start: Optional[datetime], end: Optional[datetime]) -> list:
+    filters = [FinancialDailyRollup.clinic_id == clinic_id]
+    if start:
+        filters.append(FinancialDailyRollup.day >= start.date())
+    if end:
+        filters.append(FinancialDailyRollup.day < end.date())
+    return filters
+
+
+def _use_rollup(start: Optional[datetime], end: Optional[datetime]) -> bool:
+    """O rollup é diário: só responde períodos com limites na meia-noite."""
+    if not FINANCIAL_ROLLUP_READS:
+        return False
+    return all(b is None or b.time() == time.min for b in (start, end))
+
+
+def _month_expr(column):
+    if _is_postgres():
+        return func.to_char(column, "YYYY-MM")
+    return func.strftime("%Y-%m", column)
+
+
+def _day_key(value) -> str:
+    # SQLite devolve 'YYYY-MM-DD' (texto), Postgres devolve date
+    return str(value)[:10]
+
+
+# ---------------------------------------------------------------------------
+# Leituras
+# ---------------------------------------------------------------------------
+def totals_by_type(clinic_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[str, dict]:
+    """{"income": {"total": x, "count": n}, "expense": {...}} — uma consulta."""
+    if _use_rollup(start, end):
+        R = FinancialDailyRollup
+        q = db.session.query(R.type, func.sum(R.total), func.sum(R.count)).filter(*_rollup_filters(clinic_id, start, end))
+        q = q.group_by(R.type)
+    else:
+        q = db.session.query(Transaction.type, func.sum(Transaction.amount), func.count(Transaction.id))
+        q = q.filter(*_period_filters(clinic_id, start, end)).group_by(Transaction.type)
+
+    out = {INCOME: {"total": 0.0, "count": 0}, EXPENSE: {"total": 0.0, "count": 0}}
+    for ttype, total, count in q.all():
+        out[ttype] = {"total": float(total or 0.0), "count": int(count or 0)}
+    return out
+
+
+def by_category(clinic_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+    if _use_rollup(start, end):
+        R = FinancialDailyRollup
+        total = func.sum(R.total)
+        q = db.session.query(R.type, R.category, total, func.sum(R.count)).filter(*_rollup_filters(clinic_id, start, end))
+        q = q.group_by(R.type, R.category)
+    else:
+        total = func.sum(Transaction.amount)
+        q = db.session.query(Transaction.type, Transaction.category, total, func.count(Transaction.id))
+        q = q.filter(*_period_filters(clinic_id, start, end)).group_by(Transaction.type, Transaction.category)
+
+    return [
+        {"type": ttype, "category": category or DEFAULT_CATEGORY, "total": float(t or 0.0), "count": int(c or 0)}
+        for ttype, category, t, c in q.order_by(total.desc()).all()
+    ]
+
+
+def by_month(clinic_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+    if _use_rollup(start, end):
+        R = FinancialDailyRollup
+        month, ttype_col = _month_expr(R.day).label("month"), R.type
+        q = db.session.query(month, ttype_col, func.sum(R.total)).filter(*_rollup_filters(clinic_id, start, end))
+    else:
+        month, ttype_col = _month_expr(Transaction.date).label("month"), Transaction.type
+        q = db.session.query(month, ttype_col, func.sum(Transaction.amount))
+        q = q.filter(*_period_filters(clinic_id, start, end))
+
+    months: Dict[str, dict] = {}
+    for m, ttype, total in q.group_by(month, ttype_col).order_by(month).all():
+        item = months.setdefault(m, {"month": m, "receita": 0.0, "despesas": 0.0})
+        if ttype == INCOME:
+            item["receita"] += float(total or 0.0)
+        elif ttype == EXPENSE:
+            item["despesas"] += float(total or 0.0)
+    for item in months.values():
+        item["lucro"] = item["receita"] - item["despesas"]
+    return list(months.values())
+
+
+def recent_transactions(
+    clinic_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None, limit: int = 20
+) -> List[dict]:
+    rows = (
+        db.session.query(
+            Transaction.id, Transaction.description, Transaction.amount,
+            Transaction.type, Transaction.category, Transaction.date,
+        )
+        .filter(*_period_filters(clinic_id, start, end))
+        .order_by(Transaction.date.desc(), Transaction.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return [
+        {
+            "id": r.id,
+            "description": r.description,
+            "amount": r.amount,
+            "type": r.type,
+            "category": r.category,
+            "date": r.date.strftime("%Y-%m-%d") if r.date else None,
+        }
+        for r in rows
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Manutenção do rollup
+# ---------------------------------------------------------------------------
+def apply_to_rollup(transaction: Transaction, sign: int = 1) -> None:
+    """Soma (sign=1) ou desconta (sign=-1) a transação no dia dela. Não faz commit:
+    roda na mesma transação do INSERT/DELETE da transação."""
+    values = {
+        "clinic_id": transaction.clinic_id,
+        "day": (transaction.date or datetime.utcnow()).date(),
+        "type": transaction.type,
+        "category": transaction.category or DEFAULT_CATEGORY,
+        "total": sign * float(transaction.amount or 0.0),
+        "count": sign,
+        "updated_at": datetime.utcnow(),
+    }
+    stmt = (pg_insert if _is_postgres() else sqlite_insert)(FinancialDailyRollup).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["clinic_id", "day", "type", "category"],
+        set_={
+            "total": FinancialDailyRollup.total + stmt.excluded.total,
+            "count": FinancialDailyRollup.count + stmt.excluded.count,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    db.session.execute(stmt)
+
+
+def rebuild_rollup(clinic_id: Optional[int] = None, start_day: Optional[date] = None, end_day: Optional[date] = None) -> int:
+    """Recalcula o rollup a partir das transações (tudo, uma clínica e/ou dias [start_day, end_day)).
+
+    DELETE + INSERT ... SELECT ... GROUP BY, sem commit. Devolve quantas linhas de rollup foram gravadas.
+    """
+    R = FinancialDailyRollup
+    rollup_filters, raw_filters = [], []
+    if clinic_id is not None:
+        rollup_filters.append(R.clinic_id == clinic_id)
+        raw_filters.append(Transaction.clinic_id == clinic_id)
+    if start_day is not None:
+        rollup_filters.append(R.day >= start_day)
+        raw_filters.append(Transaction.date >= datetime.combine(start_day, time.min))
+    if end_day is not None:
+        rollup_filters.append(R.day < end_day)
+        raw_filters.append(Transaction.date < datetime.combine(end_day, time.min))
+
+    db.session.query(R).filter(*rollup_filters).delete(synchronize_session=False)
+    res = db.session.execute(rollup_insert_from_transactions(*raw_filters))
+    return res.rowcount or 0
+
+
+def rollup_insert_from_transactions(*filters):
+    """INSERT INTO financial_daily_rollup ... SELECT ... FROM transactions GROUP BY (clínica, dia, tipo, categoria).
+
+    Também usado pela revisão 0002_financial_daily_rollup na carga inicial.
+    """
+    day = func.date(Transaction.date)
+    category = func.coalesce(Transaction.category, DEFAULT_CATEGORY)
+    grouped = (
+        db.select(
+            Transaction.clinic_id, day, Transaction.type, category,
+            func.sum(Transaction.amount), func.count(Transaction.id), literal(datetime.utcnow()),
+        )
+        .where(Transaction.date.isnot(None), *filters)
+        .group_by(Transaction.clinic_id, day, Transaction.type, category)
+    )
+    return insert(FinancialDailyRollup).from_select(
+        ["clinic_id", "day", "type", "category", "total", "count", "updated_at"], grouped
+    )
+
+
+def reconcile_rollup(clinic_id: Optional[int] = None, since_day: Optional[date] = None, fix: bool = True) -> dict:
+    """Compara rollup x transações (desde `since_day`) e, com fix=True, recalcula os dias divergentes.
+
+    Faz commit quando corrige. Devolve {"groups", "mismatched_days", "fixed"}.
+    """
+    R = FinancialDailyRollup
+    raw_filters, rollup_filters = [Transaction.date.isnot(None)], []
+    if clinic_id is not None:
+        raw_filters.append(Transaction.clinic_id == clinic_id)
+        rollup_filters.append(R.clinic_id == clinic_id)
+    if since_day is not None:
+        raw_filters.append(Transaction.date >= datetime.combine(since_day, time.min))
+        rollup_filters.append(R.day >= since_day)
+
+    day = func.date(Transaction.date)
+    category = func.coalesce(Transaction.category, DEFAULT_CATEGORY)
+    raw = {
+        (cid, _day_key(d), t, c): (float(total or 0.0), int(count or 0))
+        for cid, d, t, c, total, count in db.session.query(
+            Transaction.clinic_id, day, Transaction.type, category,
+            func.sum(Transaction.amount), func.count(Transaction.id),
+        ).filter(*raw_filters).group_by(Transaction.clinic_id, day, Transaction.type, category)
+    }
+    rolled = {
+        (cid, _day_key(d), t, c): (float(total or 0.0), int(count or 0))
+        for cid, d, t, c, total, count in db.session.query(
+            R.clinic_id, R.day, R.type, R.category, R.total, R.count
+        ).filter(*rollup_filters)
+    }
+
+    bad_days = set()
+    for key in raw.keys() | rolled.keys():
+        a, b = raw.get(key, (0.0, 0)), rolled.get(key, (0.0, 0))
+        if a[1] != b[1] or abs(a[0] - b[0]) > ROLLUP_TOLERANCE:
+            bad_days.add((key[0], key[1]))
+
+    if bad_days:
+        logger.warning(f"⚠️ Rollup financeiro divergente em {len(bad_days)} dia(s): {sorted(bad_days)[:10]}")
+        if fix:
+            for cid, day_str in sorted(bad_days):
+                d = date.fromisoformat(day_str)
+                rebuild_rollup(cid, d, d + timedelta(days=1))
+            db.session.commit()
+
+    return {"groups": len(raw), "mismatched_days": len(bad_days), "fixed": bool(bad_days and fix)}
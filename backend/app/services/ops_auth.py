@@ -0,0 +1,37 @@
+"""Acesso aos endpoints operacionais da plataforma (filas, líder, métricas).
+
+Esses endpoints mostram dados de todas as clínicas (instâncias, filas,
+estatísticas de IA), então o JWT de clínica não basta: todo cadastro vira
+`admin` da própria clínica. Quem chama manda o header `X-Ops-Token` com o
+valor de OPS_API_TOKEN; sem a variável configurada os endpoints ficam
+fechados.
+"""
+import hmac
+import logging
+import os
+from functools import wraps
+
+from flask import jsonify, request
+
+logger = logging.getLogger(__name__)
+
+OPS_API_TOKEN = os.getenv("OPS_API_TOKEN", "")
+OPS_TOKEN_HEADER = "X-Ops-Token"
+
+
+def is_ops_request() -> bool:
+    sent = request.headers.get(OPS_TOKEN_HEADER) or ""
+    return bool(OPS_API_TOKEN) and hmac.compare_digest(sent.encode("utf-8"), OPS_API_TOKEN.encode("utf-8"))
+
+
+def ops_required(view):
+    """Decorator: 403 se o header `X-Ops-Token` não bater com OPS_API_TOKEN."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_ops_request():
+            logger.warning(f"⛔ Acesso negado a endpoint operacional: {request.path}")
+            return jsonify({"error": "acesso restrito à operação da plataforma"}), 403
+        return view(*args, **kwargs)
+
+    return wrapper
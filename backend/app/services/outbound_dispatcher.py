@@ -0,0 +1,531 @@
+"""Fila de envio de mensagens do WhatsApp (tabela `scheduled_messages`).
+
+Quem quer mandar mensagem (recall, chatbot, envio manual) só grava a linha
+com `enqueue_message`; o dispatcher em background reivindica as mensagens
+vencidas em lote (FOR UPDATE SKIP LOCKED no Postgres, UPDATE condicional nos
+outros bancos), respeita um token bucket por instância da Evolution e
+envia pelo cliente compartilhado. Falhas transitórias voltam para a fila com
+backoff; 4xx (número inválido etc.) falham direto. O recall cria o card do
+CRM já no enfileiramento: se a mensagem dele é descartada (falha definitiva
+ou opt-out), o card aberto é fechado como `lost`, senão o paciente nunca
+mais entraria num recall.
+Todo processo que enfileira sobe o dispatcher, mas só o líder eleito de
+"outbound" (ver `app.task.leader`) reivindica e envia: o bucket fica num
+processo só e OUTBOUND_RATE_PER_MINUTE vale para o deploy inteiro, não
+por worker do gunicorn. Os outros processos só gravam na fila.
+Mensagens de uma mesma instância são enviadas por um único shard, na ordem
+em que foram reivindicadas.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import func, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import CRMCard, CRMHistory, MessageLog, ScheduledMessage, WhatsAppContact
+from app.services.conversation_pool import ShardedExecutor
+from app.services.evolution_client import get_evolution_client
+from app.task.leader import LEADER_HEARTBEAT_SECONDS, get_leader_elector
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURAÇÕES ---
+# 1 = respostas do chatbot e envios manuais também passam pela fila (recall sempre passa)
+WHATSAPP_OUTBOUND_QUEUE = os.getenv("WHATSAPP_OUTBOUND_QUEUE", "0") == "1"
+OUTBOUND_DISPATCHER_ENABLED = os.getenv("OUTBOUND_DISPATCHER_ENABLED", "1") == "1"
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "4"))
+OUTBOUND_BATCH_SIZE = int(os.getenv("OUTBOUND_BATCH_SIZE", "50"))
+OUTBOUND_POLL_INTERVAL = float(os.getenv("OUTBOUND_POLL_INTERVAL", "2"))
+OUTBOUND_RATE_PER_MINUTE = float(os.getenv("OUTBOUND_RATE_PER_MINUTE", "20"))
+OUTBOUND_BURST = float(os.getenv("OUTBOUND_BURST", "5"))
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "5"))
+OUTBOUND_RETRY_BASE_SECONDS = float(os.getenv("OUTBOUND_RETRY_BASE_SECONDS", "30"))
+OUTBOUND_STALE_AFTER_SECONDS = int(os.getenv("OUTBOUND_STALE_AFTER_SECONDS", "300"))
+MAINTENANCE_INTERVAL_SECONDS = 60
+# nome da eleição: só o líder envia (o rate limit é do processo líder)
+OUTBOUND_LEADER_NAME = "outbound"
+
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+TYPE_TEXT = "text"
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+_wake = threading.Event()
+
+
+def instance_for_clinic(clinic_id) -> str:
+    return f"clinica_v3_{clinic_id}"
+
+
+class TokenBucket:
+    """Token bucket simples (em memória, no processo líder): `rate` tokens/s, até `burst` acumulados."""
+
+    def __init__(self, rate_per_second: float, burst: float):
+        self.rate = max(float(rate_per_second), 0.001)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def refund(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def wait_seconds(self) -> float:
+        with self._lock:
+            self._refill()
+            return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill()
+            return round(self.tokens, 2)
+
+
+# -------------------------
+# Enfileiramento
+# -------------------------
+
+def get_or_create_contact(clinic_id: int, phone: str, name: Optional[str] = None, patient_id: Optional[int] = None) -> WhatsAppContact:
+    contact = WhatsAppContact.query.filter_by(clinic_id=clinic_id, phone=phone).first()
+    if contact:
+        if patient_id and not contact.patient_id:
+            contact.patient_id = patient_id
+        return contact
+
+    try:
+        with db.session.begin_nested():
+            contact = WhatsAppContact(clinic_id=clinic_id, phone=phone, name=name, patient_id=patient_id)
+            db.session.add(contact)
+    except IntegrityError:
+        # outro processo criou o mesmo contato (uq clinic_id + phone)
+        contact = WhatsAppContact.query.filter_by(clinic_id=clinic_id, phone=phone).first()
+    return contact
+
+
+def enqueue_message(
+    clinic_id: int,
+    phone: str,
+    text: str,
+    source: str = "manual",
+    run_at: Optional[datetime] = None,
+    delay: int = 1200,
+    link_preview: Optional[bool] = None,
+    card_id: Optional[int] = None,
+    patient_id: Optional[int] = None,
+    name: Optional[str] = None,
+    commit: bool = True,
+) -> ScheduledMessage:
+    """Grava a mensagem na fila de envio e acorda o dispatcher deste processo."""
+    contact = get_or_create_contact(clinic_id, phone, name=name, patient_id=patient_id)
+    payload = {"text": text, "delay": delay, "source": source}
+    if link_preview is not None:
+        payload["link_preview"] = link_preview
+    if card_id:
+        payload["card_id"] = card_id
+
+    msg = ScheduledMessage(
+        clinic_id=clinic_id,
+        contact_id=contact.id,
+        type=TYPE_TEXT,
+        payload=payload,
+        run_at=run_at or datetime.utcnow(),
+        status=STATUS_PENDING,
+        attempts=0,
+    )
+    db.session.add(msg)
+    if commit:
+        db.session.commit()
+        wake_dispatcher()
+    return msg
+
+
+def enqueue_many(clinic_id: int, items: List[dict], source: str, delay: int = 1200,
+                 link_preview: Optional[bool] = None, commit: bool = True) -> int:
+    """Versão em lote de `enqueue_message` (recall): 1 SELECT + 1 INSERT de contatos e 1 INSERT de mensagens.
+
+    Cada item: {"phone", "text", "patient_id"?, "name"?, "card_id"?}.
+    """
+    items = [it for it in items if it.get("phone") and it.get("text")]
+    if not items:
+        return 0
+
+    phones = {it["phone"] for it in items}
+    contacts = dict(
+        db.session.query(WhatsAppContact.phone, WhatsAppContact.id)
+        .filter(WhatsAppContact.clinic_id == clinic_id, WhatsAppContact.phone.in_(phones))
+        .all()
+    )
+    missing = {}
+    for it in items:
+        if it["phone"] not in contacts and it["phone"] not in missing:
+            missing[it["phone"]] = {"clinic_id": clinic_id, "phone": it["phone"], "name": it.get("name"),
+                                    "patient_id": it.get("patient_id"), "opt_in": True, "created_at": datetime.utcnow()}
+    if missing:
+        try:
+            with db.session.begin_nested():
+                rows = db.session.execute(
+                    insert(WhatsAppContact).returning(WhatsAppContact.phone, WhatsAppContact.id),
+                    list(missing.values()),
+                ).all()
+            contacts.update(dict(rows))
+        except IntegrityError:
+            # corrida com outro processo: cai para o caminho um-a-um
+            for phone, row in missing.items():
+                contacts[phone] = get_or_create_contact(clinic_id, phone, row["name"], row["patient_id"]).id
+
+    now = datetime.utcnow()
+    rows = []
+    for it in items:
+        payload = {"text": it["text"], "delay": delay, "source": source}
+        if link_preview is not None:
+            payload["link_preview"] = link_preview
+        if it.get("card_id"):
+            payload["card_id"] = it["card_id"]
+        rows.append({
+            "clinic_id": clinic_id,
+            "contact_id": contacts[it["phone"]],
+            "type": TYPE_TEXT,
+            "payload": payload,
+            "run_at": now,
+            "status": STATUS_PENDING,
+            "attempts": 0,
+            "created_at": now,
+        })
+    db.session.execute(insert(ScheduledMessage), rows)
+    if commit:
+        db.session.commit()
+        wake_dispatcher()
+    return len(rows)
+
+
+def wake_dispatcher():
+    if OUTBOUND_DISPATCHER_ENABLED and has_app_context():
+        ensure_dispatcher(current_app._get_current_object())
+    _wake.set()
+
+
+def outbound_stats() -> dict:
+    now = datetime.utcnow()
+    rows = (
+        db.session.query(ScheduledMessage.status, func.count(ScheduledMessage.id))
+        .group_by(ScheduledMessage.status)
+        .all()
+    )
+    oldest_due = (
+        db.session.query(func.min(ScheduledMessage.run_at))
+        .filter(ScheduledMessage.status == STATUS_PENDING, ScheduledMessage.run_at <= now)
+        .scalar()
+    )
+    due = (
+        db.session.query(func.count(ScheduledMessage.id))
+        .filter(ScheduledMessage.status == STATUS_PENDING, ScheduledMessage.run_at <= now)
+        .scalar()
+    )
+    return {
+        "by_status": {status: int(count) for status, count in rows},
+        "due": int(due or 0),
+        "oldest_due_lag_seconds": round(max((now - oldest_due).total_seconds(), 0.0), 3) if oldest_due else 0.0,
+        "dispatcher": _dispatcher.stats() if _dispatcher else None,
+    }
+
+
+def ensure_dispatcher(app, workers: Optional[int] = None):
+    """Sobe (uma vez por processo) o dispatcher da fila de envio."""
+    global _dispatcher
+    if _dispatcher is not None:
+        return _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            dispatcher = OutboundDispatcher(app, workers or OUTBOUND_WORKERS)
+            dispatcher.start()
+            _dispatcher = dispatcher
+    return _dispatcher
+
+
+# -------------------------
+# Dispatcher
+# -------------------------
+
+class OutboundDispatcher:
+    def __init__(self, app, workers: int):
+        self.app = app
+        self.workers = max(int(workers or 1), 1)
+        self.max_inflight = max(OUTBOUND_BATCH_SIZE, self.workers)
+        self.executor = None
+        self.elector = None
+        self._thread = None
+        self._buckets = {}
+        self._stats_lock = threading.Lock()
+        self._inflight = 0
+        self._sent = 0
+        self._failed = 0
+        self._retried = 0
+        self._last_maintenance = 0.0
+
+    def start(self):
+        self.executor = ShardedExecutor(self.workers, name="outbound")
+        self.elector = get_leader_elector(self.app, OUTBOUND_LEADER_NAME)
+        self._thread = threading.Thread(target=self._run, name="outbound-dispatcher", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"📤 Outbound dispatcher iniciado | shards={self.workers} "
+            f"rate={OUTBOUND_RATE_PER_MINUTE}/min burst={OUTBOUND_BURST} por instância (envia só se for o líder)"
+        )
+
+    def bucket(self, clinic_id) -> TokenBucket:
+        with self._stats_lock:
+            b = self._buckets.get(clinic_id)
+            if b is None:
+                b = self._buckets[clinic_id] = TokenBucket(OUTBOUND_RATE_PER_MINUTE / 60.0, OUTBOUND_BURST)
+            return b
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            buckets = dict(self._buckets)
+            data = {
+                "alive": bool(self._thread and self._thread.is_alive()),
+                "leader": bool(self.elector and self.elector.is_leader),
+                "inflight": self._inflight,
+                "sent": self._sent,
+                "failed": self._failed,
+                "retried": self._retried,
+            }
+        data["tokens"] = {instance_for_clinic(cid): b.available() for cid, b in buckets.items()}
+        data["executor"] = self.executor.stats() if self.executor else None
+        return data
+
+    def _run(self):
+        while True:
+            if not self.elector.is_leader:
+                # seguidor: não envia; mensagens enfileiradas aqui saem pelo líder no próximo poll dele
+                self.elector.wait_until_leader(LEADER_HEARTBEAT_SECONDS)
+                continue
+
+            claimed = 0
+            try:
+                with self.app.app_context():
+                    self._maybe_maintenance()
+                    claimed = self._claim_and_submit()
+            except Exception as e:
+                logger.exception(f"Outbound dispatcher falhou: {e}")
+                time.sleep(1)
+                continue
+
+            if not claimed:
+                _wake.wait(self._idle_wait())
+                _wake.clear()
+
+    def _idle_wait(self) -> float:
+        # instância sem token: acorda quando o próximo token estiver disponível
+        with self._stats_lock:
+            buckets = list(self._buckets.values())
+        waits = [w for w in (b.wait_seconds() for b in buckets) if w > 0]
+        return max(min([OUTBOUND_POLL_INTERVAL] + waits), 0.05)
+
+    def _claim_and_submit(self) -> int:
+        free = self.max_inflight - self._inflight
+        if free <= 0:
+            return 0
+
+        now = datetime.utcnow()
+        with self._stats_lock:
+            throttled = [cid for cid, b in self._buckets.items() if b.wait_seconds() > 0]
+
+        query = ScheduledMessage.query.filter(
+            ScheduledMessage.status == STATUS_PENDING,
+            ScheduledMessage.run_at <= now,
+        )
+        if throttled:
+            query = query.filter(ScheduledMessage.clinic_id.notin_(throttled))
+        query = query.order_by(ScheduledMessage.run_at, ScheduledMessage.id).limit(min(free, OUTBOUND_BATCH_SIZE))
+
+        is_pg = db.engine.dialect.name == "postgresql"
+        if is_pg:
+            # linhas travadas por outro processo são puladas; as não escolhidas são liberadas no commit
+            query = query.with_for_update(skip_locked=True)
+        candidates = [(m.id, m.clinic_id) for m in query.all()]
+
+        picked = []
+        for msg_id, clinic_id in candidates:
+            if self.bucket(clinic_id).try_take():
+                picked.append((msg_id, clinic_id))
+
+        claimed = []
+        if is_pg and picked:
+            db.session.execute(
+                update(ScheduledMessage)
+                .where(ScheduledMessage.id.in_([m for m, _ in picked]))
+                .values(status=STATUS_SENDING, locked_at=now, attempts=ScheduledMessage.attempts + 1)
+            )
+            claimed = picked
+        else:
+            for msg_id, clinic_id in picked:
+                res = db.session.execute(
+                    update(ScheduledMessage)
+                    .where(ScheduledMessage.id == msg_id, ScheduledMessage.status == STATUS_PENDING)
+                    .values(status=STATUS_SENDING, locked_at=now, attempts=ScheduledMessage.attempts + 1)
+                )
+                if res.rowcount == 1:
+                    claimed.append((msg_id, clinic_id))
+                else:
+                    self.bucket(clinic_id).refund()
+        db.session.commit()
+
+        for msg_id, clinic_id in claimed:
+            with self._stats_lock:
+                self._inflight += 1
+            self.executor.submit(instance_for_clinic(clinic_id), self._send_in_context, msg_id)
+        return len(claimed)
+
+    def _send_in_context(self, msg_id: int):
+        try:
+            with self.app.app_context():
+                self._send(msg_id)
+        finally:
+            with self._stats_lock:
+                self._inflight -= 1
+            _wake.set()
+
+    def _send(self, msg_id: int):
+        msg = db.session.get(ScheduledMessage, msg_id)
+        if not msg or msg.status != STATUS_SENDING:
+            return
+
+        contact = msg.contact
+        payload = msg.payload if isinstance(msg.payload, dict) else {}
+        text = (payload.get("text") or "").strip()
+
+        if not contact or contact.opt_in is False or not text:
+            msg.status = STATUS_CANCELLED
+            msg.fail_reason = "opt_out" if contact and contact.opt_in is False else "invalid_message"
+            self._close_recall_card(payload, f"Envio cancelado ({msg.fail_reason})")
+            db.session.commit()
+            return
+
+        retryable = True
+        try:
+            r = get_evolution_client().send_text(
+                instance_for_clinic(msg.clinic_id),
+                contact.phone,
+                text,
+                delay=int(payload.get("delay", 1200)),
+                link_preview=payload.get("link_preview"),
+            )
+            error = None if r.status_code in (200, 201) else f"HTTP {r.status_code}: {(r.text or '')[:200]}"
+            retryable = r.status_code >= 500 or r.status_code == 429
+        except Exception as e:
+            error = str(e)
+
+        now = datetime.utcnow()
+        msg = db.session.get(ScheduledMessage, msg_id)
+        if error is None:
+            msg.status = STATUS_SENT
+            msg.sent_at = now
+            msg.fail_reason = None
+            contact.last_outbound_at = now
+            self._log(msg, text, "sent")
+            self._card_history(payload, f"Robô enviou: {text}")
+            db.session.commit()
+            with self._stats_lock:
+                self._sent += 1
+            return
+
+        msg.fail_reason = error[:255]
+        if retryable and (msg.attempts or 0) < OUTBOUND_MAX_ATTEMPTS:
+            backoff = OUTBOUND_RETRY_BASE_SECONDS * (2 ** ((msg.attempts or 1) - 1))
+            msg.status = STATUS_PENDING
+            msg.run_at = now + timedelta(seconds=random.uniform(backoff / 2, backoff))
+            db.session.commit()
+            logger.warning(f"⚠️ Envio {msg_id} falhou (tentativa {msg.attempts}), reagendado: {error}")
+            with self._stats_lock:
+                self._retried += 1
+            return
+
+        msg.status = STATUS_FAILED
+        self._log(msg, text, "failed")
+        self._card_history(payload, f"Falha no envio: {error[:200]}")
+        self._close_recall_card(payload, "Recall não entregue: card fechado para o paciente voltar ao recall")
+        db.session.commit()
+        logger.error(f"❌ Envio {msg_id} falhou definitivamente: {error}")
+        with self._stats_lock:
+            self._failed += 1
+
+    def _log(self, msg: ScheduledMessage, text: str, status: str):
+        db.session.add(MessageLog(
+            clinic_id=msg.clinic_id,
+            contact_id=msg.contact_id,
+            direction="out",
+            body=text,
+            status=status,
+        ))
+
+    def _card_history(self, payload: dict, descricao: str):
+        card_id = payload.get("card_id")
+        if card_id:
+            tipo = "BOT_RECALL" if payload.get("source") == "recall" else "BOT"
+            db.session.add(CRMHistory(card_id=card_id, tipo=tipo, descricao=descricao))
+
+    def _close_recall_card(self, payload: dict, descricao: str):
+        card_id = payload.get("card_id")
+        if not card_id or payload.get("source") != "recall":
+            return
+        closed = db.session.execute(
+            update(CRMCard)
+            .where(CRMCard.id == card_id, CRMCard.status == "open")
+            .values(status="lost", ultima_interacao=datetime.utcnow())
+        ).rowcount
+        if closed:
+            db.session.add(CRMHistory(card_id=card_id, tipo="BOT_RECALL", descricao=descricao))
+
+    def _maybe_maintenance(self):
+        now_mono = time.monotonic()
+        if now_mono - self._last_maintenance < MAINTENANCE_INTERVAL_SECONDS:
+            return
+        self._last_maintenance = now_mono
+
+        try:
+            # processo morreu no meio do envio: volta para a fila (pode duplicar um envio já feito)
+            stale = db.session.execute(
+                update(ScheduledMessage)
+                .where(
+                    ScheduledMessage.status == STATUS_SENDING,
+                    ScheduledMessage.locked_at < datetime.utcnow() - timedelta(seconds=OUTBOUND_STALE_AFTER_SECONDS),
+                )
+                .values(status=STATUS_PENDING)
+            ).rowcount
+            db.session.commit()
+
+            stats = outbound_stats()
+            logger.info(
+                f"📊 Outbound | due={stats['due']} lag_oldest={stats['oldest_due_lag_seconds']}s "
+                f"by_status={stats['by_status']} stale_requeued={stale}"
+            )
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"⚠️ Manutenção da fila de envio falhou: {e}")
@@ -0,0 +1,181 @@
+"""Listagem de pacientes paginada por cursor (keyset) e com busca no banco.
+
+Ordem fixa (name, id); o cursor é o par da última linha devolvida e a
+próxima página filtra `(name, id) > cursor`, servido pelo índice
+`ix_patients_clinic_name` (clinic_id, name, id) — custo igual em qualquer
+página, sem OFFSET. Só as colunas pedidas em `fields` saem do banco.
+
+Busca (`q`) por trecho de nome, telefone ou CPF:
+  - Postgres: ILIKE '%q%' nas três colunas, com índices GIN trigram
+    (pg_trgm, migração 0003_patient_search);
+  - SQLite: tabela FTS5 `patients_fts` (tokenizer trigram, mantida por
+    triggers), criada só aqui, por `ensure_sqlite_fts` no create_app.
+    Termos com menos de 3 caracteres ou banco sem a tabela caem no LIKE.
+"""
+import base64
+import json
+import logging
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import or_, select, text, tuple_
+
+from app.models import db, Patient
+
+logger = logging.getLogger(__name__)
+
+PATIENT_PAGE_SIZE = 50
+PATIENT_PAGE_MAX = 200
+# trigram: FTS5 e pg_trgm só indexam termos a partir de 3 caracteres
+MIN_TRIGRAM_CHARS = 3
+
+PATIENT_FIELDS = {
+    "id": Patient.id,
+    "name": Patient.name,
+    "phone": Patient.phone,
+    "cpf": Patient.cpf,
+    "email": Patient.email,
+    "address": Patient.address,
+    "status": Patient.status,
+    "receive_marketing": Patient.receive_marketing,
+    "source": Patient.source,
+    "last_visit": Patient.last_visit,
+    "created_at": Patient.created_at,
+}
+# mesmas chaves do Patient.to_dict()
+DEFAULT_FIELDS = ("id", "name", "phone", "cpf", "email", "address", "status", "receive_marketing")
+
+# SQLite: índice FTS5 externo sobre patients (rowid = patients.id)
+SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5("
+    "name, phone, cpf, content='patients', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS patients_fts_ai AFTER INSERT ON patients BEGIN "
+    "INSERT INTO patients_fts(rowid, name, phone, cpf) VALUES (new.id, new.name, new.phone, new.cpf); END",
+    "CREATE TRIGGER IF NOT EXISTS patients_fts_ad AFTER DELETE ON patients BEGIN "
+    "INSERT INTO patients_fts(patients_fts, rowid, name, phone, cpf) VALUES ('delete', old.id, old.name, old.phone, old.cpf); END",
+    "CREATE TRIGGER IF NOT EXISTS patients_fts_au AFTER UPDATE OF name, phone, cpf ON patients BEGIN "
+    "INSERT INTO patients_fts(patients_fts, rowid, name, phone, cpf) VALUES ('delete', old.id, old.name, old.phone, old.cpf); "
+    "INSERT INTO patients_fts(rowid, name, phone, cpf) VALUES (new.id, new.name, new.phone, new.cpf); END",
+]
+
+_fts_available = {}
+
+
+def ensure_sqlite_fts() -> None:
+    """Cria patients_fts + triggers se faltarem e preenche a tabela quando ela é nova."""
+    exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'")
+    ).first()
+    for stmt in SQLITE_FTS_DDL:
+        db.session.execute(text(stmt))
+    if not exists:
+        db.session.execute(text("INSERT INTO patients_fts(patients_fts) VALUES ('rebuild')"))
+    db.session.commit()
+    _fts_available.clear()
+
+
+def _has_sqlite_fts() -> bool:
+    key = str(db.engine.url)
+    if key not in _fts_available:
+        _fts_available[key] = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'")
+        ).first() is not None
+    return _fts_available[key]
+
+
+# ---------------------------------------------------------------------------
+# Cursor / parâmetros
+# ---------------------------------------------------------------------------
+def encode_cursor(name: str, patient_id: int) -> str:
+    raw = json.dumps([name, patient_id], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Levanta ValueError se o cursor não veio de `encode_cursor`."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        name, patient_id = json.loads(raw.decode("utf-8"))
+    except Exception:
+        raise ValueError("cursor inválido")
+    if not isinstance(name, str) or not isinstance(patient_id, int):
+        raise ValueError("cursor inválido")
+    return name, patient_id
+
+
+def parse_fields(raw: Optional[str]) -> Sequence[str]:
+    """'id,name,phone' -> campos válidos (id sempre vem). ValueError com os desconhecidos."""
+    if not raw:
+        return DEFAULT_FIELDS
+    fields = [f.strip() for f in raw.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in PATIENT_FIELDS]
+    if unknown:
+        raise ValueError(f"campos desconhecidos: {', '.join(unknown)}")
+    return tuple(dict.fromkeys(["id", *fields]))
+
+
+# ---------------------------------------------------------------------------
+# Consulta
+# ---------------------------------------------------------------------------
+def _escape_like(term: str) -> str:
+    return term.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+
+
+def _search_filter(term: str):
+    pattern = f"%{_escape_like(term)}%"
+    like_any = or_(
+        Patient.name.ilike(pattern, escape="!"),
+        Patient.phone.ilike(pattern, escape="!"),
+        Patient.cpf.ilike(pattern, escape="!"),
+    )
+    if db.engine.dialect.name != "sqlite" or len(term) < MIN_TRIGRAM_CHARS or not _has_sqlite_fts():
+        return like_any
+    # frase entre aspas = trecho literal no tokenizer trigram
+    match = '"' + term.replace('"', '""') + '"'
+    return text("patients.id IN (SELECT rowid FROM patients_fts WHERE patients_fts MATCH :fts_q)").bindparams(
+        fts_q=match
+    )
+
+
+def _serialize(row, fields: Sequence[str]) -> dict:
+    item = {}
+    for f in fields:
+        value = getattr(row, f)
+        if f in ("last_visit", "created_at") and value is not None:
+            value = value.isoformat()
+        item[f] = value
+    return item
+
+
+def list_patients(
+    clinic_id: int,
+    q: Optional[str] = None,
+    fields: Sequence[str] = DEFAULT_FIELDS,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """Página de pacientes da clínica em (name, id). limit=None = todos (compatibilidade).
+
+    Devolve (itens, próximo cursor | None). ValueError para cursor inválido.
+    """
+    columns = [PATIENT_FIELDS[f] for f in fields]
+    for key in ("name", "id"):
+        if key not in fields:
+            columns.append(PATIENT_FIELDS[key])
+
+    stmt = select(*columns).where(Patient.clinic_id == clinic_id)
+    term = (q or "").strip()
+    if term:
+        stmt = stmt.where(_search_filter(term))
+    if cursor:
+        after_name, after_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Patient.name, Patient.id) > tuple_(after_name, after_id))
+    stmt = stmt.order_by(Patient.name, Patient.id)
+    if limit is not None:
+        stmt = stmt.limit(limit + 1)
+
+    rows = db.session.execute(stmt).all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].name, rows[-1].id)
+    return [_serialize(r, fields) for r in rows], next_cursor
@@ -0,0 +1,197 @@
+"""Montagem do system prompt do chatbot, compilada uma vez por clínica.
+
+O prompt fixo (instruções + política de agendamento + procedimentos) só muda
+quando a config de IA da clínica muda: é compilado uma vez, versionado pelo
+hash da config (`settings_hash`) e reaproveitado em todas as mensagens. Por
+mensagem só entram o nome do paciente e o histórico recente.
+
+Tudo respeita um orçamento de tokens (estimativa ~4 caracteres/token, sem
+tokenizer externo): procedimentos são serializados compactos e, se ainda
+estourar, têm a descrição encurtada e os últimos descartados; o histórico
+entra do mais recente para o mais antigo até o orçamento acabar.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from app.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+AI_PROMPT_MAX_TOKENS = int(os.getenv("AI_PROMPT_MAX_TOKENS", "2000"))
+# fatia máxima do orçamento que o prompt fixo (instruções + procedimentos) pode usar
+AI_PROMPT_SYSTEM_SHARE = float(os.getenv("AI_PROMPT_SYSTEM_SHARE", "0.6"))
+AI_PROMPT_HISTORY_MAX_MESSAGES = int(os.getenv("AI_PROMPT_HISTORY_MAX_MESSAGES", "10"))
+AI_PROMPT_MESSAGE_MAX_CHARS = 1500
+PROCEDURE_DESCRIPTION_MAX_CHARS = 240
+
+_compiled = TTLCache(ttl_seconds=float(os.getenv("AI_PROMPT_CACHE_TTL_SECONDS", "3600")), max_size=2048)
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text or "") + 3) // 4
+
+
+def settings_hash(cfg: dict) -> str:
+    """Versão da config de IA da clínica (o que muda o prompt ou a resposta)."""
+    payload = json.dumps(
+        {
+            "system_prompt": cfg.get("system_prompt"),
+            "procedures": cfg.get("procedures"),
+            "booking_policy": cfg.get("booking_policy"),
+            "model": cfg.get("model"),
+            "clinic_name": cfg.get("clinic_name"),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _compact(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _procedure_items(procedures: Any) -> List[Any]:
+    """Aceita o formato do painel ({"procedures": [...]}) e o formato nome -> dados."""
+    if isinstance(procedures, dict):
+        if isinstance(procedures.get("procedures"), list):
+            return list(procedures["procedures"])
+        return [{name: data} for name, data in procedures.items()]
+    if isinstance(procedures, list):
+        return list(procedures)
+    return []
+
+
+def _shorten(item: Any) -> Any:
+    """Encurta descrições longas (o resto dos campos fica como está)."""
+    if isinstance(item, dict):
+        out = {}
+        for k, v in item.items():
+            if isinstance(v, str) and len(v) > PROCEDURE_DESCRIPTION_MAX_CHARS:
+                v = v[:PROCEDURE_DESCRIPTION_MAX_CHARS].rsplit(" ", 1)[0] + "…"
+            elif isinstance(v, dict):
+                v = _shorten(v)
+            out[k] = v
+        return out
+    return item
+
+
+def _procedures_block(procedures: Any, budget_tokens: int) -> tuple:
+    items = _procedure_items(procedures)
+    if not items:
+        return "", 0, 0
+
+    header = "PROCEDIMENTOS (use para explicar de forma simples e profissional; não invente valores/garantias):\n"
+    lines = [_compact(i) for i in items]
+    if estimate_tokens(header + "\n".join(lines)) > budget_tokens:
+        lines = [_compact(_shorten(i)) for i in items]
+
+    kept: List[str] = []
+    used = estimate_tokens(header)
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget_tokens:
+            break
+        kept.append(line)
+        used += cost
+
+    if not kept:
+        return "", 0, len(items)
+    return header + "\n".join(kept), len(kept), len(items)
+
+
+def compile_prompt(clinic_id, cfg: dict, default_system_prompt: str = "") -> Dict[str, Any]:
+    """Prompt fixo da clínica (cacheado por versão da config)."""
+    version = settings_hash(cfg)
+    key = (clinic_id, version)
+    compiled = _compiled.get(key)
+    if compiled is not None:
+        return compiled
+
+    system_budget = int(AI_PROMPT_MAX_TOKENS * AI_PROMPT_SYSTEM_SHARE)
+
+    blocks = [(cfg.get("system_prompt") or default_system_prompt).strip()]
+    clinic_name = (cfg.get("clinic_name") or "").strip()
+    if clinic_name:
+        blocks.append(f"Nome da clínica: {clinic_name}.")
+    booking_policy = (cfg.get("booking_policy") or "").strip()
+    if booking_policy:
+        blocks.append("POLÍTICAS DE AGENDAMENTO (obrigatório seguir):\n" + booking_policy)
+
+    base = "\n\n".join(b for b in blocks if b)
+    proc_text, included, total = _procedures_block(
+        cfg.get("procedures"), max(system_budget - estimate_tokens(base), 0)
+    )
+    text = base + ("\n\n" + proc_text if proc_text else "")
+
+    compiled = {
+        "version": version,
+        "text": text,
+        "tokens": estimate_tokens(text),
+        "procedures_included": included,
+        "procedures_total": total,
+    }
+    if included < total:
+        logger.info(
+            f"✂️ Prompt da clínica {clinic_id} cortado: {included}/{total} procedimentos "
+            f"(orçamento {system_budget} tokens)"
+        )
+
+    # versões anteriores da mesma clínica não servem mais
+    _compiled.delete_where(lambda k, v: k[0] == clinic_id and k[1] != version)
+    _compiled.set(key, compiled)
+    return compiled
+
+
+def build_chat_messages(
+    compiled: Dict[str, Any],
+    push_name: str,
+    history: Optional[list],
+    user_text: str,
+) -> tuple:
+    """(system_prompt, history_messages) dentro do orçamento de tokens.
+
+    O histórico vem do mais recente para o mais antigo; para quando o
+    orçamento (descontados o prompt fixo e a mensagem atual) acaba.
+    """
+    system_prompt = compiled["text"]
+    if push_name:
+        system_prompt += f"\n\nNome do paciente: {push_name}."
+
+    hist = list(history) if isinstance(history, list) else []
+    # o chatbot já grava a mensagem atual no histórico antes de chamar a IA: não manda duas vezes
+    if hist and isinstance(hist[-1], dict) and hist[-1].get("role") == "user" \
+            and str(hist[-1].get("content", "")).strip().lower() == (user_text or "").strip().lower():
+        hist.pop()
+
+    remaining = AI_PROMPT_MAX_TOKENS - estimate_tokens(system_prompt) - estimate_tokens(user_text)
+    messages: List[Dict[str, str]] = []
+    for item in reversed(hist[-AI_PROMPT_HISTORY_MAX_MESSAGES:]):
+        if not isinstance(item, dict) or item.get("role") not in ("user", "assistant"):
+            continue
+        content = str(item.get("content", "")).strip()[:AI_PROMPT_MESSAGE_MAX_CHARS]
+        if not content:
+            continue
+        cost = estimate_tokens(content) + 4  # + overhead de papel/mensagem
+        if cost > remaining:
+            break
+        messages.append({"role": item["role"], "content": content})
+        remaining -= cost
+
+    messages.reverse()
+    return system_prompt, messages
+
+
+def invalidate_prompt(clinic_id=None):
+    if clinic_id is None:
+        _compiled.clear()
+        return
+    _compiled.delete_where(lambda k, v: str(k[0]) == str(clinic_id))
+
+
+def prompt_cache_stats() -> dict:
+    return _compiled.stats()
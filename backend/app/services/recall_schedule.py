@@ -0,0 +1,50 @@
+"""Próxima execução das regras de recall (horário de Brasília).
+
+`horario_disparo` (HH:MM) é interpretado em America/Sao_Paulo; o instante
+calculado é gravado em `automacoes_recall.next_run_at` (UTC, sem tz, igual
+ao resto do banco) e indexado, então o timer só consulta as regras vencidas.
+"""
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+TZ_SP = ZoneInfo("America/Sao_Paulo")
+
+# acorda o timer deste processo quando uma regra muda
+recall_wake = threading.Event()
+
+
+def parse_hhmm(value: str):
+    try:
+        hh, mm = (value or "").strip().split(":")[:2]
+        hh, mm = int(hh), int(mm)
+        if 0 <= hh < 24 and 0 <= mm < 60:
+            return hh, mm
+    except (ValueError, AttributeError):
+        pass
+    return None
+
+
+def compute_next_run(horario_disparo: str, after: Optional[datetime] = None) -> Optional[datetime]:
+    """Primeiro instante (UTC naive) estritamente depois de `after` em que bate HH:MM em São Paulo."""
+    hhmm = parse_hhmm(horario_disparo)
+    if hhmm is None:
+        return None
+
+    after = after or datetime.utcnow()
+    local_after = after.replace(tzinfo=timezone.utc).astimezone(TZ_SP)
+    candidate = local_after.replace(hour=hhmm[0], minute=hhmm[1], second=0, microsecond=0)
+    if candidate <= local_after:
+        candidate = (local_after + timedelta(days=1)).replace(hour=hhmm[0], minute=hhmm[1], second=0, microsecond=0)
+    return candidate.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def refresh_next_run(regra, after: Optional[datetime] = None):
+    """Recalcula `next_run_at` da regra (None se inativa). Chame `notify_recall_changed` após o commit."""
+    regra.next_run_at = compute_next_run(regra.horario_disparo, after) if regra.ativo else None
+    return regra.next_run_at
+
+
+def notify_recall_changed():
+    recall_wake.set()
@@ -0,0 +1,108 @@
+"""Deduplicação de entregas do webhook pelo id da mensagem do WhatsApp (`key.id`).
+
+O Evolution reenvia o webhook quando a resposta demora; sem isso, cada
+retentativa gerava outro LeadEvent, duplicava o histórico do card e rodava
+o chatbot / OpenAI de novo. Primeiro consulta um LRU em memória (sem tocar
+no banco); se não está lá, tenta inserir em `webhook_message_ids` (índice
+único) — a violação de unicidade indica que outro processo já aceitou a
+mensagem.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import WebhookMessageId
+from app.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_DEDUPE_LRU_SIZE = int(os.getenv("WEBHOOK_DEDUPE_LRU_SIZE", "20000"))
+WEBHOOK_DEDUPE_RETENTION_HOURS = int(os.getenv("WEBHOOK_DEDUPE_RETENTION_HOURS", "48"))
+PURGE_INTERVAL_SECONDS = 600
+
+_seen = TTLCache(ttl_seconds=WEBHOOK_DEDUPE_RETENTION_HOURS * 3600, max_size=WEBHOOK_DEDUPE_LRU_SIZE)
+_lock = threading.Lock()
+_counters = {"hits_memory": 0, "hits_db": 0, "misses": 0, "no_id": 0}
+_last_purge = 0.0
+
+
+def dedupe_key(source_ref, message_id) -> str:
+    return f"{source_ref or ''}:{message_id}"[:200]
+
+
+def _count(name: str):
+    with _lock:
+        _counters[name] += 1
+
+
+def claim_message(source_ref, message_id) -> bool:
+    """True se é a primeira entrega desta mensagem (e registra); False se é duplicada."""
+    if not message_id:
+        _count("no_id")
+        return True
+
+    key = dedupe_key(source_ref, message_id)
+    if _seen.contains(key):
+        _count("hits_memory")
+        return False
+
+    try:
+        db.session.add(WebhookMessageId(dedupe_key=key, received_at=datetime.utcnow()))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        _seen.set(key, True)
+        _count("hits_db")
+        return False
+
+    _seen.set(key, True)
+    _count("misses")
+    _maybe_purge()
+    return True
+
+
+def release_message(source_ref, message_id):
+    """Desfaz o registro (processamento falhou): a próxima retentativa do Evolution é aceita."""
+    if not message_id:
+        return
+    key = dedupe_key(source_ref, message_id)
+    _seen.delete(key)
+    try:
+        WebhookMessageId.query.filter_by(dedupe_key=key).delete()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"⚠️ Falha ao liberar id de mensagem {key}: {e}")
+
+
+def dedupe_stats() -> dict:
+    with _lock:
+        data = dict(_counters)
+    total = data["hits_memory"] + data["hits_db"] + data["misses"]
+    data["duplicate_rate"] = round((data["hits_memory"] + data["hits_db"]) / total, 3) if total else 0.0
+    data["lru_size"] = _seen.stats()["size"]
+    return data
+
+
+def _maybe_purge():
+    global _last_purge
+    now = time.monotonic()
+    with _lock:
+        if now - _last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        _last_purge = now
+    try:
+        purged = WebhookMessageId.query.filter(
+            WebhookMessageId.received_at < datetime.utcnow() - timedelta(hours=WEBHOOK_DEDUPE_RETENTION_HOURS)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        if purged:
+            logger.info(f"🧹 Dedupe do webhook: {purged} ids antigos removidos")
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"⚠️ Limpeza do dedupe do webhook falhou: {e}")
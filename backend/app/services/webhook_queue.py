@@ -0,0 +1,344 @@
+"""Fila de ingestão do webhook do WhatsApp.
+
+O endpoint só valida e persiste o evento bruto (tabela `webhook_events`) e
+responde 200 na hora; um dispatcher em background drena a fila e entrega cada
+evento ao shard da sua conversa (ver `conversation_pool`).
+A reivindicação de eventos é feita com UPDATE condicional, então vários
+processos (workers do gunicorn) podem drenar a mesma fila sem duplicar, e só
+o evento mais antigo de cada conversa é elegível enquanto nenhum outro da
+mesma conversa estiver em processamento: a ordem é preservada entre processos.
+Evento que falha volta para a fila com `next_attempt_at` no futuro (backoff
+exponencial com jitter): uma queda curta da OpenAI/Evolution não queima as
+WEBHOOK_MAX_ATTEMPTS em milissegundos. Enquanto espera, ele continua
+segurando os eventos seguintes da mesma conversa.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.models import WebhookEvent
+from app.services.conversation_pool import ShardedExecutor
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURAÇÕES ---
+WEBHOOK_ASYNC_MODE = os.getenv("WEBHOOK_ASYNC_MODE", "0") == "1"
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "3"))
+WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", "5"))
+WEBHOOK_RETRY_MAX_SECONDS = float(os.getenv("WEBHOOK_RETRY_MAX_SECONDS", "300"))
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "0.5"))
+WEBHOOK_STALE_AFTER_SECONDS = int(os.getenv("WEBHOOK_STALE_AFTER_SECONDS", "300"))
+WEBHOOK_RETENTION_DAYS = int(os.getenv("WEBHOOK_RETENTION_DAYS", "3"))
+MAINTENANCE_INTERVAL_SECONDS = 60
+
+STATUS_PENDING = "pending"
+STATUS_PROCESSING = "processing"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# handler(payload) -> (body, http_status). Status >= 500 conta como falha (vai para retry).
+Handler = Callable[[dict], Tuple[dict, int]]
+
+_pool = None
+_pool_lock = threading.Lock()
+_wake = threading.Event()
+
+
+def enqueue_event(payload: dict, conversation_key: str, source: str = "whatsapp") -> WebhookEvent:
+    """Persiste o evento bruto e acorda o dispatcher deste processo."""
+    ev = WebhookEvent(
+        source=source,
+        payload=payload,
+        conversation_key=(conversation_key or "")[:120],
+        status=STATUS_PENDING,
+        received_at=datetime.utcnow(),
+    )
+    db.session.add(ev)
+    db.session.commit()
+    _wake.set()
+    return ev
+
+
+def queue_stats() -> dict:
+    """Profundidade da fila, lag do evento pendente mais antigo e métricas dos workers locais."""
+    rows = (
+        db.session.query(WebhookEvent.status, func.count(WebhookEvent.id), func.min(WebhookEvent.received_at))
+        .filter(WebhookEvent.status.in_([STATUS_PENDING, STATUS_PROCESSING, STATUS_FAILED]))
+        .group_by(WebhookEvent.status)
+        .all()
+    )
+    by_status = {status: (count, oldest) for status, count, oldest in rows}
+    depth, oldest_pending = by_status.get(STATUS_PENDING, (0, None))
+
+    lag = (datetime.utcnow() - oldest_pending).total_seconds() if oldest_pending else 0.0
+    return {
+        "depth": int(depth or 0),
+        "processing": int(by_status.get(STATUS_PROCESSING, (0, None))[0] or 0),
+        "failed": int(by_status.get(STATUS_FAILED, (0, None))[0] or 0),
+        "oldest_pending_lag_seconds": round(max(lag, 0.0), 3),
+        "workers": _pool.stats() if _pool else None,
+    }
+
+
+def ensure_workers(app, handler: Handler, workers: Optional[int] = None):
+    """Sobe (uma vez por processo) o dispatcher + shards que drenam a fila."""
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            pool = WebhookWorkerPool(app, handler, workers or WEBHOOK_WORKERS)
+            pool.start()
+            _pool = pool
+    return _pool
+
+
+def requeue_stale(now: Optional[datetime] = None) -> int:
+    """Eventos presos em 'processing' há mais de WEBHOOK_STALE_AFTER_SECONDS (processo morreu no meio)
+    voltam para 'pending'. Não faz commit."""
+    now = now or datetime.utcnow()
+    return db.session.execute(
+        update(WebhookEvent)
+        .where(
+            WebhookEvent.status == STATUS_PROCESSING,
+            WebhookEvent.started_at < now - timedelta(seconds=WEBHOOK_STALE_AFTER_SECONDS),
+        )
+        .values(status=STATUS_PENDING)
+    ).rowcount
+
+
+def start_webhook_workers(app):
+    """Sobe os workers junto com o processo (gunicorn / worker dedicado), não só no primeiro evento.
+
+    Depois de restart ou crash, o que ficou pendente (ou preso em 'processing')
+    é drenado mesmo sem tráfego novo chegando neste processo.
+    """
+    if not WEBHOOK_ASYNC_MODE:
+        return None
+    from app.routes.marketing.webhook import process_inbound_event
+
+    with app.app_context():
+        try:
+            stale = requeue_stale()
+            db.session.commit()
+            if stale:
+                logger.info(f"♻️ Webhook queue: {stale} evento(s) preso(s) em processing voltaram para a fila")
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"⚠️ Falha ao devolver eventos presos do webhook: {e}")
+    return ensure_workers(app, process_inbound_event)
+
+
+class WebhookWorkerPool:
+    def __init__(self, app, handler: Handler, workers: int):
+        self.app = app
+        self.handler = handler
+        self.workers = max(int(workers or 1), 1)
+        # limita eventos reivindicados por este processo (deixa trabalho para os outros)
+        self.max_inflight = self.workers * 2
+        self.executor = None
+        self._dispatcher = None
+        self._inflight = 0
+        self._stats_lock = threading.Lock()
+        self._processed = 0
+        self._failed = 0
+        self._retried = 0
+        self._lag_last = 0.0
+        self._lag_max = 0.0
+        self._lag_ema = 0.0
+        self._last_maintenance = 0.0
+
+    def start(self):
+        self.executor = ShardedExecutor(self.workers, name="webhook")
+        self._dispatcher = threading.Thread(target=self._run, name="webhook-dispatcher", daemon=True)
+        self._dispatcher.start()
+        logger.info(f"📥 Webhook queue: dispatcher + {self.workers} shards iniciados")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            data = {
+                "threads": self.workers,
+                "alive": bool(self._dispatcher and self._dispatcher.is_alive()),
+                "inflight": self._inflight,
+                "processed": self._processed,
+                "failed": self._failed,
+                "retried": self._retried,
+                "lag_last_seconds": round(self._lag_last, 3),
+                "lag_avg_seconds": round(self._lag_ema, 3),
+                "lag_max_seconds": round(self._lag_max, 3),
+            }
+        data["executor"] = self.executor.stats() if self.executor else None
+        return data
+
+    # -------------------------
+    # Loop
+    # -------------------------
+
+    def _run(self):
+        while True:
+            claimed = 0
+            try:
+                with self.app.app_context():
+                    self._maybe_maintenance()
+                    while self._inflight < self.max_inflight:
+                        claim = self._claim_next()
+                        if claim is None:
+                            break
+                        event_id, key = claim
+                        with self._stats_lock:
+                            self._inflight += 1
+                        self.executor.submit(key, self._process_in_context, event_id)
+                        claimed += 1
+            except Exception as e:
+                logger.exception(f"Webhook dispatcher falhou: {e}")
+                time.sleep(1)
+                continue
+
+            if not claimed:
+                _wake.wait(WEBHOOK_POLL_INTERVAL)
+                _wake.clear()
+
+    def _claim_next(self) -> Optional[Tuple[int, str]]:
+        # Elegível: evento pendente mais antigo da conversa, sem outro da mesma conversa em processamento.
+        other = aliased(WebhookEvent)
+        blocked = (
+            db.session.query(other.id)
+            .filter(
+                other.conversation_key == WebhookEvent.conversation_key,
+                or_(
+                    other.status == STATUS_PROCESSING,
+                    and_(other.status == STATUS_PENDING, other.id < WebhookEvent.id),
+                ),
+            )
+            .exists()
+        )
+        now = datetime.utcnow()
+        candidates = (
+            db.session.query(WebhookEvent.id, WebhookEvent.conversation_key)
+            .filter(
+                WebhookEvent.status == STATUS_PENDING,
+                or_(WebhookEvent.next_attempt_at.is_(None), WebhookEvent.next_attempt_at <= now),
+                ~blocked,
+            )
+            .order_by(WebhookEvent.id.asc())
+            .limit(self.workers * 2)
+            .all()
+        )
+        for event_id, key in candidates:
+            res = db.session.execute(
+                update(WebhookEvent)
+                .where(WebhookEvent.id == event_id, WebhookEvent.status == STATUS_PENDING)
+                .values(status=STATUS_PROCESSING, started_at=now, attempts=WebhookEvent.attempts + 1)
+            )
+            db.session.commit()
+            if res.rowcount == 1:
+                return event_id, key or ""
+        db.session.commit()
+        return None
+
+    def _process_in_context(self, event_id: int):
+        try:
+            with self.app.app_context():
+                self._process(event_id)
+        finally:
+            with self._stats_lock:
+                self._inflight -= 1
+            _wake.set()
+
+    def _process(self, event_id: int):
+        ev = db.session.get(WebhookEvent, event_id)
+        if not ev:
+            return
+
+        payload = ev.payload if isinstance(ev.payload, dict) else {}
+        try:
+            body, code = self.handler(payload)
+            error = None if code < 500 else f"HTTP {code}: {body}"
+        except Exception as e:
+            db.session.rollback()
+            error = str(e)
+
+        # o handler pode ter dado rollback/commit na sessão: recarrega o evento
+        ev = db.session.get(WebhookEvent, event_id)
+        if not ev:
+            return
+
+        now = datetime.utcnow()
+        if error is None:
+            ev.status = STATUS_DONE
+            ev.processed_at = now
+            ev.last_error = None
+            db.session.commit()
+            self._record_done((now - ev.received_at).total_seconds())
+            return
+
+        ev.last_error = error[:255]
+        if (ev.attempts or 0) >= WEBHOOK_MAX_ATTEMPTS:
+            ev.status = STATUS_FAILED
+            ev.processed_at = now
+            logger.error(f"❌ Webhook event {event_id} falhou definitivamente: {error}")
+        else:
+            backoff = min(WEBHOOK_RETRY_BASE_SECONDS * (2 ** ((ev.attempts or 1) - 1)), WEBHOOK_RETRY_MAX_SECONDS)
+            ev.status = STATUS_PENDING
+            ev.next_attempt_at = now + timedelta(seconds=random.uniform(backoff / 2, backoff))
+            logger.warning(
+                f"⚠️ Webhook event {event_id} falhou (tentativa {ev.attempts}), "
+                f"volta para a fila em {(ev.next_attempt_at - now).total_seconds():.1f}s: {error}"
+            )
+        db.session.commit()
+        self._record_failure(retry=ev.status == STATUS_PENDING)
+
+    # -------------------------
+    # Métricas / manutenção
+    # -------------------------
+
+    def _record_done(self, lag: float):
+        with self._stats_lock:
+            self._processed += 1
+            self._lag_last = lag
+            self._lag_max = max(self._lag_max, lag)
+            self._lag_ema = lag if self._processed == 1 else (0.9 * self._lag_ema + 0.1 * lag)
+
+    def _record_failure(self, retry: bool):
+        with self._stats_lock:
+            if retry:
+                self._retried += 1
+            else:
+                self._failed += 1
+
+    def _maybe_maintenance(self):
+        now_mono = time.monotonic()
+        if now_mono - self._last_maintenance < MAINTENANCE_INTERVAL_SECONDS:
+            return
+        self._last_maintenance = now_mono
+
+        now = datetime.utcnow()
+        try:
+            # eventos presos em 'processing' (processo morreu no meio) voltam para a fila
+            stale = requeue_stale(now)
+            purged = WebhookEvent.query.filter(
+                WebhookEvent.status == STATUS_DONE,
+                WebhookEvent.processed_at < now - timedelta(days=WEBHOOK_RETENTION_DAYS),
+            ).delete(synchronize_session=False)
+            db.session.commit()
+
+            stats = queue_stats()
+            backlog = [s["backlog"] for s in stats["workers"]["executor"]["shards"]]
+            logger.info(
+                f"📊 Webhook queue | depth={stats['depth']} processing={stats['processing']} "
+                f"failed={stats['failed']} lag_oldest={stats['oldest_pending_lag_seconds']}s "
+                f"lag_avg={stats['workers']['lag_avg_seconds']}s shard_backlog={backlog} "
+                f"stale_requeued={stale} purged={purged}"
+            )
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"⚠️ Manutenção da fila do webhook falhou: {e}")
@@ -0,0 +1,243 @@
+"""Eleição de líder do scheduler entre processos (workers do gunicorn, worker dedicado).
+
+- Postgres: `pg_try_advisory_lock` numa conexão dedicada, mantida aberta
+  enquanto o processo for líder. Se o processo (ou a conexão) morrer, o
+  Postgres solta o lock sozinho e outro processo assume na próxima tentativa.
+- Outros bancos (SQLite local): lock exclusivo num arquivo (`fcntl.flock` no
+  Linux/macOS, `msvcrt.locking` no Windows); vale para processos da mesma
+  máquina, que é o caso de uso do SQLite.
+
+O líder grava/renova uma linha em `scheduler_leases` (só para visibilidade:
+quem é o líder e quando deu o último sinal de vida).
+"""
+import logging
+import os
+import socket
+import tempfile
+import threading
+import zlib
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+
+from app import db
+from app.models import SchedulerLease
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+LEADER_HEARTBEAT_SECONDS = float(os.getenv("LEADER_HEARTBEAT_SECONDS", "15"))
+LEADER_LOCK_DIR = os.getenv("LEADER_LOCK_DIR", tempfile.gettempdir())
+
+MODE_PG = "pg_advisory"
+MODE_FILE = "file"
+
+_electors = {}
+_electors_lock = threading.Lock()
+
+
+def _lock_file(fh) -> bool:
+    """Lock exclusivo sem esperar. False se outro processo já segura o arquivo."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            # msvcrt trava bytes a partir da posição atual: sempre o 1º byte
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock_file(fh):
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+    else:
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _lock_key(name: str) -> int:
+    # chave estável (bigint) para o advisory lock
+    return zlib.crc32(f"odonto-scheduler:{name}".encode()) & 0x7FFFFFFF
+
+
+class LeaderElector:
+    def __init__(self, app, name: str = "scheduler"):
+        self.app = app
+        self.name = name
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.mode = None
+        self.elected_at: Optional[datetime] = None
+        self._is_leader = threading.Event()
+        self._stop = threading.Event()
+        self._conn = None
+        self._lock_file = None
+        self._thread = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._is_leader.is_set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"leader-{self.name}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self.app.app_context():
+            self._release()
+
+    def wait_until_leader(self, timeout: float) -> bool:
+        return self._is_leader.wait(timeout)
+
+    # -------------------------
+    # Loop
+    # -------------------------
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    if self.is_leader:
+                        if self._still_holding():
+                            self._heartbeat()
+                        else:
+                            logger.warning(f"⚠️ Liderança de '{self.name}' perdida ({self.holder})")
+                            self._release()
+                    elif self._try_acquire():
+                        self.elected_at = datetime.utcnow()
+                        self._is_leader.set()
+                        self._heartbeat(new=True)
+                        logger.info(f"👑 {self.holder} é o líder de '{self.name}' ({self.mode})")
+            except Exception as e:
+                logger.warning(f"⚠️ Eleição de líder '{self.name}' falhou: {e}")
+                try:
+                    db.session.rollback()
+                except Exception:
+                    pass
+            self._stop.wait(LEADER_HEARTBEAT_SECONDS)
+
+    def _try_acquire(self) -> bool:
+        if db.engine.dialect.name == "postgresql":
+            self.mode = MODE_PG
+            conn = db.engine.connect()
+            try:
+                got = conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _lock_key(self.name)}).scalar()
+                conn.commit()
+            except Exception:
+                conn.close()
+                raise
+            if got:
+                self._conn = conn
+                return True
+            conn.close()
+            return False
+
+        self.mode = MODE_FILE
+        path = os.path.join(LEADER_LOCK_DIR, f"odonto-{self.name}.lock")
+        fh = open(path, "a+")
+        if not _lock_file(fh):
+            fh.close()
+            return False
+        self._lock_file = fh
+        return True
+
+    def _still_holding(self) -> bool:
+        if self.mode == MODE_PG:
+            try:
+                self._conn.execute(text("SELECT 1"))
+                self._conn.commit()
+                return True
+            except Exception:
+                return False
+        return self._lock_file is not None and not self._lock_file.closed
+
+    def _release(self):
+        was_leader = self.is_leader
+        self._is_leader.clear()
+        if self._conn is not None:
+            try:
+                self._conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _lock_key(self.name)})
+                self._conn.commit()
+            except Exception:
+                pass
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+        if self._lock_file is not None:
+            try:
+                _unlock_file(self._lock_file)
+            except Exception:
+                pass
+            self._lock_file.close()
+            self._lock_file = None
+        if was_leader:
+            try:
+                SchedulerLease.query.filter_by(name=self.name, holder=self.holder).delete()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+
+    def _heartbeat(self, new: bool = False):
+        now = datetime.utcnow()
+        lease = db.session.get(SchedulerLease, self.name)
+        if lease is None:
+            lease = SchedulerLease(name=self.name, holder=self.holder, lock_mode=self.mode, acquired_at=now)
+            db.session.add(lease)
+        elif new or lease.holder != self.holder:
+            lease.holder = self.holder
+            lease.lock_mode = self.mode
+            lease.acquired_at = now
+        lease.heartbeat_at = now
+        db.session.commit()
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "holder": self.holder,
+            "is_leader": self.is_leader,
+            "mode": self.mode,
+            "elected_at": self.elected_at.isoformat() if self.elected_at and self.is_leader else None,
+        }
+
+
+def get_leader_elector(app, name: str = "scheduler") -> LeaderElector:
+    """Um elector por nome e por processo (já iniciado)."""
+    with _electors_lock:
+        elector = _electors.get(name)
+        if elector is None:
+            elector = _electors[name] = LeaderElector(app, name).start()
+        return elector
+
+
+def local_elector(name: str = "scheduler") -> Optional[LeaderElector]:
+    return _electors.get(name)
+
+
+def lease_status(name: str = "scheduler") -> dict:
+    """Linha de `scheduler_leases` + se o heartbeat está em dia."""
+    lease = db.session.get(SchedulerLease, name)
+    if lease is None:
+        return {"name": name, "holder": None, "healthy": False}
+    age = (datetime.utcnow() - lease.heartbeat_at).total_seconds()
+    return {
+        "name": name,
+        "holder": lease.holder,
+        "lock_mode": lease.lock_mode,
+        "acquired_at": lease.acquired_at.isoformat(),
+        "heartbeat_at": lease.heartbeat_at.isoformat(),
+        "heartbeat_age_seconds": round(age, 1),
+        "healthy": age <= LEADER_HEARTBEAT_SECONDS * 3,
+    }
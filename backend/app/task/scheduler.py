@@ -1,147 +1,305 @@
 import os
-import requests
+import time
 import logging
+import threading
 from datetime import datetime, timedelta
-from apscheduler.schedulers.background import BackgroundScheduler
-from sqlalchemy import and_
+from sqlalchemy import and_, func, insert, select, update
 
 # Importa o app e o banco
 from app import create_app, db
 from app.models import (
     AutomacaoRecall, Patient, Appointment, 
-    CRMCard, CRMStage, CRMHistory, WhatsAppConnection
+    CRMCard, CRMStage, CRMHistory, WhatsAppConnection,
+    ScheduledMessage, WhatsAppContact
 )
+from app.services.crm_stages import entry_stage_id
+from app.services.financial import reconcile_rollup
+from app.services.outbound_dispatcher import enqueue_many, ensure_dispatcher
+from app.task.leader import get_leader_elector
+from app.services.recall_schedule import compute_next_run, recall_wake, refresh_next_run
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("Scheduler")
 
-EVOLUTION_API_URL = os.getenv("WHATSAPP_QR_SERVICE_URL", "http://localhost:8080").rstrip("/")
-EVOLUTION_API_KEY = os.getenv("EVOLUTION_API_KEY", "minha-senha-secreta")
+# pacientes por lote no recall (1 SELECT + INSERTs em lote por chunk)
+RECALL_CHUNK_SIZE = int(os.getenv("RECALL_CHUNK_SIZE", "500"))
+RECALL_TIMER_MAX_SLEEP = float(os.getenv("RECALL_TIMER_MAX_SLEEP_SECONDS", "60"))
+# processo ficou fora do ar além disso: pula o disparo perdido em vez de mandar fora de hora
+RECALL_MISFIRE_GRACE_SECONDS = int(os.getenv("RECALL_MISFIRE_GRACE_SECONDS", "3600"))
+# conferência do rollup financeiro contra as transações (só o líder roda)
+FINANCIAL_RECONCILE_INTERVAL_SECONDS = int(os.getenv("FINANCIAL_RECONCILE_INTERVAL_SECONDS", "21600"))
+FINANCIAL_RECONCILE_DAYS = int(os.getenv("FINANCIAL_RECONCILE_DAYS", "60"))
 
-def get_headers():
-    return {
-        "apikey": EVOLUTION_API_KEY,
-        "Content-Type": "application/json"
-    }
+_ultima_reconciliacao = None
 
-def enviar_whatsapp_interno(clinic_id, telefone, mensagem):
-    instance_name = f"clinica_v3_{clinic_id}"
-    phone_number = ''.join(filter(str.isdigit, telefone))
+def normalizar_telefone(telefone):
+    phone_number = ''.join(filter(str.isdigit, telefone or ""))
     if len(phone_number) == 11 and not phone_number.startswith("55"):
         phone_number = "55" + phone_number
+    return phone_number
 
-    url = f"{EVOLUTION_API_URL}/message/sendText/{instance_name}"
-    payload = {
-        "number": phone_number,
-        "text": mensagem,
-        "delay": 1200,
-        "linkPreview": False
-    }
-
-    try:
-        r = requests.post(url, json=payload, headers=get_headers(), timeout=30)
-        if r.status_code == 201:
-            return True, "Enviado"
-        else:
-            return False, f"Erro API: {r.text}"
-    except Exception as e:
-        return False, str(e)
-
-def processar_automacoes():
+_app = None
+
+def get_app():
+    """App (e engine/pool) do scheduler: criado uma vez e reaproveitado em todos os ticks."""
+    global _app
+    if _app is None:
+        _app = create_app()
+    return _app
+
+def set_app(app):
+    global _app
+    _app = app
+
+def _preencher_next_run(agora):
+    # regras antigas (antes da coluna) ou criadas direto no banco
+    pendentes = AutomacaoRecall.query.filter(
+        AutomacaoRecall.ativo == True,
+        AutomacaoRecall.next_run_at.is_(None),
+    ).all()
+    for regra in pendentes:
+        refresh_next_run(regra, agora)
+    if pendentes:
+        db.session.commit()
+
+def processar_automacoes(app=None):
     """
-    Roda a cada 1 hora.
+    Dispara as regras vencidas (next_run_at <= agora) e devolve o próximo disparo (UTC) ou None.
     """
-    app = create_app()
+    t0 = time.perf_counter()
+    app = app or get_app()
     with app.app_context():
-        # --- CORREÇÃO DE FUSO HORÁRIO (BRASIL GMT-3) ---
-        # Pega a hora UTC e diminui 3 horas
-        hora_brasil = datetime.utcnow() - timedelta(hours=3)
-        hora_formatada = hora_brasil.strftime("%H:00")
-        
-        logger.info(f"⏰ Scheduler rodando | Hora Brasil: {hora_formatada} | Hora Server (UTC): {datetime.utcnow().strftime('%H:%M')}")
+        overhead_ms = (time.perf_counter() - t0) * 1000
+        agora = datetime.utcnow()
+        _preencher_next_run(agora)
 
-        regras = AutomacaoRecall.query.filter_by(ativo=True).all()
+        # só as vencidas, pelo índice de next_run_at
+        vencidas = (
+            db.session.query(AutomacaoRecall.id, AutomacaoRecall.next_run_at)
+            .filter(AutomacaoRecall.ativo == True, AutomacaoRecall.next_run_at <= agora)
+            .order_by(AutomacaoRecall.next_run_at)
+            .all()
+        )
 
-        for regra in regras:
-            # Compara com a hora do Brasil
-            if regra.horario_disparo and regra.horario_disparo.startswith(hora_formatada[:2]):
-                logger.info(f"🚀 Executando regra '{regra.nome}' (Agendada para {regra.horario_disparo})")
-                executar_regra_especifica(regra)
+        executadas = 0
+        for regra_id, previsto in vencidas:
+            regra = db.session.get(AutomacaoRecall, regra_id)
+            if not regra:
+                continue
 
-def executar_regra_especifica(regra):
-    # Data limite: Hoje - Dias configurados
-    data_corte = datetime.utcnow() - timedelta(days=regra.dias_ausente)
-    
-    # Busca Pacientes elegíveis
-    pacientes_candidatos = Patient.query.filter(
-        Patient.clinic_id == regra.clinic_id,
-        Patient.last_visit < data_corte,
-        Patient.status == 'ativo',
-        Patient.receive_marketing == True 
+            # UPDATE condicional: só um processo avança o next_run_at (e dispara)
+            res = db.session.execute(
+                update(AutomacaoRecall)
+                .where(AutomacaoRecall.id == regra_id, AutomacaoRecall.next_run_at == previsto)
+                .values(next_run_at=compute_next_run(regra.horario_disparo, agora), last_run_at=agora)
+            )
+            db.session.commit()
+            if res.rowcount != 1:
+                continue
+
+            atraso = (agora - previsto).total_seconds()
+            if atraso > RECALL_MISFIRE_GRACE_SECONDS:
+                logger.warning(f"⏭️ Regra '{regra.nome}' pulada: disparo de {previsto} perdido há {atraso:.0f}s")
+                continue
+
+            logger.info(f"🚀 Executando regra '{regra.nome}' (Agendada para {regra.horario_disparo}, atraso {atraso:.1f}s)")
+            executar_regra_especifica(regra)
+            executadas += 1
+
+        proximo = (
+            db.session.query(func.min(AutomacaoRecall.next_run_at))
+            .filter(AutomacaoRecall.ativo == True)
+            .scalar()
+        )
+
+    if executadas:
+        logger.info(
+            f"⏱️ Tick concluído | overhead={overhead_ms:.1f}ms total={(time.perf_counter() - t0) * 1000:.1f}ms "
+            f"executadas={executadas} proximo={proximo}"
+        )
+    else:
+        logger.debug(f"⏱️ Tick sem regras vencidas | overhead={overhead_ms:.1f}ms proximo={proximo}")
+    return proximo
+
+def reconciliar_financeiro(app=None, force=False):
+    """Confere o rollup financeiro dos últimos FINANCIAL_RECONCILE_DAYS dias e corrige divergências."""
+    global _ultima_reconciliacao
+    agora = time.monotonic()
+    if not force and _ultima_reconciliacao is not None \
+            and agora - _ultima_reconciliacao < FINANCIAL_RECONCILE_INTERVAL_SECONDS:
+        return None
+    _ultima_reconciliacao = agora
+
+    app = app or get_app()
+    with app.app_context():
+        try:
+            t0 = time.perf_counter()
+            desde = datetime.utcnow().date() - timedelta(days=FINANCIAL_RECONCILE_DAYS)
+            resultado = reconcile_rollup(since_day=desde, fix=True)
+            logger.info(
+                f"📒 Rollup financeiro conferido desde {desde}: {resultado['groups']} grupos, "
+                f"{resultado['mismatched_days']} dia(s) divergente(s) em {(time.perf_counter() - t0) * 1000:.0f}ms"
+            )
+            return resultado
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro ao conferir rollup financeiro: {e}")
+            return None
+
+class RecallTimer:
+    """Um único timer: dorme até o próximo next_run_at (no máximo RECALL_TIMER_MAX_SLEEP_SECONDS)."""
+
+    def __init__(self, app, elector=None):
+        self.app = app
+        # com elector, só o processo líder dispara (os outros ficam de reserva)
+        self.elector = elector
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run(self):
+        logger.info(f"⏰ Timer de recall iniciado (máx. {RECALL_TIMER_MAX_SLEEP}s entre verificações)")
+        while not self._stop.is_set():
+            if self.elector is not None and not self.elector.is_leader:
+                self.elector.wait_until_leader(RECALL_TIMER_MAX_SLEEP)
+                continue
+
+            try:
+                proximo = processar_automacoes(self.app)
+            except Exception as e:
+                logger.exception(f"Timer de recall falhou: {e}")
+                proximo = None
+
+            reconciliar_financeiro(self.app)
+
+            # o teto cobre regras alteradas por outro processo (web); no mesmo processo, recall_wake acorda na hora
+            espera = RECALL_TIMER_MAX_SLEEP
+            if proximo is not None:
+                espera = min(espera, max((proximo - datetime.utcnow()).total_seconds(), 0.5))
+            recall_wake.wait(espera)
+            recall_wake.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="recall-timer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        recall_wake.set()
+        if self.elector is not None:
+            self.elector.stop()
+
+def _query_candidatos_recall(regra, agora, after_id, limit):
+    """Pacientes elegíveis para a regra, em uma query (anti-joins), paginada por id."""
+    consulta_futura = (
+        select(Appointment.id)
+        .where(
+            Appointment.clinic_id == regra.clinic_id,
+            Appointment.patient_id == Patient.id,
+            Appointment.start_datetime > agora,
+            Appointment.status != 'cancelled',
+        )
+        .exists()
+    )
+    card_aberto = (
+        select(CRMCard.id)
+        .where(
+            CRMCard.clinic_id == regra.clinic_id,
+            CRMCard.paciente_id == Patient.id,
+            CRMCard.status == 'open',
+        )
+        .exists()
+    )
+    # clínica sem etapas não gera card: evita reenfileirar quem ainda está na fila
+    envio_pendente = (
+        select(ScheduledMessage.id)
+        .join(WhatsAppContact, WhatsAppContact.id == ScheduledMessage.contact_id)
+        .where(
+            WhatsAppContact.clinic_id == regra.clinic_id,
+            WhatsAppContact.patient_id == Patient.id,
+            ScheduledMessage.status.in_(('pending', 'sending')),
+        )
+        .exists()
+    )
+    return db.session.execute(
+        select(Patient.id, Patient.name, Patient.phone)
+        .where(
+            Patient.clinic_id == regra.clinic_id,
+            Patient.last_visit < agora - timedelta(days=regra.dias_ausente),
+            Patient.status == 'ativo',
+            Patient.receive_marketing == True,
+            Patient.id > after_id,
+            ~consulta_futura,
+            ~card_aberto,
+            ~envio_pendente,
+        )
+        .order_by(Patient.id)
+        .limit(limit)
     ).all()
 
-    for paciente in pacientes_candidatos:
+def executar_regra_especifica(regra):
+    agora = datetime.utcnow()
+    stage_id = entry_stage_id(regra.clinic_id)
+    total = 0
+    last_id = 0
+
+    while True:
+        lote = _query_candidatos_recall(regra, agora, last_id, RECALL_CHUNK_SIZE)
+        if not lote:
+            break
+        last_id = lote[-1].id
+
         try:
-            # 1. Verifica se já tem consulta futura
-            tem_agendamento = Appointment.query.filter(
-                Appointment.clinic_id == regra.clinic_id,
-                Appointment.patient_id == paciente.id,
-                Appointment.date_time > datetime.utcnow(),
-                Appointment.status != 'cancelled'
-            ).first()
-
-            if tem_agendamento:
-                continue 
-
-            # 2. Verifica se já está no CRM (Card Aberto)
-            card_aberto = CRMCard.query.filter(
-                CRMCard.clinic_id == regra.clinic_id,
-                CRMCard.paciente_id == paciente.id,
-                CRMCard.status == 'open'
-            ).first()
-
-            if card_aberto:
-                continue 
-
-            # 3. Envia Mensagem
-            msg_final = regra.mensagem_template.replace("{nome}", paciente.name) if regra.mensagem_template else f"Olá {paciente.name}!"
-            sucesso, log_msg = enviar_whatsapp_interno(regra.clinic_id, paciente.phone, msg_final)
-
-            if sucesso:
-                logger.info(f"✅ Recall enviado para {paciente.name}")
-                
-                # Cria Card no CRM
-                estagio_inicial = CRMStage.query.filter_by(clinic_id=regra.clinic_id, is_initial=True).first()
-                if not estagio_inicial:
-                    estagio_inicial = CRMStage.query.filter_by(clinic_id=regra.clinic_id).order_by(CRMStage.ordem).first()
-
-                if estagio_inicial:
-                    novo_card = CRMCard(
-                        clinic_id=regra.clinic_id,
-                        paciente_id=paciente.id,
-                        stage_id=estagio_inicial.id,
-                        ultima_interacao=datetime.utcnow(),
-                        status='open'
-                    )
-                    db.session.add(novo_card)
-                    db.session.flush()
-
-                    hist = CRMHistory(
-                        card_id=novo_card.id,
-                        tipo="BOT_RECALL",
-                        descricao=f"Robô enviou: {msg_final}"
-                    )
-                    db.session.add(hist)
-                    db.session.commit()
-            else:
-                logger.error(f"❌ Falha ao enviar para {paciente.name}: {log_msg}")
+            itens = []
+            for paciente_id, nome, phone in lote:
+                telefone = normalizar_telefone(phone)
+                if not telefone:
+                    continue
+                msg_final = regra.mensagem_template.replace("{nome}", nome) if regra.mensagem_template else f"Olá {nome}!"
+                itens.append({"phone": telefone, "text": msg_final, "patient_id": paciente_id, "name": nome})
 
+            # Cria os cards já no enfileiramento (antes era depois do envio): a próxima rodada não pega
+            # o paciente de novo. Se o envio for descartado, o dispatcher fecha o card (status 'lost').
+            if stage_id and itens:
+                cards = db.session.execute(
+                    insert(CRMCard).returning(CRMCard.paciente_id, CRMCard.id),
+                    [
+                        {
+                            "clinic_id": regra.clinic_id,
+                            "paciente_id": it["patient_id"],
+                            "paciente_nome": it["name"],
+                            "paciente_phone": it["phone"],
+                            "stage_id": stage_id,
+                            "ultima_interacao": agora,
+                            "status": 'open',
+                        }
+                        for it in itens
+                    ],
+                ).all()
+                card_por_paciente = dict(cards)
+                for it in itens:
+                    it["card_id"] = card_por_paciente.get(it["patient_id"])
+                db.session.execute(
+                    insert(CRMHistory),
+                    [
+                        {"card_id": it["card_id"], "tipo": "BOT_RECALL", "descricao": f"Recall '{regra.nome}' enfileirado", "criado_em": agora}
+                        for it in itens
+                    ],
+                )
+
+            total += enqueue_many(regra.clinic_id, itens, source="recall", delay=1200, link_preview=False)
         except Exception as e:
-            logger.error(f"Erro ao processar paciente {paciente.id}: {e}")
+            logger.error(f"Erro ao processar lote de recall (regra {regra.id}, após paciente {last_id}): {e}")
             db.session.rollback()
 
-def start_scheduler():
-    scheduler = BackgroundScheduler()
-    # Roda a cada 60 minutos
-    scheduler.add_job(processar_automacoes, 'interval', minutes=60)
-    scheduler.start()
\ No newline at end of file
+    logger.info(f"📤 Regra '{regra.nome}': {total} recalls enfileirados")
+
+def start_scheduler(app=None):
+    """Scheduler embutido (thread em background) no processo que chamou."""
+    app = app or get_app()
+    set_app(app)
+
+    # fila de envio (recall enfileira; o dispatcher deste processo envia)
+    ensure_dispatcher(app)
+    # cada processo pode chamar start_scheduler: só o líder executa os disparos
+    return RecallTimer(app, get_leader_elector(app)).start()
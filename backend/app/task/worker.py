@@ -0,0 +1,56 @@
+"""Processo dedicado do scheduler (recall / CRM) e da fila de envio.
+
+Uso: `cd backend && python -m app.task.worker`
+
+Cria o app uma única vez (schema hotfix, engine e pool de conexões) e
+reaproveita o mesmo contexto em todos os ticks; o web (gunicorn) não
+precisa carregar o scheduler.
+"""
+import logging
+import os
+import signal
+import sys
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("SchedulerWorker")
+
+
+def main():
+    t0 = time.perf_counter()
+
+    from app import create_app
+    from app.task.leader import get_leader_elector
+    from app.task.scheduler import RecallTimer, set_app
+    from app.services.outbound_dispatcher import ensure_dispatcher
+    from app.services.webhook_queue import start_webhook_workers
+
+    t_import = time.perf_counter()
+    app = create_app()
+    set_app(app)
+    t_app = time.perf_counter()
+    ensure_dispatcher(app)
+    # drena a fila do webhook também daqui: eventos pendentes não esperam tráfego novo no web
+    start_webhook_workers(app)
+
+    timer = RecallTimer(app, get_leader_elector(app))
+
+    def _shutdown(signum, frame):
+        logger.info(f"🛑 Sinal {signum} recebido, encerrando scheduler...")
+        timer.stop()
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    logger.info(
+        f"🚀 Worker do scheduler pronto em {(time.perf_counter() - t0) * 1000:.0f}ms "
+        f"(imports={(t_import - t0) * 1000:.0f}ms create_app={(t_app - t_import) * 1000:.0f}ms) "
+        f"| pid={os.getpid()}"
+    )
+    timer.run()
+    logger.info("✅ Scheduler encerrado")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -78,5 +78,35 @@ def init_db():
         except Exception as e:
             print(f"❌ Erro crítico na migração: {e}")
 
+
+def upgrade_schema():
+    """Aplica as revisões do Alembic (backend/migrations) por cima das tabelas do create_all."""
+    from alembic.script import ScriptDirectory
+    from flask_migrate import stamp, upgrade
+
+    with app.app_context():
+        try:
+            migrations_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+            config = app.extensions["migrate"].migrate.get_config(migrations_dir)
+            known = {rev.revision for rev in ScriptDirectory.from_config(config).walk_revisions()}
+
+            try:
+                current = [r[0] for r in db.session.execute(text("SELECT version_num FROM alembic_version")).fetchall()]
+            except Exception:
+                db.session.rollback()
+                current = []
+
+            # bancos antigos foram carimbados por revisões que não existem mais no repositório
+            if any(rev not in known for rev in current):
+                print(f"🧹 alembic_version desconhecida {current}: recarimbando como base")
+                stamp(directory=migrations_dir, revision="base", purge=True)
+
+            upgrade(directory=migrations_dir)
+            print("✅ Revisões do Alembic aplicadas!")
+        except Exception as e:
+            print(f"❌ Erro ao aplicar revisões do Alembic: {e}")
+
+
 if __name__ == "__main__":
     init_db()
+    upgrade_schema()
@@ -0,0 +1,47 @@
+"""Monta (ou refaz) o rollup financeiro diário a partir das transações.
+
+Uso: `cd backend && python backfill_financial_rollup.py [clinic_id] [--check]`
+
+Sem argumentos recalcula todas as clínicas; com clinic_id, só aquela.
+`--check` não grava nada: só compara rollup x transações e mostra quantos
+dias divergem. A carga inicial já sai da revisão 0002_financial_daily_rollup;
+use este script para refazer depois de correções manuais no banco.
+"""
+import sys
+import time
+
+from app import create_app
+from app.models import db
+from app.services.financial import rebuild_rollup, reconcile_rollup
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    clinic_id = int(args[0]) if args else None
+    only_check = "--check" in sys.argv
+    scope = f"clínica {clinic_id}" if clinic_id else "todas as clínicas"
+
+    app = create_app()
+    with app.app_context():
+        t0 = time.perf_counter()
+        if only_check:
+            result = reconcile_rollup(clinic_id=clinic_id, fix=False)
+            print(
+                f"🔍 {scope}: {result['groups']} grupos nas transações, "
+                f"{result['mismatched_days']} dia(s) divergente(s) ({time.perf_counter() - t0:.2f}s)"
+            )
+            return 1 if result["mismatched_days"] else 0
+
+        try:
+            rows = rebuild_rollup(clinic_id=clinic_id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Erro no backfill do rollup financeiro: {e}")
+            return 1
+        print(f"✅ Rollup financeiro refeito ({scope}): {rows} linhas em {time.perf_counter() - t0:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Benchmark da listagem de agendamentos com relações (GET /api/appointments?include=1).
+
+Uso: `cd backend && python bench_appointments.py [tamanhos...]`  (padrão: 1000 10000)
+
+Compara, para N agendamentos de uma clínica (paciente e lead distintos em
+metade deles):
+  - antigo: objetos ORM + `_appt_to_dict(include_relations=True)`, que faz
+    `Patient.query.get` / `Lead.query.get` por agendamento;
+  - novo: `_appointment_rows` (uma consulta, colunas projetadas + LEFT JOIN)
+    + `_appt_row_to_dict`.
+Mostra consultas SQL e tempo de cada um e confere que o JSON é o mesmo.
+
+Banco: SQLite temporário (ignora DATABASE_URL).
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_appointments.db")
+
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.models import db, Appointment, Clinic, Lead, Patient  # noqa: E402
+from app.routes.agenda_routes import _appointment_rows, _appt_row_to_dict, _appt_to_dict  # noqa: E402
+
+
+def seed(size: int) -> int:
+    clinic = Clinic(name=f"Bench {size}", max_dentists=4)
+    db.session.add(clinic)
+    db.session.flush()
+
+    base = datetime(2026, 1, 5, 8, 0)
+    rows = []
+    for i in range(size):
+        patient = lead = None
+        if i % 2 == 0:
+            patient = Patient(clinic_id=clinic.id, name=f"Paciente {i}", phone=f"55119{i:08d}")
+            lead = Lead(clinic_id=clinic.id, name=f"Lead {i}", phone=f"55219{i:08d}", source="bench")
+            db.session.add_all([patient, lead])
+        rows.append((patient, lead, base + timedelta(minutes=30 * i)))
+    db.session.flush()
+
+    db.session.bulk_save_objects([
+        Appointment(
+            clinic_id=clinic.id,
+            patient_id=patient.id if patient else None,
+            lead_id=lead.id if lead else None,
+            title=f"Consulta {n}",
+            start_datetime=start,
+            end_datetime=start + timedelta(minutes=30),
+            status="scheduled",
+            created_at=start,
+        )
+        for n, (patient, lead, start) in enumerate(rows)
+    ])
+    db.session.commit()
+    return clinic.id
+
+
+def legacy(clinic_id: int):
+    appointments = (
+        Appointment.query.filter_by(clinic_id=clinic_id).order_by(Appointment.start_datetime.asc()).all()
+    )
+    return [_appt_to_dict(a, include_relations=True) for a in appointments]
+
+
+def projected(clinic_id: int):
+    return [_appt_row_to_dict(r, include_relations=True) for r in _appointment_rows(clinic_id, include_relations=True)]
+
+
+def measure(fn, clinic_id: int, counter: list):
+    db.session.expunge_all()  # sem identity map aquecido entre rodadas
+    counter[0] = 0
+    started = time.perf_counter()
+    out = fn(clinic_id)
+    return out, counter[0], (time.perf_counter() - started) * 1000
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000]
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        counter = [0]
+        event.listen(db.engine, "before_cursor_execute", lambda *a, **k: counter.__setitem__(0, counter[0] + 1))
+
+        failed = False
+        for size in sizes:
+            clinic_id = seed(size)
+            print(f"📅 {size} agendamentos (metade com paciente + lead)")
+            results = {}
+            for name, fn in (("antigo", legacy), ("projeção", projected)):
+                out, queries, ms = measure(fn, clinic_id, counter)
+                results[name] = out
+                print(f"   {name:9}: {queries:6d} consultas | {ms:8.1f} ms")
+            same = results["antigo"] == results["projeção"]
+            failed |= not same
+            print(f"   {'✅ mesmo JSON' if same else '❌ JSON diferente'}")
+        return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
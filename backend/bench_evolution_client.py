@@ -0,0 +1,234 @@
+"""Testa o `EvolutionClient` contra um stub local da Evolution API (http.server).
+
+Uso: `cd backend && python bench_evolution_client.py`
+
+Sobe um servidor HTTP/1.1 (keep-alive) em 127.0.0.1 com rotas que imitam a
+Evolution e confere:
+  - pool: chamadas em sequência reaproveitam a mesma conexão TCP (contra
+    uma conexão nova por chamada com `requests.post` solto);
+  - retry: 429/503 são repetidos com backoff + jitter até dar certo ou
+    esgotar as tentativas; 500 em POST de envio não é repetido (mensagem
+    pode ter saído), em GET é;
+  - semáforo por instância: nunca mais que `per_instance` chamadas
+    simultâneas na mesma instância, sem travar as outras, e `EvolutionBusy`
+    quando não dá para esperar.
+Sai com código 1 se alguma verificação falhar.
+"""
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# backoff curto para o teste não demorar (lido no import do cliente)
+os.environ.setdefault("EVOLUTION_BACKOFF_BASE_SECONDS", "0.05")
+os.environ.setdefault("EVOLUTION_BACKOFF_MAX_SECONDS", "0.2")
+
+import requests  # noqa: E402
+
+from app.services.evolution_client import (  # noqa: E402
+    EVOLUTION_BACKOFF_MAX, EvolutionBusy, EvolutionClient,
+)
+
+SLOW_SECONDS = 0.3
+
+
+class StubState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ports = set()
+        self.hits = defaultdict(list)  # path -> [monotonic de cada chamada]
+        self.inflight = defaultdict(int)
+        self.max_inflight = defaultdict(int)
+        # path -> lista de status a devolver em ordem (o último se repete)
+        self.scripts = {}
+
+    def reset(self):
+        with self.lock:
+            self.ports.clear()
+            self.hits.clear()
+            self.max_inflight.clear()
+
+
+STATE = StubState()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # cabeçalho + corpo num write só: senão Nagle + delayed ACK somam ~40ms por resposta no keep-alive
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body: bytes = b"{}"):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        path = self.path
+        with STATE.lock:
+            STATE.ports.add(self.client_address[1])
+            STATE.hits[path].append(time.monotonic())
+            attempt = len(STATE.hits[path])
+            script = STATE.scripts.get(path)
+
+        if path.startswith("/slow/"):
+            instance = path.rsplit("/", 1)[-1]
+            with STATE.lock:
+                STATE.inflight[instance] += 1
+                STATE.max_inflight[instance] = max(STATE.max_inflight[instance], STATE.inflight[instance])
+            time.sleep(SLOW_SECONDS)
+            with STATE.lock:
+                STATE.inflight[instance] -= 1
+            return self._reply(200)
+
+        if script:
+            return self._reply(script[min(attempt, len(script)) - 1])
+        return self._reply(201 if self.command == "POST" else 200)
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+def _check(results: list, title: str, ok: bool, detail: str = ""):
+    results.append(ok)
+    print(f"{'✅' if ok else '❌'} {title}{f' — {detail}' if detail else ''}")
+
+
+def check_pooling(base: str, results: list):
+    client = EvolutionClient(base_url=base, api_key="stub", pool_size=4, per_instance=4, max_retries=0)
+    STATE.reset()
+    t0 = time.perf_counter()
+    for _ in range(50):
+        client.connection_state("pool")
+    pooled_ms = (time.perf_counter() - t0) * 1000
+    pooled_conns = len(STATE.ports)
+
+    STATE.reset()
+    t0 = time.perf_counter()
+    for _ in range(50):
+        requests.get(f"{base}/instance/connectionState/pool", timeout=5).close()
+    naive_ms = (time.perf_counter() - t0) * 1000
+    naive_conns = len(STATE.ports)
+
+    _check(
+        results, "pool: 50 GETs em sequência numa conexão só", pooled_conns == 1,
+        f"cliente {pooled_conns} conexão(ões) / {pooled_ms:.0f}ms x requests solto {naive_conns} / {naive_ms:.0f}ms",
+    )
+
+
+def check_retries(base: str, results: list):
+    client = EvolutionClient(base_url=base, api_key="stub", max_retries=2)
+
+    STATE.reset()
+    STATE.scripts["/message/sendText/r429"] = [429, 429, 201]
+    r = client.send_text("r429", "5511999990000", "oi")
+    hits = STATE.hits["/message/sendText/r429"]
+    _check(results, "retry: 429, 429 e depois 201 no envio", r.status_code == 201 and len(hits) == 3,
+           f"status {r.status_code}, {len(hits)} tentativas")
+    gaps = [b - a for a, b in zip(hits, hits[1:])]
+    _check(results, "backoff dentro do teto (full jitter)", all(g <= EVOLUTION_BACKOFF_MAX + 0.1 for g in gaps),
+           ", ".join(f"{g * 1000:.0f}ms" for g in gaps))
+
+    STATE.scripts["/message/sendText/r503"] = [503]
+    r = client.send_text("r503", "5511999990000", "oi")
+    hits = STATE.hits["/message/sendText/r503"]
+    _check(results, "retry: 503 esgota 1 + max_retries tentativas", r.status_code == 503 and len(hits) == 3,
+           f"status {r.status_code}, {len(hits)} tentativas")
+
+    STATE.scripts["/message/sendText/r500"] = [500, 201]
+    r = client.send_text("r500", "5511999990000", "oi")
+    hits = STATE.hits["/message/sendText/r500"]
+    _check(results, "500 em POST de envio não é repetido", r.status_code == 500 and len(hits) == 1,
+           f"status {r.status_code}, {len(hits)} tentativa(s)")
+
+    STATE.scripts["/instance/connectionState/r500"] = [500, 200]
+    r = client.connection_state("r500")
+    hits = STATE.hits["/instance/connectionState/r500"]
+    _check(results, "500 em GET é repetido", r.status_code == 200 and len(hits) == 2,
+           f"status {r.status_code}, {len(hits)} tentativas")
+
+    # jitter: o intervalo da 1ª retentativa varia entre execuções
+    first_gaps = []
+    for i in range(12):
+        path = f"/message/sendText/jit{i}"
+        STATE.scripts[path] = [429, 201]
+        client.send_text(f"jit{i}", "5511999990000", "oi")
+        a, b = STATE.hits[path][:2]
+        first_gaps.append(b - a)
+    spread = (max(first_gaps) - min(first_gaps)) * 1000
+    _check(results, "jitter: 1ª retentativa não cai sempre no mesmo instante", spread > 5,
+           f"min {min(first_gaps) * 1000:.0f}ms / max {max(first_gaps) * 1000:.0f}ms")
+
+    snap = client.metrics()["instances"]["r429"]
+    _check(results, "métricas contam as retentativas", snap["retries"] == 2 and snap["requests"] == 1,
+           f"requests={snap['requests']} retries={snap['retries']}")
+
+
+def check_semaphore(base: str, results: list):
+    per_instance = 2
+    client = EvolutionClient(base_url=base, api_key="stub", pool_size=16, per_instance=per_instance, max_retries=0)
+    STATE.reset()
+
+    def call(instance):
+        return client.request("GET", f"slow/{instance}", instance=instance, timeout=5).status_code
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        codes = list(ex.map(call, ["a"] * 8 + ["b"] * 8))
+    elapsed = time.perf_counter() - t0
+    peak_a, peak_b = STATE.max_inflight["a"], STATE.max_inflight["b"]
+    _check(
+        results, f"semáforo: no máximo {per_instance} simultâneas por instância",
+        all(c == 200 for c in codes) and peak_a == per_instance and peak_b == per_instance,
+        f"pico a={peak_a} b={peak_b}",
+    )
+    # 8 chamadas por instância em lotes de 2 = 4 rodadas; as duas instâncias em paralelo
+    rounds = 8 / per_instance
+    _check(results, "instâncias não se bloqueiam entre si", elapsed < (rounds + 1.5) * SLOW_SECONDS,
+           f"{elapsed:.2f}s para 16 chamadas (~{rounds * SLOW_SECONDS:.1f}s esperado)")
+
+    # com as 2 vagas de "c" ocupadas, quem não pode esperar recebe EvolutionBusy
+    busy = []
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        futures = [ex.submit(call, "c") for _ in range(per_instance)]
+        time.sleep(SLOW_SECONDS / 3)
+        try:
+            client.request("GET", "slow/c", instance="c", timeout=0.05)
+        except EvolutionBusy as e:
+            busy.append(e)
+        [f.result() for f in futures]
+    _check(results, "EvolutionBusy quando a instância está lotada", len(busy) == 1)
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    print(f"🧪 Stub da Evolution em {base}")
+
+    results = []
+    try:
+        check_pooling(base, results)
+        check_retries(base, results)
+        check_semaphore(base, results)
+    finally:
+        server.shutdown()
+
+    print(f"\n{sum(results)}/{len(results)} verificações ok")
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
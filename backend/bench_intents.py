@@ -0,0 +1,234 @@
+"""Corpus rotulado + microbenchmark do classificador de intenções do chatbot.
+
+Uso: `cd backend && python bench_intents.py [iterações]`
+
+Compara o parser antigo (buscas por substring + regex recompiladas a cada
+chamada) com `app.routes.marketing.intents.analyze_message` em:
+  - acertos no corpus (intenções, data, horário);
+  - tempo por mensagem (classificação completa: 4 intenções + data + hora).
+Sai com código 1 se o classificador novo errar algum caso do corpus.
+"""
+import re
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from app.routes.marketing.intents import analyze_message
+
+TODAY = datetime(2026, 10, 14)  # quarta-feira
+
+Y, N, S, R = "yes", "no", "schedule", "reschedule"
+
+
+def d(days):
+    return (TODAY + timedelta(days=days)).date()
+
+
+# (mensagem, intenções, data, horário)
+CORPUS = [
+    ("Sim", {Y}, None, None),
+    ("sim, pode ser", {Y}, None, None),
+    ("Pode confirmar", {Y}, None, None),
+    ("ok", {Y}, None, None),
+    ("Claro!", {Y}, None, None),
+    ("isso mesmo", {Y}, None, None),
+    ("com certeza 😊", {Y}, None, None),
+    ("Confirmado, obrigada", {Y}, None, None),
+    ("fechado então", {Y}, None, None),
+    ("beleza", {Y}, None, None),
+    ("Não", {N}, None, None),
+    ("nao", {N}, None, None),
+    ("não pode", {N}, None, None),
+    ("assim não dá", {N}, None, None),
+    ("está errado", {N}, None, None),
+    ("quero cancelar", {N}, None, None),
+    ("negativo", {N}, None, None),
+    ("podemos ver depois?", set(), None, None),
+    ("é simples de fazer?", set(), None, None),
+    ("Qual o valor do clareamento?", set(), None, None),
+    ("vocês atendem convênio?", set(), None, None),
+    ("o look ficou ótimo", set(), None, None),
+    ("tenho um compromisso", set(), None, None),
+    ("quero agendar", {S}, None, None),
+    ("Gostaria de marcar uma consulta", {S}, None, None),
+    ("queria uma avaliação", {S}, None, None),
+    ("Quero fazer um agendamento", {S}, None, None),
+    ("não quero agendar agora", {N}, None, None),
+    ("preciso remarcar", {R}, None, None),
+    ("Quero reagendar minha consulta", {R, S}, None, None),
+    ("dá pra mudar o horário?", {R}, None, None),
+    ("Posso alterar a data?", {R}, None, None),
+    ("vou ter que remarcar", {R}, None, None),
+    ("preciso trocar de dia", {R}, None, None),
+    ("amanhã", set(), d(1), None),
+    ("hoje às 15h", set(), d(0), "15:00"),
+    ("depois de amanhã", set(), d(2), None),
+    ("Depois de amanhã às 10:30", set(), d(2), "10:30"),
+    ("04/02", set(), datetime(2026, 2, 4).date(), None),
+    ("10/11 às 14", set(), datetime(2026, 11, 10).date(), "14:00"),
+    ("15/12/2026 9h", set(), datetime(2026, 12, 15).date(), "09:00"),
+    ("31/02", set(), None, None),
+    ("12 de março", set(), datetime(2026, 3, 12).date(), None),
+    ("dia 20 de novembro às 16h", set(), datetime(2026, 11, 20).date(), "16:00"),
+    ("quinta", set(), d(1), None),
+    ("sexta-feira 10h", set(), d(2), "10:00"),
+    ("segunda de manhã, 8 horas", set(), d(5), "08:00"),
+    ("quarta", set(), d(7), None),
+    ("sábado", set(), d(3), None),
+    ("15", set(), None, "15:00"),
+    ("15:30", set(), None, "15:30"),
+    ("14h30", set(), None, "14:30"),
+    ("às 9", set(), None, "09:00"),
+    ("dia 12 às 15", set(), None, "15:00"),
+    ("umas 3", set(), None, None),
+    ("R$ 1.500 o clareamento?", set(), None, None),
+    ("vou ter uma reunião", set(), None, None),
+    ("sim, quinta às 16h", {Y}, d(1), "16:00"),
+    ("Não, prefiro amanhã 11h", {N}, d(1), "11:00"),
+]
+
+
+# ---------------------------------------------------------------------------
+# Parser antigo (cópia do chatbot_logic antes do classificador compilado)
+# ---------------------------------------------------------------------------
+def legacy_is_yes(text):
+    return any(w in text for w in ['sim', 'confirmar', 'pode', 'ok', 'com certeza', 'claro', 'confirmado', 'isso', 'isso mesmo'])
+
+
+def legacy_is_no(text):
+    return any(w in text for w in ['não', 'nao', 'mudar', 'cancelar', 'errado', 'negativo'])
+
+
+def legacy_wants_schedule(text):
+    return any(w in text for w in ['agendar', 'consulta', 'marcar', 'avaliação', 'avaliacao'])
+
+
+def legacy_wants_reschedule(text):
+    return any(w in text for w in ['remarcar', 'reagendar', 'reagendamento', 'mudar horario', 'mudar horário', 'mudar data', 'trocar', 'alterar horario', 'alterar horário', 'alterar data'])
+
+
+def legacy_parse_date(text, today=TODAY):
+    if 'amanhã' in text or 'amanha' in text:
+        return today + timedelta(days=1)
+    if 'hoje' in text:
+        return today
+    if 'depois de amanhã' in text or 'depois de amanha' in text:
+        return today + timedelta(days=2)
+    match = re.search(r'(\d{1,2})[/-](\d{1,2})(?:[/-](\d{2,4}))?', text)
+    if match:
+        day, month = int(match.group(1)), int(match.group(2))
+        year = int(match.group(3)) if match.group(3) else today.year
+        if year < 100:
+            year += 2000
+        try:
+            return datetime(year, month, day)
+        except ValueError:
+            return None
+    meses = {
+        'janeiro': 1, 'fevereiro': 2, 'março': 3, 'marco': 3, 'abril': 4, 'maio': 5, 'junho': 6,
+        'julho': 7, 'agosto': 8, 'setembro': 9, 'outubro': 10, 'novembro': 11, 'dezembro': 12
+    }
+    for mes_nome, mes_num in meses.items():
+        if mes_nome in text:
+            match = re.search(rf'(\d{{1,2}})\s+(?:de\s+)?{mes_nome}', text)
+            if match:
+                return datetime(today.year, mes_num, int(match.group(1)))
+    dias_semana = {
+        'segunda': 0, 'terça': 1, 'terca': 1, 'quarta': 2, 'quinta': 3, 'sexta': 4,
+        'sábado': 5, 'sabado': 5, 'domingo': 6, 'seg': 0, 'ter': 1, 'qua': 2, 'qui': 3, 'sex': 4
+    }
+    for dia_nome, dia_num in dias_semana.items():
+        if re.search(rf'\b{dia_nome}\b', text):
+            days_ahead = dia_num - today.weekday()
+            if days_ahead <= 0:
+                days_ahead += 7
+            return today + timedelta(days=days_ahead)
+    return None
+
+
+def legacy_parse_time(text):
+    match = re.search(r'(\d{1,2})[:h](\d{2})\b', text)
+    if match:
+        hours, minutes = int(match.group(1)), int(match.group(2))
+        if 0 <= hours <= 23 and 0 <= minutes <= 59:
+            return f"{hours:02d}:{minutes:02d}"
+    match = re.search(r'(\d{1,2})\s*h\b', text)
+    if match and 0 <= int(match.group(1)) <= 23:
+        return f"{int(match.group(1)):02d}:00"
+    if not re.search(r'\d{1,2}[/-]\d{1,2}', text):
+        match = re.search(r'\b(\d{1,2})\b', text)
+        if match and 7 <= int(match.group(1)) <= 20:
+            return f"{int(match.group(1)):02d}:00"
+    return None
+
+
+def legacy_analyze(text):
+    text = text.lower()
+    intents = set()
+    if legacy_is_yes(text):
+        intents.add(Y)
+    if legacy_is_no(text):
+        intents.add(N)
+    if legacy_wants_schedule(text):
+        intents.add(S)
+    if legacy_wants_reschedule(text):
+        intents.add(R)
+    dt = legacy_parse_date(text)
+    return {"intents": intents, "date": dt, "time": legacy_parse_time(text)}
+
+
+def new_analyze(text):
+    return analyze_message(text.lower(), today=TODAY)
+
+
+# ---------------------------------------------------------------------------
+def score(fn, verbose=False):
+    ok = {"intents": 0, "date": 0, "time": 0}
+    failures = []
+    for text, intents, date, time_ in CORPUS:
+        try:
+            out = fn(text)
+        except Exception as e:  # o parser antigo quebra em datas inválidas
+            out = {"intents": set(), "date": None, "time": None, "error": repr(e)}
+        got_date = out["date"].date() if out["date"] else None
+        checks = {"intents": out["intents"] == intents, "date": got_date == date, "time": out["time"] == time_}
+        for k, v in checks.items():
+            ok[k] += int(v)
+        if not all(checks.values()):
+            failures.append((text, sorted(out["intents"]), got_date, out["time"]))
+    if verbose:
+        for f in failures:
+            print(f"   ✗ {f[0]!r}: intents={f[1]} date={f[2]} time={f[3]}")
+    return ok, failures
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    total = len(CORPUS)
+    print(f"📚 Corpus: {total} mensagens rotuladas (hoje = {TODAY.date()}, quarta-feira)")
+
+    results = {}
+    for name, fn in (("antigo", legacy_analyze), ("compilado", new_analyze)):
+        ok, failures = score(fn, verbose=True)
+        results[name] = failures
+        print(
+            f"🎯 {name:9}: intenções {ok['intents']}/{total} | data {ok['date']}/{total} | "
+            f"horário {ok['time']}/{total} | mensagens 100% certas {total - len(failures)}/{total}"
+        )
+
+    texts = [c[0] for c in CORPUS]
+    for name, fn in (("antigo", legacy_analyze), ("compilado", new_analyze)):
+        def run():
+            for t in texts:
+                try:
+                    fn(t)
+                except Exception:
+                    pass
+        secs = min(timeit.repeat(run, number=iterations, repeat=3))
+        print(f"⏱️ {name:9}: {secs / (iterations * total) * 1e6:.1f} µs/mensagem")
+
+    return 1 if results["compilado"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""Planos de execução das consultas quentes, sem e com os índices de 0001_hot_query_indexes.
+
+Uso: `cd backend && python explain_hot_queries.py [clinic_id]`
+
+Para cada consulta mostra o plano "antes" (índices da migração removidos)
+e "depois" (banco como está — rode `flask db upgrade` antes):
+  - Postgres: o DROP INDEX roda numa transação que é desfeita no final. O
+    DROP segura lock exclusivo nas tabelas até o rollback: use uma cópia /
+    staging, não o banco de produção em horário de pico. Rode ANALYZE antes
+    para o planner ter estatísticas;
+  - SQLite: o "antes" roda numa cópia em memória do banco.
+
+As consultas são as mesmas do app, compiladas com os valores embutidos
+(como o psycopg2 manda para o Postgres), para os índices parciais valerem.
+O recall continua com um sort no "depois" (ORDER BY id do lote): o índice
+parcial reduz a busca aos ausentes da clínica e o sort é só sobre eles.
+"""
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import false, select, true
+
+from app import create_app
+from app.models import db, Appointment, CRMCard, Lead, Patient, Transaction
+
+MANAGED_INDEXES = [
+    ("ix_appointments_clinic_start", "appointments"),
+    ("ix_appointments_clinic_active_span", "appointments"),
+    ("ix_crm_cards_clinic_phone_open", "crm_cards"),
+    ("ix_marketing_leads_clinic_phone", "marketing_leads"),
+    ("ix_marketing_leads_clinic_created_active", "marketing_leads"),
+    ("ix_patients_clinic_phone", "patients"),
+    ("ix_patients_clinic_recall", "patients"),
+    ("ix_transactions_clinic_date", "transactions"),
+]
+
+
+def hot_queries(clinic_id: int):
+    now = datetime(2026, 10, 17, 12, 0)
+    day = now.replace(hour=0, minute=0)
+    phone = "5511999990000"
+    return [
+        ("agenda do mês (GET /appointments)", select(Appointment.id, Appointment.start_datetime).where(
+            Appointment.clinic_id == clinic_id,
+            Appointment.start_datetime >= day,
+            Appointment.start_datetime <= day + timedelta(days=31),
+        ).order_by(Appointment.start_datetime)),
+        ("disponibilidade / conflito (AvailabilityIndex.load)", select(
+            Appointment.start_datetime, Appointment.end_datetime
+        ).where(
+            Appointment.clinic_id == clinic_id,
+            Appointment.start_datetime < day + timedelta(days=7),
+            Appointment.end_datetime > day,
+            Appointment.status != "cancelled",
+        )),
+        ("card aberto do telefone (webhook)", select(CRMCard.id).where(
+            CRMCard.clinic_id == clinic_id, CRMCard.paciente_phone == phone, CRMCard.status == "open",
+        ).limit(1)),
+        ("lead por telefone (webhook / chatbot)", select(Lead.id).where(
+            Lead.clinic_id == clinic_id, Lead.phone == phone,
+        ).limit(1)),
+        ("leads da clínica (GET /marketing/leads)", select(Lead.id).where(
+            Lead.clinic_id == clinic_id, Lead.is_deleted == false(),
+        ).order_by(Lead.created_at.desc())),
+        ("paciente por telefone (chatbot)", select(Patient.id).where(
+            Patient.clinic_id == clinic_id, Patient.phone == phone,
+        ).limit(1)),
+        # ORDER BY id (paginação do lote) ainda ordena em memória, mas só as linhas que o índice achou
+        ("recall: ausentes há 180 dias (scheduler)", select(Patient.id).where(
+            Patient.clinic_id == clinic_id,
+            Patient.last_visit < now - timedelta(days=180),
+            Patient.status == "ativo",
+            Patient.receive_marketing == true(),
+        ).order_by(Patient.id).limit(200)),
+        ("lançamentos do dia (dashboard / financeiro)", select(Transaction.id, Transaction.amount).where(
+            Transaction.clinic_id == clinic_id,
+            Transaction.date >= day,
+            Transaction.date <= day + timedelta(days=1),
+        )),
+    ]
+
+
+def _explain_sqlite(conn: sqlite3.Connection, sql: str):
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()]
+
+
+def _explain_pg(conn, sql: str):
+    return [row[0] for row in conn.exec_driver_sql("EXPLAIN " + sql).fetchall()]
+
+
+def _print(title: str, before, after):
+    print(f"\n🔎 {title}")
+    print("   antes :")
+    for line in before:
+        print(f"      {line}")
+    print("   depois:")
+    for line in after:
+        print(f"      {line}")
+
+
+def main():
+    clinic_id = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    app = create_app()
+    with app.app_context():
+        engine = db.engine
+        dialect = engine.dialect
+        queries = [
+            (title, str(stmt.compile(dialect=dialect, compile_kwargs={"literal_binds": True})))
+            for title, stmt in hot_queries(clinic_id)
+        ]
+        print(f"🗄️ Banco: {dialect.name} | clinic_id={clinic_id}")
+
+        if dialect.name == "postgresql":
+            with engine.connect() as conn:
+                existing = {r[0] for r in conn.exec_driver_sql("SELECT indexname FROM pg_indexes").fetchall()}
+                after = [_explain_pg(conn, sql) for _, sql in queries]
+                trans = conn.begin()
+                for name, _table in MANAGED_INDEXES:
+                    conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+                before = [_explain_pg(conn, sql) for _, sql in queries]
+                trans.rollback()
+        else:
+            raw = engine.raw_connection()
+            try:
+                src = raw.driver_connection
+                existing = {r[0] for r in src.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+                after = [_explain_sqlite(src, sql) for _, sql in queries]
+                copy = sqlite3.connect(":memory:")
+                src.backup(copy)
+            finally:
+                raw.close()
+            for name, _table in MANAGED_INDEXES:
+                copy.execute(f"DROP INDEX IF EXISTS {name}")
+            before = [_explain_sqlite(copy, sql) for _, sql in queries]
+            copy.close()
+
+        missing = [name for name, _table in MANAGED_INDEXES if name not in existing]
+        if missing:
+            print(f"⚠️ Índices ausentes (rode `flask db upgrade`): {', '.join(missing)}")
+
+        for (title, _sql), b, a in zip(queries, before, after):
+            _print(title, b, a)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
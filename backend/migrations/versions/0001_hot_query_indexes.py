@@ -0,0 +1,100 @@
+"""Índices compostos (clinic_id + filtro) das consultas quentes
+
+Primeira revisão gerenciada: as tabelas continuam vindo do create_all /
+auto_migrate.py; daqui para frente índices e mudanças de schema entram
+como revisões. Tudo com IF NOT EXISTS (banco novo já nasce com os índices
+declarados em models.py) e, no Postgres, CREATE INDEX CONCURRENTLY para não
+travar escrita nas tabelas durante o deploy. Um CONCURRENTLY que falha no
+meio deixa o índice INVALID com o nome ocupado (o IF NOT EXISTS pularia):
+esses são removidos e recriados.
+
+Planos antes/depois: `python explain_hot_queries.py`.
+
+Revision ID: 0001_hot_query_indexes
+Revises:
+Create Date: 2026-10-17 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_hot_query_indexes'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# (nome, tabela, colunas, predicado Postgres, predicado SQLite)
+INDEXES = [
+    # listagem da agenda / consultas do dia
+    ("ix_appointments_clinic_start", "appointments", ["clinic_id", "start_datetime"], None, None),
+    # disponibilidade e conflito (AvailabilityIndex.load): cobre início/fim dos não cancelados
+    (
+        "ix_appointments_clinic_active_span", "appointments", ["clinic_id", "start_datetime", "end_datetime"],
+        "status <> 'cancelled'", "status <> 'cancelled'",
+    ),
+    # webhook / chatbot: card aberto do telefone
+    (
+        "ix_crm_cards_clinic_phone_open", "crm_cards", ["clinic_id", "paciente_phone"],
+        "status = 'open'", "status = 'open'",
+    ),
+    # webhook / chatbot / quadro do CRM: lead por telefone
+    ("ix_marketing_leads_clinic_phone", "marketing_leads", ["clinic_id", "phone"], None, None),
+    # listagem de leads sem os apagados
+    (
+        "ix_marketing_leads_clinic_created_active", "marketing_leads", ["clinic_id", "created_at"],
+        "is_deleted = false", "is_deleted = 0",
+    ),
+    # chatbot: paciente por telefone
+    ("ix_patients_clinic_phone", "patients", ["clinic_id", "phone"], None, None),
+    # recall (scheduler): ausentes há N dias entre ativos que aceitam marketing
+    (
+        "ix_patients_clinic_recall", "patients", ["clinic_id", "last_visit"],
+        "status = 'ativo' AND receive_marketing = true", "status = 'ativo' AND receive_marketing = 1",
+    ),
+    # financeiro / dashboard: lançamentos por período
+    ("ix_transactions_clinic_date", "transactions", ["clinic_id", "date"], None, None),
+]
+
+
+def _drop_invalid_pg():
+    """Índices desta revisão que ficaram INVALID (build CONCURRENTLY interrompido) são removidos."""
+    names = [name for name, *_ in INDEXES]
+    invalid = op.get_bind().execute(
+        sa.text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE NOT i.indisvalid AND c.relname = ANY(:names)"
+        ),
+        {"names": names},
+    ).scalars().all()
+    for name in invalid:
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def _create_all(postgres):
+    for name, table, columns, pg_where, sqlite_where in INDEXES:
+        kwargs = {}
+        if postgres:
+            kwargs["postgresql_concurrently"] = True
+            if pg_where:
+                kwargs["postgresql_where"] = sa.text(pg_where)
+        elif sqlite_where:
+            kwargs["sqlite_where"] = sa.text(sqlite_where)
+        op.create_index(name, table, columns, if_not_exists=True, **kwargs)
+
+
+def upgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        # CONCURRENTLY não roda dentro de transação
+        with op.get_context().autocommit_block():
+            _drop_invalid_pg()
+            _create_all(postgres=True)
+    else:
+        _create_all(postgres=False)
+
+
+def downgrade():
+    for name, table, _columns, _pg_where, _sqlite_where in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
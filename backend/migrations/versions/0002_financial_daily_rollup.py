@@ -0,0 +1,48 @@
+"""Tabela financial_daily_rollup (soma diária por clínica, tipo e categoria)
+
+Esta revisão é a dona da tabela: cria (se faltar) e, se estiver vazia,
+preenche com as transações já existentes — o `auto_migrate.py` roda isso
+antes do gunicorn subir, então o resumo e o dashboard não perdem o
+histórico de antes do deploy. A carga usa o mesmo INSERT ... SELECT ...
+GROUP BY do `rebuild_rollup`. Dali em diante cada `add_transaction`
+mantém a tabela.
+
+Revision ID: 0002_financial_daily_rollup
+Revises: 0001_hot_query_indexes
+Create Date: 2026-10-17 14:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_financial_daily_rollup'
+down_revision = '0001_hot_query_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # o create_all (banco novo / auto_migrate) pode já ter criado a tabela, vazia
+    if not sa.inspect(bind).has_table("financial_daily_rollup"):
+        op.create_table(
+            "financial_daily_rollup",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("clinic_id", sa.Integer(), sa.ForeignKey("clinics.id"), nullable=False),
+            sa.Column("day", sa.Date(), nullable=False),
+            sa.Column("type", sa.String(length=20), nullable=False),
+            sa.Column("category", sa.String(length=50), nullable=False),
+            sa.Column("total", sa.Float(), nullable=False),
+            sa.Column("count", sa.Integer(), nullable=False),
+            sa.Column("updated_at", sa.DateTime(), nullable=False),
+            sa.UniqueConstraint("clinic_id", "day", "type", "category", name="uq_financial_rollup_key"),
+        )
+    if bind.execute(sa.text("SELECT 1 FROM financial_daily_rollup LIMIT 1")).first() is None:
+        from app.services.financial import rollup_insert_from_transactions
+        bind.execute(rollup_insert_from_transactions())
+
+
+def downgrade():
+    op.drop_table("financial_daily_rollup")
@@ -0,0 +1,83 @@
+"""Índices da listagem/busca de pacientes
+
+- (clinic_id, name, id): paginação por cursor em GET /patients;
+- Postgres: pg_trgm + GIN trigram em name/phone/cpf para ILIKE '%q%'.
+  Se a extensão não puder ser criada (sem permissão), segue sem esses
+  índices e a busca faz scan dentro da clínica. Índices que ficaram
+  INVALID de uma execução CONCURRENTLY interrompida são refeitos.
+
+No SQLite a tabela FTS5 patients_fts e seus triggers não são desta revisão:
+quem cria é o `ensure_sqlite_fts` (app/services/patient_search.py),
+chamado no create_app.
+
+Revision ID: 0003_patient_search
+Revises: 0002_financial_daily_rollup
+Create Date: 2026-10-17 16:00:00
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_patient_search'
+down_revision = '0002_financial_daily_rollup'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+TRGM_INDEXES = [
+    ("ix_patients_name_trgm", "name"),
+    ("ix_patients_phone_trgm", "phone"),
+    ("ix_patients_cpf_trgm", "cpf"),
+]
+
+
+def _drop_invalid_pg(names):
+    """Índices que ficaram INVALID (build CONCURRENTLY interrompido) são removidos para serem refeitos."""
+    invalid = op.get_bind().execute(
+        sa.text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE NOT i.indisvalid AND c.relname = ANY(:names)"
+        ),
+        {"names": list(names)},
+    ).scalars().all()
+    for name in invalid:
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        # CONCURRENTLY não roda dentro de transação
+        with op.get_context().autocommit_block():
+            _drop_invalid_pg(["ix_patients_clinic_name", *(name for name, _column in TRGM_INDEXES)])
+            op.create_index(
+                "ix_patients_clinic_name", "patients", ["clinic_id", "name", "id"],
+                if_not_exists=True, postgresql_concurrently=True,
+            )
+            try:
+                op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            except Exception as e:
+                logger.warning(f"⚠️ pg_trgm indisponível, busca de pacientes sem índice trigram: {e}")
+                return
+            for name, column in TRGM_INDEXES:
+                op.create_index(
+                    name, "patients", [column], if_not_exists=True,
+                    postgresql_concurrently=True, postgresql_using="gin",
+                    postgresql_ops={column: "gin_trgm_ops"},
+                )
+        return
+
+    op.create_index("ix_patients_clinic_name", "patients", ["clinic_id", "name", "id"], if_not_exists=True)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        for name, _column in reversed(TRGM_INDEXES):
+            op.drop_index(name, table_name="patients", if_exists=True)
+    op.drop_index("ix_patients_clinic_name", table_name="patients", if_exists=True)
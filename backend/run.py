@@ -1,17 +1,39 @@
 import os
+import sys
 from app import create_app
 # CORREÇÃO AQUI: Mudamos de 'tasks' para 'task' (singular, igual na sua imagem)
 from app.task.scheduler import start_scheduler 
+from app.services.webhook_queue import start_webhook_workers
 
 app = create_app()
 
+# SCHEDULER_EMBEDDED=0 quando o scheduler roda no processo próprio (python -m app.task.worker)
+SCHEDULER_EMBEDDED = os.environ.get("SCHEDULER_EMBEDDED", "1") == "1"
+
+# Sob gunicorn (run:app) cada worker importa este módulo: todos sobem o scheduler,
+# mas só o líder eleito (advisory lock / file lock) executa os disparos.
+# Fila do webhook (WEBHOOK_ASYNC_MODE=1): cada worker do gunicorn drena desde o boot
+if __name__ != "__main__" and "gunicorn" in sys.modules:
+    try:
+        start_webhook_workers(app)
+    except Exception as e:
+        print(f"❌ Erro ao iniciar workers do webhook: {e}")
+
+if __name__ != "__main__" and SCHEDULER_EMBEDDED and "gunicorn" in sys.modules:
+    try:
+        start_scheduler(app)
+    except Exception as e:
+        print(f"❌ Erro ao iniciar Scheduler: {e}")
+
 if __name__ == "__main__":
     # INICIALIZA O ROBÔ DE RECALL / CRM
     # Verifica se não é o reloader do Flask (para não rodar 2x em dev)
-    if os.environ.get("WERKZEUG_RUN_MAIN") == "true" or os.environ.get("FLASK_ENV") == "production":
+    if not SCHEDULER_EMBEDDED:
+        print("ℹ️ Scheduler embutido desativado (SCHEDULER_EMBEDDED=0)")
+    elif os.environ.get("WERKZEUG_RUN_MAIN") == "true" or os.environ.get("FLASK_ENV") == "production":
         try:
             print("🚀 Iniciando Scheduler de Automação...")
-            start_scheduler()
+            start_scheduler(app)
         except Exception as e:
             print(f"❌ Erro ao iniciar Scheduler: {e}")
     else:
@@ -20,11 +42,18 @@ if __name__ == "__main__":
         if not os.environ.get("FLASK_DEBUG"):
              try:
                 print("🚀 Iniciando Scheduler de Automação (Prod)...")
-                start_scheduler()
+                start_scheduler(app)
              except:
                  pass
 
     port = int(os.environ.get("PORT", 10000))
     debug = os.environ.get("FLASK_DEBUG", "0") == "1"
+
+    # com reloader, só o processo filho (o que atende) sobe os workers do webhook
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        try:
+            start_webhook_workers(app)
+        except Exception as e:
+            print(f"❌ Erro ao iniciar workers do webhook: {e}")
     
     app.run(host="0.0.0.0", port=port, debug=debug)
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""Teste de estresse da reserva de horário: centenas de POST /api/appointments no mesmo horário.
+
+Uso: `cd backend && python stress_booking.py [reservas] [threads] [--sem-lock]`
+
+Cria uma clínica de teste (max_dentists = 2), dispara as reservas em
+paralelo para o mesmo horário e confere no banco que o horário não ficou
+com mais agendamentos do que a capacidade. `--sem-lock` desliga o lock da
+agenda (`lock_clinic_agenda`) para mostrar a corrida do SELECT + INSERT.
+
+Banco: `DATABASE_URL` se definido (use um Postgres de teste), senão um
+SQLite temporário. Sai com código 1 se houver overbooking ou erro 5xx.
+"""
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "stress_booking.db")
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.models import db, Appointment, Clinic, User  # noqa: E402
+from app.services import booking  # noqa: E402
+
+CAPACITY = 2
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    total = int(args[0]) if args else 300
+    threads = int(args[1]) if len(args) > 1 else 32
+    no_lock = "--sem-lock" in sys.argv
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        clinic = Clinic(name=f"Stress {int(time.time())}", max_dentists=CAPACITY)
+        db.session.add(clinic)
+        db.session.flush()
+        user = User(
+            name="stress", email=f"stress-{clinic.id}-{int(time.time())}@example.com",
+            password_hash="x", role="admin", clinic_id=clinic.id,
+        )
+        db.session.add(user)
+        db.session.commit()
+        clinic_id = clinic.id
+        token = create_access_token(identity=str(user.id))
+
+    if no_lock:
+        booking.lock_clinic_agenda = lambda clinic_id: None
+
+    slot = (datetime.now() + timedelta(days=3)).replace(hour=10, minute=0, second=0, microsecond=0)
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+    body = {"start": slot.isoformat(), "duration_minutes": 30, "title": "Stress"}
+
+    def book(_):
+        resp = client.post("/api/appointments", json=body, headers=headers)
+        return resp.status_code
+
+    print(f"🔥 {total} reservas em {threads} threads para {slot:%d/%m %H:%M} (capacidade {CAPACITY})"
+          f"{' — SEM lock' if no_lock else ''} | banco {os.environ['DATABASE_URL'].split(':')[0]}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        codes = Counter(pool.map(book, range(total)))
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        booked = Appointment.query.filter(
+            Appointment.clinic_id == clinic_id,
+            Appointment.start_datetime < slot + timedelta(minutes=30),
+            Appointment.end_datetime > slot,
+            Appointment.status != "cancelled",
+        ).count()
+
+    print(f"📊 status HTTP: {dict(sorted(codes.items()))}")
+    print(f"📅 agendamentos no horário: {booked} (capacidade {CAPACITY})")
+    print(f"⏱️ {elapsed:.2f}s ({total / elapsed:.0f} reservas/s)")
+
+    failed = booked > CAPACITY or any(code >= 500 for code in codes)
+    print("❌ overbooking / erro" if failed else "✅ sem overbooking")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())